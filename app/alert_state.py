@@ -0,0 +1,112 @@
+"""Trạng thái cảnh báo của agent lưu trong SQLite: cooldown theo mức độ và các điều tra đang chạy.
+
+Mỗi thay đổi được ghi nền qua writer của storage ngay khi xảy ra, nên sau khi agent khởi động lại (rollout, OOM,
+drain node) các pod vừa cảnh báo vẫn còn trong cooldown thay vì bị điều tra và cảnh báo lại cùng lúc. Cooldown
+hết hạn được xóa lười khi gặp lại pod đó (và định kỳ qua prune()); điều tra đang chạy dở lúc agent dừng được
+trả về một lần qua take_interrupted() để tiếp tục.
+"""
+import time
+import logging
+import sqlite3
+import threading
+
+
+def parse_severity_cooldowns(text):
+    """'CRITICAL=10,ERROR=30' (phút) -> {"CRITICAL": 600.0, "ERROR": 1800.0}; mục sai định dạng bị bỏ qua."""
+    cooldowns = {}
+    for item in (text or "").split(','):
+        if not item.strip(): continue
+        severity, _, minutes = item.partition('=')
+        try: cooldowns[severity.strip().upper()] = float(minutes) * 60
+        except ValueError: logging.warning(f"Ignoring invalid severity cooldown '{item.strip()}' (expected SEVERITY=minutes).")
+    return cooldowns
+
+
+class AlertState:
+    """Cooldown cảnh báo và tập điều tra đang chạy theo khóa (pod_key hoặc workload key).
+
+    `severity_cooldown_seconds` ghi đè `default_cooldown_seconds` cho từng mức độ; điều tra dở dang cũ hơn
+    `interrupted_max_age_seconds` khi nạp lại thì bị bỏ (pod có lẽ đã được phát hiện lại hoặc đã hết lỗi).
+    """
+
+    def __init__(self, db, default_cooldown_seconds=1800, severity_cooldown_seconds=None, interrupted_max_age_seconds=1800, clock=time.time):
+        self.db = db
+        self.default_cooldown_seconds = default_cooldown_seconds
+        self.severity_cooldown_seconds = dict(severity_cooldown_seconds or {})
+        self.interrupted_max_age_seconds = interrupted_max_age_seconds
+        self.clock = clock
+        self._cooldowns = {}
+        self._in_flight = {}
+        self._interrupted = {}
+        self._lock = threading.Lock()
+        self.stats = {"suppressed": 0, "expired": 0, "restored_cooldowns": 0, "restored_in_flight": 0}
+
+    def cooldown_seconds(self, severity):
+        return self.severity_cooldown_seconds.get((severity or "").upper(), self.default_cooldown_seconds)
+
+    def load(self):
+        """Xóa các mục đã hết hạn, nạp cooldown còn hiệu lực và lấy ra các điều tra dở dang của lần chạy trước."""
+        now = self.clock()
+        def load(cursor):
+            cursor.execute('DELETE FROM alert_cooldowns WHERE expires_at <= ?', (now,))
+            cooldowns = cursor.execute('SELECT key, severity, expires_at FROM alert_cooldowns').fetchall()
+            in_flight = cursor.execute('SELECT key, pod_key FROM in_flight_investigations WHERE started_at >= ?', (now - self.interrupted_max_age_seconds,)).fetchall()
+            cursor.execute('DELETE FROM in_flight_investigations')
+            return cooldowns, in_flight
+        try: cooldowns, in_flight = self.db.run(load)
+        except sqlite3.Error as e: logging.error(f"Database error loading alert state: {e}"); return
+        with self._lock:
+            for key, severity, expires_at in cooldowns: self._cooldowns[key] = (severity, expires_at)
+            self._interrupted = dict(in_flight)
+        self.stats["restored_cooldowns"] = len(cooldowns); self.stats["restored_in_flight"] = len(in_flight)
+        logging.info(f"Restored {len(cooldowns)} alert cooldowns and {len(in_flight)} interrupted investigations from the database.")
+
+    def try_start(self, key, pod_key=None):
+        """Đánh dấu bắt đầu điều tra `key`; trả về None nếu được phép, ngược lại lý do bỏ qua: "in_flight" hoặc "cooldown"."""
+        now = self.clock(); expired = False
+        with self._lock:
+            if key in self._in_flight: return "in_flight"
+            cooldown = self._cooldowns.get(key)
+            if cooldown is not None:
+                if now < cooldown[1]: self.stats["suppressed"] += 1; return "cooldown"
+                del self._cooldowns[key]; self.stats["expired"] += 1; expired = True
+            self._in_flight[key] = now
+        def write(cursor):
+            if expired: cursor.execute('DELETE FROM alert_cooldowns WHERE key = ?', (key,))
+            cursor.execute('INSERT OR REPLACE INTO in_flight_investigations (key, pod_key, started_at) VALUES (?, ?, ?)', (key, pod_key or key, now))
+        self.db.write(write)
+        return None
+
+    def finish(self, key, severity=None):
+        """Kết thúc điều tra `key`; nếu đã gửi cảnh báo (`severity`) thì bắt đầu cooldown theo mức độ đó."""
+        now = self.clock(); expires_at = None
+        with self._lock:
+            self._in_flight.pop(key, None)
+            if severity: expires_at = now + self.cooldown_seconds(severity); self._cooldowns[key] = (severity, expires_at)
+        def write(cursor):
+            cursor.execute('DELETE FROM in_flight_investigations WHERE key = ?', (key,))
+            if expires_at is not None:
+                cursor.execute('INSERT OR REPLACE INTO alert_cooldowns (key, severity, alerted_at, expires_at) VALUES (?, ?, ?, ?)', (key, severity, now, expires_at))
+        self.db.write(write)
+
+    def take_interrupted(self):
+        """{key: pod_key} của các điều tra còn dở khi agent dừng lần trước (chỉ trả về ở lần gọi đầu tiên)."""
+        with self._lock: interrupted = self._interrupted; self._interrupted = {}
+        return interrupted
+
+    def prune(self):
+        """Bỏ các cooldown đã hết hạn của những pod không còn được phát hiện lại; trả về số mục đã bỏ."""
+        now = self.clock()
+        with self._lock:
+            expired = [key for key, (_, expires_at) in self._cooldowns.items() if expires_at <= now]
+            for key in expired: del self._cooldowns[key]
+        if expired: self.db.write(lambda cursor: cursor.execute('DELETE FROM alert_cooldowns WHERE expires_at <= ?', (now,)))
+        return len(expired)
+
+    @property
+    def cooldown_count(self):
+        return len(self._cooldowns)
+
+    @property
+    def in_flight_count(self):
+        return len(self._in_flight)
@@ -0,0 +1,83 @@
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+import schema
+from log_templates import mask_message
+
+# Hậu tố do ReplicaSet/controller sinh ra trong tên pod: name-<hash>-<xxxxx> hoặc name-<xxxxx>
+# (Kubernetes chỉ dùng bảng ký tự không nguyên âm này cho các hậu tố ngẫu nhiên)
+_SAFE_CHARS = "[bcdfghjklmnpqrstvwxz2456789]"
+_POD_SUFFIX = re.compile(rf"\b([a-z0-9][-a-z0-9]*?)-(?:{_SAFE_CHARS}{{6,10}}-)?{_SAFE_CHARS}{{5}}\b")
+_NODE_LINE = re.compile(r"^(\s*Node:\s*).*$", re.MULTILINE)
+_EVENT_TIME = re.compile(r"\[[^\]]*\d{2}:\d{2}:\d{2}[^\]]*\]")
+
+
+def normalize_k8s_context(k8s_context):
+    """Bỏ các phần chỉ khác nhau giữa các replica / các lần chạy: hậu tố tên pod, tên node, thời gian, số."""
+    text = _NODE_LINE.sub(r"\1<node>", k8s_context or "")
+    text = _EVENT_TIME.sub("", text)
+    text = _POD_SUFFIX.sub(r"\1-<pod>", text)
+    return mask_message(text)
+
+
+def analysis_fingerprint(k8s_context, log_templates=None, log_batch=None):
+    """Fingerprint nội dung cho một lần phân tích: ngữ cảnh K8s đã chuẩn hóa + tập template log (hoặc các dòng của LogBatch)."""
+    if log_templates is not None: log_part = sorted({t.template for t in log_templates})
+    else: log_part = sorted({mask_message(message) for message in (log_batch.messages() if log_batch else ())})
+    digest = hashlib.sha256()
+    digest.update(normalize_k8s_context(k8s_context).encode("utf-8"))
+    for item in log_part: digest.update(b"\0"); digest.update(item.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class AnalysisCache:
+    """Cache LRU có TTL cho kết quả phân tích Gemini, lưu trong SQLite để giữ qua các lần khởi động lại."""
+
+    def __init__(self, db, ttl_seconds=3600, max_entries=1000):
+        self.db = db
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Xóa mục hết hạn và nạp các mục mới nhất vào bộ nhớ (bảng do migration schema.create_analysis_cache tạo)."""
+        cutoff = time.time() - self.ttl_seconds
+        def load(cursor):
+            schema.prune_analysis_cache(cursor, cutoff)
+            return cursor.execute('SELECT fingerprint, result, created_at FROM analysis_cache ORDER BY created_at DESC LIMIT ?', (self.max_entries,)).fetchall()
+        try: rows = self.db.run(load)
+        except sqlite3.Error as e: logging.error(f"Database error loading analysis cache: {e}"); return
+        with self._lock:
+            for fingerprint, result, created_at in reversed(rows): self._entries[fingerprint] = (json.loads(result), created_at)
+        logging.info(f"Loaded {len(rows)} analysis cache entries from the database.")
+
+    def get(self, fingerprint):
+        with self._lock:
+            item = self._entries.get(fingerprint)
+            if item is None: return None
+            result, created_at = item
+            if time.time() - created_at > self.ttl_seconds: del self._entries[fingerprint]; return None
+            self._entries.move_to_end(fingerprint)
+            return dict(result)
+
+    def put(self, fingerprint, result):
+        created_at = time.time(); evicted = []
+        with self._lock:
+            self._entries[fingerprint] = (dict(result), created_at); self._entries.move_to_end(fingerprint)
+            while len(self._entries) > self.max_entries: evicted.append(self._entries.popitem(last=False)[0])
+        result_json = json.dumps(result, ensure_ascii=False)
+        def write(cursor):
+            cursor.execute('INSERT OR REPLACE INTO analysis_cache (fingerprint, result, created_at) VALUES (?, ?, ?)', (fingerprint, result_json, created_at))
+            if evicted: cursor.executemany('DELETE FROM analysis_cache WHERE fingerprint = ?', [(fp,) for fp in evicted])
+        # Ghi nền qua writer của storage; lỗi ghi chỉ ảnh hưởng bản lưu, không ảnh hưởng cache trong bộ nhớ
+        self.db.write(write)
+
+    def __len__(self):
+        with self._lock: return len(self._entries)
@@ -0,0 +1,239 @@
+import threading
+import time
+import logging
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class DeadlineExceeded(Exception):
+    """Hết thời hạn của chu kỳ trước khi kịp lấy slot backend."""
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Circuit breaker của backend đang mở: lời gọi bị từ chối ngay, không chờ timeout."""
+
+
+class RateLimiter:
+    """Token bucket thread-safe: tối đa `rate` lần gọi/giây, cho phép burst `burst`."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.capacity = max(1.0, float(burst))
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def acquire(self, deadline=None):
+        """Chờ đến khi có token. Trả về False nếu vượt quá deadline (time.monotonic)."""
+        if self.rate <= 0: return True
+        while True:
+            with self._lock:
+                now = time.monotonic(); self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1; return True
+                wait_time = (1 - self._tokens) / self.rate
+            if deadline is not None and now + wait_time > deadline: return False
+            time.sleep(wait_time)
+
+
+class LatencyTracker:
+    """Giữ `window` độ trễ gần nhất (giây) để tính percentile."""
+
+    def __init__(self, window=200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock: self._samples.append(seconds)
+
+    def percentile(self, pct):
+        with self._lock: samples = sorted(self._samples)
+        if not samples: return None
+        return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+    def __len__(self):
+        return len(self._samples)
+
+
+class CircuitBreaker:
+    """Mở sau `failure_threshold` lỗi liên tiếp; sau `reset_timeout_seconds` cho một lời gọi thử (half-open).
+
+    Lời gọi thử thành công thì đóng lại, thất bại thì mở tiếp một chu kỳ nữa.
+    """
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout_seconds=30):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout_seconds = reset_timeout_seconds
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.times_opened = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED: return True
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout_seconds: return False
+                self.state = self.HALF_OPEN; self._probe_in_flight = False
+            # Half-open: chỉ một lời gọi thử tại một thời điểm
+            if self._probe_in_flight: return False
+            self._probe_in_flight = True; return True
+
+    def is_open(self):
+        with self._lock: return self.state == self.OPEN and time.monotonic() - self.opened_at < self.reset_timeout_seconds
+
+    def record_success(self):
+        with self._lock: self.state = self.CLOSED; self.consecutive_failures = 0; self._probe_in_flight = False
+
+    def record_failure(self):
+        """Trả về True nếu lỗi này làm circuit chuyển sang mở."""
+        with self._lock:
+            self.consecutive_failures += 1; self._probe_in_flight = False
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.consecutive_failures >= self.failure_threshold):
+                self.state = self.OPEN; self.opened_at = time.monotonic(); self.times_opened += 1; return True
+            return False
+
+
+class Backend:
+    """Giới hạn số lời gọi đồng thời và tốc độ gọi cho một backend (K8s, Loki, Gemini, Telegram).
+
+    Backend HTTP còn có session dùng lại kết nối, timeout thích ứng theo percentile độ trễ
+    (`timeout_multiplier` x p99, kẹp trong [min_timeout, max_timeout]) và circuit breaker.
+    """
+
+    def __init__(self, name, max_concurrency, rate_per_second, burst=1, min_timeout=5.0, max_timeout=60.0, timeout_multiplier=3.0,
+                 failure_threshold=5, reset_timeout_seconds=30):
+        self.name = name
+        self.max_concurrency = max(1, int(max_concurrency))
+        self._semaphore = threading.BoundedSemaphore(self.max_concurrency)
+        self._limiter = RateLimiter(rate_per_second, burst)
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.timeout_multiplier = timeout_multiplier
+        self.latency = LatencyTracker()
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout_seconds)
+        self._session = None
+        self._in_flight = 0
+        self.stats = {"calls": 0, "errors": 0, "timeouts": 0, "rejected": 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, **values):
+        with self._stats_lock:
+            for key, value in values.items(): self.stats[key] += value
+
+    @property
+    def session(self):
+        # Pool kết nối bằng số lời gọi đồng thời tối đa, để không lời gọi nào phải mở kết nối mới
+        if self._session is None:
+            session = requests.Session(); adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_concurrency)
+            session.mount("https://", adapter); session.mount("http://", adapter); self._session = session
+        return self._session
+
+    def timeout(self, deadline=None):
+        """Timeout cho lời gọi kế tiếp: dựa trên p99 gần đây, không vượt quá phần còn lại của deadline."""
+        p99 = self.latency.percentile(99) if len(self.latency) >= 20 else None
+        timeout = self.max_timeout if p99 is None else min(self.max_timeout, max(self.min_timeout, p99 * self.timeout_multiplier))
+        if deadline is not None: timeout = max(0.1, min(timeout, deadline - time.monotonic()))
+        return timeout
+
+    def available(self):
+        return not self.breaker.is_open()
+
+    def call(self, func, deadline=None):
+        """Chạy func(timeout) qua circuit breaker và ghi nhận độ trễ; không giữ slot (xem slot()/request())."""
+        if not self.breaker.allow():
+            self._count(rejected=1); raise CircuitOpenError(f"{self.name} circuit breaker is open")
+        timeout = self.timeout(deadline); start = time.monotonic()
+        with self._stats_lock: self._in_flight += 1
+        try: result = func(timeout)
+        except Exception as e:
+            is_timeout = isinstance(e, requests.exceptions.Timeout) or "timeout" in type(e).__name__.lower() or "deadline" in type(e).__name__.lower()
+            self._count(calls=1, errors=1, timeouts=1 if is_timeout else 0)
+            self._record_failure(e); raise
+        finally:
+            with self._stats_lock: self._in_flight -= 1
+        self.latency.record(time.monotonic() - start); self._count(calls=1)
+        status = getattr(result, "status_code", 200)
+        # 5xx / 429: backend quá tải hoặc đang lỗi; 4xx khác là lỗi của truy vấn nên không tính
+        if status >= 500 or status == 429: self._count(errors=1); self._record_failure(f"HTTP {status}")
+        else: self.breaker.record_success()
+        return result
+
+    def _record_failure(self, error):
+        if self.breaker.record_failure():
+            logging.error(f"Circuit breaker for backend '{self.name}' opened after {self.breaker.consecutive_failures} consecutive failures "
+                          f"(last: {error}); rejecting calls for {self.breaker.reset_timeout_seconds}s.")
+
+    def request(self, method, url, deadline=None, timeout=None, **kwargs):
+        """HTTP request qua session chung, trong slot của backend; `timeout` (nếu có) là trần của timeout thích ứng."""
+        # Từ chối trước khi chờ slot / rate limit để lời gọi tới backend đang hỏng không tốn thời gian
+        if not self.available():
+            self._count(rejected=1); raise CircuitOpenError(f"{self.name} circuit breaker is open")
+        with self.slot(deadline):
+            return self.call(lambda adaptive: self.session.request(method, url, timeout=adaptive if timeout is None else min(timeout, adaptive), **kwargs), deadline)
+
+    def get(self, url, **kwargs):
+        # Giao diện kiểu requests.get để truyền Backend thay cho session (ví dụ LokiCursorIngestor)
+        return self.request("GET", url, **kwargs)
+
+    def health(self):
+        """Số liệu sức khỏe của backend: trạng thái circuit, độ trễ, timeout hiện tại và các bộ đếm."""
+        to_ms = lambda seconds: None if seconds is None else round(seconds * 1000, 1)
+        with self._stats_lock: stats = dict(self.stats); in_flight = self._in_flight
+        return {"name": self.name, "state": self.breaker.state, "consecutive_failures": self.breaker.consecutive_failures,
+                "times_opened": self.breaker.times_opened, "p50_ms": to_ms(self.latency.percentile(50)), "p95_ms": to_ms(self.latency.percentile(95)),
+                "p99_ms": to_ms(self.latency.percentile(99)), "timeout_ms": to_ms(self.timeout()), "in_flight": in_flight, **stats}
+
+    def acquire(self, deadline=None):
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        if not self._semaphore.acquire(timeout=timeout):
+            raise DeadlineExceeded(f"Timed out waiting for a {self.name} slot")
+        if not self._limiter.acquire(deadline):
+            self._semaphore.release()
+            raise DeadlineExceeded(f"Timed out waiting for {self.name} rate limit")
+
+    def release(self):
+        self._semaphore.release()
+
+    def slot(self, deadline=None):
+        return _BackendSlot(self, deadline)
+
+
+class _BackendSlot:
+    def __init__(self, backend, deadline):
+        self.backend = backend; self.deadline = deadline
+
+    def __enter__(self):
+        self.backend.acquire(self.deadline); return self.backend
+
+    def __exit__(self, exc_type, exc, tb):
+        self.backend.release(); return False
+
+
+def check_deadline(deadline, stage=""):
+    """Ném DeadlineExceeded nếu đã quá deadline của chu kỳ."""
+    if deadline is not None and time.monotonic() >= deadline:
+        raise DeadlineExceeded(f"Cycle deadline exceeded before stage '{stage}'")
+
+
+def build_backends(limits, timeouts=None, failure_threshold=5, reset_timeout_seconds=30):
+    """Tạo dict backend từ cấu hình dạng {name: (max_concurrency, rate_per_second)}.
+
+    `timeouts` là {name: (min_timeout, max_timeout)} cho các backend dùng timeout thích ứng.
+    """
+    backends = {}; timeouts = timeouts or {}
+    for name, (max_concurrency, rate_per_second) in limits.items():
+        min_timeout, max_timeout = timeouts.get(name, (5.0, 60.0))
+        backends[name] = Backend(name, max_concurrency, rate_per_second, burst=max_concurrency, min_timeout=min_timeout, max_timeout=max_timeout,
+                                 failure_threshold=failure_threshold, reset_timeout_seconds=reset_timeout_seconds)
+        logging.info(f"Backend '{name}': max_concurrency={max_concurrency}, rate={rate_per_second}/s, timeout={min_timeout}-{max_timeout}s")
+    return backends
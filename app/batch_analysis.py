@@ -0,0 +1,133 @@
+import re
+import json
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from backends import DeadlineExceeded
+from model_client import estimate_tokens
+
+SEVERITIES = ("INFO", "WARNING", "ERROR", "CRITICAL")
+# Ước lượng token phản hồi cho mỗi pod trong batch (severity + summary 1-2 câu)
+OUTPUT_TOKENS_PER_ITEM = 160
+
+
+def build_batch_prompt(items):
+    """Prompt phân tích nhiều pod một lần; items là danh sách (item_id, k8s_context, log_text)."""
+    sections = "".join(f"=== POD id={item_id} ===\nNgữ cảnh Kubernetes:\n{k8s_context}\nCác dòng log:\n{log_text}\n" for item_id, k8s_context, log_text in items)
+    return f"""
+    Phân tích tình huống của {len(items)} pod Kubernetes độc lập dưới đây. Mỗi pod bắt đầu bằng dòng "=== POD id=<id> ===".
+    Với từng pod, **ưu tiên xem xét ngữ cảnh Kubernetes** rồi kết hợp với các dòng log (nếu có; nếu đã gom nhóm thì mỗi mục là một mẫu log kèm số lần lặp [xN], thời điểm đầu/cuối và một dòng ví dụ).
+    Xác định mức độ nghiêm trọng tổng thể (chọn một: INFO, WARNING, ERROR, CRITICAL).
+    Nếu mức độ nghiêm trọng là WARNING, ERROR hoặc CRITICAL, hãy cung cấp một bản tóm tắt ngắn gọn (1-2 câu) bằng **tiếng Việt** giải thích vấn đề cốt lõi của pod đó.
+    Không trộn thông tin giữa các pod.
+    Chỉ trả lời bằng một mảng JSON, mỗi pod một phần tử với các khóa "id", "severity" và "summary". Ví dụ: [{{"id": "p1", "severity": "CRITICAL", "summary": "Container bị OOMKilled."}}, {{"id": "p2", "severity": "INFO", "summary": ""}}]
+--- START PODS ---
+{sections}--- END PODS ---
+"""
+
+
+def parse_batch_response(response_text, expected_ids):
+    """Tách mảng JSON trả về thành {item_id: {"severity", "summary"}}; phần tử sai định dạng hoặc id lạ bị bỏ qua."""
+    if not response_text: return {}
+    match = re.search(r'\[.*\]', response_text, re.DOTALL)
+    try: items = json.loads(match.group(0) if match else response_text)
+    except json.JSONDecodeError as e: logging.warning(f"Failed to decode batched Gemini response as JSON: {e}"); return {}
+    if not isinstance(items, list): return {}
+    expected = set(expected_ids); results = {}
+    for item in items:
+        if not isinstance(item, dict): continue
+        item_id = str(item.get("id")); severity = str(item.get("severity", "")).upper(); summary = item.get("summary", "")
+        if item_id not in expected or item_id in results or severity not in SEVERITIES or not isinstance(summary, str): continue
+        results[item_id] = {"severity": severity, "summary": summary}
+    return results
+
+
+class _BatchItem:
+    __slots__ = ("item_id", "k8s_context", "log_text", "deadline", "tokens", "future")
+
+    def __init__(self, item_id, k8s_context, log_text, deadline=None):
+        self.item_id = item_id; self.k8s_context = k8s_context; self.log_text = log_text; self.deadline = deadline
+        self.tokens = estimate_tokens(k8s_context) + estimate_tokens(log_text) + OUTPUT_TOKENS_PER_ITEM
+        self.future = Future()
+
+
+class BatchAnalyzer:
+    """Gom các yêu cầu phân tích từ nhiều worker điều tra thành một lần gọi model.
+
+    Luồng dispatcher chờ tối đa `window_seconds` sau yêu cầu đầu tiên để gom thêm, dừng khi đủ
+    `max_items` hoặc vượt `token_budget` (ước lượng cả token prompt lẫn phản hồi). Batch chỉ có
+    một pod, hoặc pod mà model trả thiếu/sai định dạng, nhận None để worker phân tích riêng lẻ.
+    `call_model(prompt, max_output_tokens, deadline)` trả về văn bản phản hồi (hoặc None) và chịu trách
+    nhiệm giới hạn đồng thời / tốc độ phía backend; `deadline` là deadline muộn nhất của các pod trong batch.
+    """
+
+    def __init__(self, call_model, token_budget=24000, max_items=8, window_seconds=1.0, max_parallel_batches=2):
+        self.call_model = call_model
+        self.token_budget = token_budget
+        self.max_items = max(1, max_items)
+        self.window_seconds = window_seconds
+        self._queue = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=max_parallel_batches, thread_name_prefix="gemini-batch")
+        self._thread = None
+        self.stats = {"batches": 0, "items_batched": 0, "items_missing": 0, "items_timed_out": 0}
+        self._stats_lock = threading.Lock()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="gemini-batcher", daemon=True); self._thread.start()
+        return self
+
+    def submit(self, item_id, k8s_context, log_text, deadline=None):
+        """Đưa một pod vào batch và chờ kết quả; trả về None nếu pod cần được phân tích riêng.
+
+        Ném DeadlineExceeded nếu batch chưa có kết quả khi tới `deadline` (time.monotonic()) của chu kỳ.
+        """
+        item = _BatchItem(item_id, k8s_context, log_text, deadline)
+        if self._thread is None or item.tokens > self.token_budget: return None
+        self._queue.put(item)
+        try: return item.future.result(timeout=None if deadline is None else max(0.0, deadline - time.monotonic()))
+        except FutureTimeoutError:
+            # Pod chưa được gửi đi thì bỏ khỏi batch; batch đang chạy thì kết quả của pod này bị bỏ qua
+            item.future.cancel()
+            with self._stats_lock: self.stats["items_timed_out"] += 1
+            raise DeadlineExceeded(f"Cycle deadline exceeded waiting for batched Gemini analysis of '{item_id}'")
+
+    def _collect(self, first):
+        batch = [first]; tokens = first.tokens; carry = None
+        deadline = time.monotonic() + self.window_seconds
+        while len(batch) < self.max_items:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0: break
+            try: item = self._queue.get(timeout=remaining)
+            except queue.Empty: break
+            if tokens + item.tokens > self.token_budget: carry = item; break
+            batch.append(item); tokens += item.tokens
+        return batch, carry
+
+    def _run(self):
+        carry = None
+        while True:
+            first = carry if carry is not None else self._queue.get()
+            batch, carry = self._collect(first)
+            # Bỏ các pod mà worker đã thôi chờ (quá deadline); sau bước này future không còn bị hủy được nữa
+            batch = [item for item in batch if item.future.set_running_or_notify_cancel()]
+            if not batch: continue
+            if len(batch) == 1: batch[0].future.set_result(None); continue
+            self._executor.submit(self._process, batch)
+
+    def _process(self, batch):
+        ids = [f"p{i}" for i in range(1, len(batch) + 1)]; results = {}
+        try:
+            prompt = build_batch_prompt([(item_id, item.k8s_context, item.log_text) for item_id, item in zip(ids, batch)])
+            logging.info(f"Sending batched analysis for {len(batch)} pods ({len(prompt)} chars) to Gemini...")
+            deadline = None if any(item.deadline is None for item in batch) else max(item.deadline for item in batch)
+            results = parse_batch_response(self.call_model(prompt, OUTPUT_TOKENS_PER_ITEM * len(batch), deadline), ids)
+        except Exception as e: logging.error(f"Error in batched Gemini analysis: {e}", exc_info=True)
+        missing = len(batch) - len(results)
+        if missing: logging.warning(f"Batched Gemini response covered {len(results)}/{len(batch)} pods; falling back to single analysis for the rest.")
+        with self._stats_lock:
+            self.stats["batches"] += 1; self.stats["items_batched"] += len(results); self.stats["items_missing"] += missing
+        for item_id, item in zip(ids, batch): item.future.set_result(results.get(item_id))
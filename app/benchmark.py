@@ -0,0 +1,363 @@
+"""Microbenchmark cho các đường nóng của agent, chạy offline không cần cluster.
+
+Ví dụ: python app/benchmark.py classifier --lines 200000
+       python app/benchmark.py batch --pods 64 --latency 0.5
+       python app/benchmark.py storage --incidents 2000 --readers 4
+       python app/benchmark.py telegram --alerts 50 --rate-limit-every 10
+       python app/benchmark.py sharding --replicas 4 --keys 200
+       python app/benchmark.py logbatch --pods 200 --lines-per-pod 2000
+"""
+import os
+import gc
+import json
+import argparse
+import requests
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from backends import Backend
+from batch_analysis import BatchAnalyzer
+from log_classifier import LogClassifier, level_index
+from logbatch import LogBatch
+from notifier import TelegramNotifier
+from sharding import LeaseCoordinator
+import storage
+
+SAMPLE_LINES = [
+    "2024-05-01T10:00:00Z INFO Started server on :8080",
+    "level=info msg=\"request served\" path=/healthz status=200",
+    '{"level":"error","msg":"connection refused","upstream":"db:5432"}',
+    "[WARNING] disk usage at 91% on /var/lib/data",
+    "ERROR: failed to load configuration file /etc/app/config.yaml",
+    "panic: runtime error: invalid memory address or nil pointer dereference",
+    "java.lang.NullPointerException at com.example.Service.handle(Service.java:42)",
+    "DEBUG cache hit ratio=0.93",
+    "upstream service unavailable, retrying in 5s",
+    "GET /api/v1/orders 200 12ms",
+]
+
+
+def synthetic_lines(count, seed=42):
+    rng = random.Random(seed)
+    return [f"{rng.choice(SAMPLE_LINES)} id={i}" for i in range(count)]
+
+
+def legacy_preprocess_and_filter(messages, min_level="WARNING"):
+    """Bản cài đặt cũ của preprocess_and_filter (chỉ phần phân loại), giữ lại để so sánh."""
+    filtered = []
+    log_levels = ["DEBUG", "INFO", "NOTICE", "WARNING", "ERROR", "CRITICAL", "ALERT", "EMERGENCY"]
+    min_level_index = log_levels.index(min_level)
+    keywords_indicating_problem = ["FAIL", "ERROR", "CRASH", "EXCEPTION", "UNAVAILABLE", "FATAL", "PANIC"]
+    for log_line in messages:
+        log_line_upper = log_line.upper(); level_detected = False
+        for i, level in enumerate(log_levels):
+            if f" {level} " in f" {log_line_upper} " or log_line_upper.startswith(level+":") or f"[{level}]" in log_line_upper or f"level={level.lower()}" in log_line_upper or f"\"level\":\"{level.lower()}\"" in log_line_upper:
+                if i >= min_level_index: filtered.append(log_line); level_detected = True; break
+        if not level_detected:
+            if any(keyword in log_line_upper for keyword in keywords_indicating_problem):
+                if min_level_index <= log_levels.index("WARNING"): filtered.append(log_line)
+    return filtered
+
+
+def _timed(func, repeat):
+    best = float("inf"); result = None
+    for _ in range(repeat):
+        start = time.perf_counter(); result = func(); best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def bench_classifier(args):
+    messages = synthetic_lines(args.lines)
+    classifier = LogClassifier(); min_index = level_index(args.min_level)
+    legacy_time, legacy_result = _timed(lambda: legacy_preprocess_and_filter(messages, args.min_level), args.repeat)
+    new_time, new_indexes = _timed(lambda: classifier.filter_batch(messages, min_index), args.repeat)
+    print(f"lines={len(messages)} min_level={args.min_level}")
+    print(f"legacy  : {legacy_time:.3f}s ({len(messages) / legacy_time:,.0f} lines/s) kept={len(legacy_result)}")
+    print(f"compiled: {new_time:.3f}s ({len(messages) / new_time:,.0f} lines/s) kept={len(new_indexes)}")
+    print(f"speedup : {legacy_time / new_time:.2f}x")
+
+
+SAMPLE_REASONS = ["OOMKilled", "CrashLoopBackOff", "ImagePullBackOff", "Unschedulable", "Completed"]
+
+
+def synthetic_contexts(count, seed=42):
+    rng = random.Random(seed); contexts = []
+    for i in range(count):
+        reason = rng.choice(SAMPLE_REASONS)
+        context = f"Pod: default/app-{i}\n  Trạng thái: Running\n  Container 'app': State=Waiting, Reason={reason}, Restarts={rng.randint(0, 20)}\n"
+        contexts.append((f"default/app-{i}", context, "\n".join(synthetic_lines(rng.randint(5, 40), seed=i))))
+    return contexts
+
+
+def bench_batch(args):
+    from fakes import FakeModelClient  # chỉ các benchmark cần backend giả mới import fakes
+    contexts = synthetic_contexts(args.pods)
+
+    def run(batched):
+        model = FakeModelClient(args.latency, args.per_item_latency, args.drop_every)
+        backend = Backend("gemini", args.concurrency, args.rate, burst=args.concurrency)
+
+        def call_model(prompt, max_output_tokens, deadline=None):
+            with backend.slot(deadline): return model.generate(prompt, max_output_tokens, json_response=True).text
+
+        def single(context, log_text):
+            prompt = f"--- START CONTEXT ---\n{context}\n--- END CONTEXT ---\n--- START LOGS ---\n{log_text}\n--- END LOGS ---"
+            with backend.slot(): return model.generate(prompt).text
+
+        analyzer = BatchAnalyzer(call_model, args.token_budget, args.max_items, args.window, max_parallel_batches=args.concurrency).start() if batched else None
+
+        def analyze(item):
+            pod_key, context, log_text = item
+            result = analyzer.submit(pod_key, context, log_text) if analyzer else None
+            return result if result is not None else single(context, log_text)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.workers) as executor: results = list(executor.map(analyze, contexts))
+        return time.perf_counter() - start, model.calls, sum(1 for r in results if r is not None)
+
+    single_time, single_calls, single_done = run(False)
+    batch_time, batch_calls, batch_done = run(True)
+    print(f"pods={args.pods} workers={args.workers} latency={args.latency}s+{args.per_item_latency}s/pod concurrency={args.concurrency} rate={args.rate}/s")
+    print(f"single : {single_time:.2f}s calls={single_calls} analyzed={single_done} ({args.pods / single_time:.1f} pods/s)")
+    print(f"batched: {batch_time:.2f}s calls={batch_calls} analyzed={batch_done} ({args.pods / batch_time:.1f} pods/s)")
+    print(f"speedup: {single_time / batch_time:.2f}x, calls saved: {single_calls - batch_calls}")
+
+
+INCIDENT_SCHEMA = ''' CREATE TABLE IF NOT EXISTS incidents (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp TEXT NOT NULL, pod_key TEXT NOT NULL,
+    severity TEXT NOT NULL, summary TEXT, initial_reasons TEXT, k8s_context TEXT, sample_logs TEXT ) '''
+INCIDENT_INSERT = ''' INSERT INTO incidents (timestamp, pod_key, severity, summary, initial_reasons, k8s_context, sample_logs)
+                      VALUES (?, ?, ?, ?, ?, ?, ?) '''
+PORTAL_QUERY = ''' SELECT id, timestamp, pod_key, severity, summary, initial_reasons FROM incidents ORDER BY timestamp DESC LIMIT 100 '''
+
+
+def _incident_row(i):
+    return (f"2024-05-01T10:{i // 60 % 60:02d}:{i % 60:02d}+00:00", f"default/app-{i % 50}", "ERROR", "Container bị OOMKilled.",
+            "K8s: Restarts=7", "Pod: default/app\n" + "x" * 2000, "\n".join(synthetic_lines(5, seed=i)))
+
+
+def _percentile(values, pct):
+    if not values: return 0.0
+    values = sorted(values); return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def _run_readers(connect_reader, count, stop):
+    latencies = []; lock = threading.Lock()
+
+    def reader():
+        conn = connect_reader(); local = []
+        while not stop.is_set():
+            start = time.perf_counter()
+            try: conn.execute(PORTAL_QUERY).fetchall(); local.append(time.perf_counter() - start)
+            except sqlite3.OperationalError: local.append(time.perf_counter() - start)
+            time.sleep(0.005)
+        with lock: latencies.extend(local)
+
+    threads = [threading.Thread(target=reader) for _ in range(count)]
+    for thread in threads: thread.start()
+    return threads, latencies
+
+
+def bench_storage(args):
+    rows = [_incident_row(i) for i in range(args.incidents)]
+
+    def legacy(db_path):
+        # Cách cũ: mở kết nối mới, ghi và commit cho từng incident, journal mặc định (rollback)
+        conn = sqlite3.connect(db_path); conn.execute(INCIDENT_SCHEMA); conn.commit(); conn.close()
+        stop = threading.Event(); threads, latencies = _run_readers(lambda: sqlite3.connect(db_path, timeout=5, check_same_thread=False), args.readers, stop)
+        lock = threading.Lock()
+
+        def insert(row):
+            with lock:
+                conn = sqlite3.connect(db_path, timeout=10); conn.execute(INCIDENT_INSERT, row); conn.commit(); conn.close()
+
+        start = time.perf_counter()
+        workers = [threading.Thread(target=lambda part=part: [insert(row) for row in part]) for part in (rows[i::args.writers] for i in range(args.writers))]
+        for worker in workers: worker.start()
+        for worker in workers: worker.join()
+        elapsed = time.perf_counter() - start; stop.set()
+        for thread in threads: thread.join()
+        return elapsed, latencies
+
+    def batched(db_path):
+        db = storage.Storage(db_path).open(); db.run(lambda cursor: cursor.execute(INCIDENT_SCHEMA))
+        stop = threading.Event(); threads, latencies = _run_readers(lambda: storage.connect(db_path, readonly=True), args.readers, stop)
+        start = time.perf_counter()
+        workers = [threading.Thread(target=lambda part=part: [db.write(lambda cursor, row=row: cursor.execute(INCIDENT_INSERT, row)) for row in part]) for part in (rows[i::args.writers] for i in range(args.writers))]
+        for worker in workers: worker.start()
+        for worker in workers: worker.join()
+        db.flush(); elapsed = time.perf_counter() - start; stop.set()
+        for thread in threads: thread.join()
+        commits = db.stats["commits"]; db.close()
+        return elapsed, latencies, commits
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_time, legacy_latencies = legacy(os.path.join(tmp, "legacy.db"))
+        batch_time, batch_latencies, commits = batched(os.path.join(tmp, "wal.db"))
+    print(f"incidents={args.incidents} writers={args.writers} readers={args.readers}")
+    for name, elapsed, latencies in (("per-row", legacy_time, legacy_latencies), ("wal+batch", batch_time, batch_latencies)):
+        print(f"{name:9}: {elapsed:.2f}s ({args.incidents / elapsed:,.0f} inserts/s), portal query p50={_percentile(latencies, 50) * 1000:.1f}ms "
+              f"p99={_percentile(latencies, 99) * 1000:.1f}ms over {len(latencies)} reads")
+    print(f"group commits: {commits}, insert speedup: {legacy_time / batch_time:.2f}x")
+
+
+def bench_telegram(args):
+    from fakes import FakeTelegramServer
+    alerts = [f"🚨 *Cảnh báo K8s/Log (Pod: default/app-{i})* 🚨\n*Mức độ:* `ERROR`\n*Tóm tắt:* Container bị OOMKilled." for i in range(args.alerts)]
+
+    def legacy(url):
+        # Cách cũ: requests.post chặn worker cho từng cảnh báo, không retry
+        start = time.perf_counter(); blocked = 0.0
+        for text in alerts:
+            call_start = time.perf_counter()
+            try: requests.post(f"{url}/botTOKEN/sendMessage", json={"chat_id": "1", "text": text}, timeout=10).raise_for_status()
+            except requests.exceptions.RequestException: pass
+            blocked += time.perf_counter() - call_start
+        return time.perf_counter() - start, blocked
+
+    def queued(url):
+        notifier = TelegramNotifier("TOKEN", url, args.window, max_retries=args.retries, backoff_seconds=0.1).start()
+        start = time.perf_counter(); blocked = 0.0
+        for text in alerts:
+            call_start = time.perf_counter(); notifier.submit(text, "1"); blocked += time.perf_counter() - call_start
+        notifier.close(timeout=120)
+        return time.perf_counter() - start, blocked, notifier.stats
+
+    results = {}
+    for name, run in (("blocking", legacy), ("queued", queued)):
+        server = FakeTelegramServer(args.rate_limit_every, args.retry_after, args.fail_every, args.latency).start()
+        results[name] = (run(server.url), server.requests, len(server.messages), sum(message["text"].count("Cảnh báo K8s/Log") for message in server.messages))
+        server.stop()
+    print(f"alerts={args.alerts} latency={args.latency}s rate_limit_every={args.rate_limit_every} fail_every={args.fail_every}")
+    for name, (run_result, requests_made, messages, delivered) in results.items():
+        print(f"{name:8}: {run_result[0]:.2f}s total, worker blocked {run_result[1] * 1000:.1f}ms, HTTP requests={requests_made}, messages={messages}, alerts delivered={delivered}/{args.alerts}")
+    print(f"notifier stats: {results['queued'][0][2]}")
+
+
+def bench_sharding(args):
+    from fakes import FakeLeaseApi
+    # Đồng hồ giả: replica "chết" bằng cách ngừng gia hạn rồi cho thời gian trôi quá thời hạn Lease
+    now = [datetime.now(timezone.utc)]; api = FakeLeaseApi(); keys = [f"ns-{i}" for i in range(args.keys)]
+    replicas = {}
+
+    def join(name):
+        replicas[name] = LeaseCoordinator(api, "kube-observability", name, lease_duration_seconds=args.lease_duration, vnodes=args.vnodes, clock=lambda: now[0])
+
+    def settle(seconds=0.0):
+        now[0] += timedelta(seconds=seconds)
+        for _ in range(2):
+            for coordinator in replicas.values(): coordinator.refresh()
+
+    def assignment():
+        owners = {key: [name for name, coordinator in replicas.items() if coordinator.owns(key)] for key in keys}
+        unowned = sum(1 for names in owners.values() if not names); duplicated = sum(1 for names in owners.values() if len(names) > 1)
+        return {key: names[0] for key, names in owners.items() if names}, unowned, duplicated
+
+    def report(label, before, after):
+        _, unowned, duplicated = assignment(); counts = {name: sum(1 for owner in after.values() if owner == name) for name in replicas}
+        moved = sum(1 for key in keys if before.get(key) != after.get(key))
+        print(f"{label:24} replicas={len(replicas)} keys/replica min={min(counts.values())} max={max(counts.values())} moved={moved} "
+              f"(ideal ~{args.keys // max(1, len(replicas))}) unowned={unowned} duplicated={duplicated}")
+
+    for i in range(args.replicas): join(f"agent-{i}")
+    settle(); current = assignment()[0]; report("initial", current, current)
+    join(f"agent-{args.replicas}"); settle(); after = assignment()[0]; report("replica joined", current, after); current = after
+    dead = replicas.pop("agent-0")
+    settle(args.lease_duration / 2); _, unowned, _ = assignment()
+    print(f"{'agent-0 died':24} before lease expiry: keys still assigned to the dead replica={sum(1 for owner in current.values() if owner == 'agent-0')}, unowned now={unowned}")
+    settle(args.lease_duration); after = assignment()[0]; report("after lease expiry", current, after); current = after
+    replicas["agent-0"] = dead; settle(); after = assignment()[0]; report("agent-0 rejoined", current, after)
+
+
+def synthetic_loki_response(pods, lines_per_pod, seed=42):
+    """Phản hồi query_range giả (JSON bytes) với mỗi pod một stream, như kết quả quét Loki."""
+    rng = random.Random(seed); start_ns = time.time_ns() - 3600 * 10**9; streams = []
+    for p in range(pods):
+        labels = {"namespace": f"ns-{p % 10}", "pod": f"app-{p}-7d9f8c6b5-x{p:04d}", "container": "app", "app": f"app-{p}", "job": f"ns-{p % 10}/app-{p}"}
+        values = [[str(start_ns + i * 1000000), f"{rng.choice(SAMPLE_LINES)} id={p}-{i}"] for i in range(lines_per_pod)]
+        streams.append({"stream": labels, "values": values})
+    return json.dumps({"status": "success", "data": {"resultType": "streams", "result": streams}}).encode("utf-8")
+
+
+def legacy_log_entries(result):
+    """Biểu diễn cũ: mỗi dòng một dict (datetime, chuỗi, dict label của stream, level), giữ lại để so sánh."""
+    logs_by_pod = {}
+    for stream in result:
+        labels = stream["stream"]; entries = logs_by_pod.setdefault(f"{labels['namespace']}/{labels['pod']}", [])
+        for ts, line in stream["values"]: entries.append({"timestamp": datetime.fromtimestamp(int(ts) / 1e9, tz=timezone.utc), "message": line.strip(), "labels": labels, "level": None})
+    return logs_by_pod
+
+
+def log_batches(result, max_lines_per_pod):
+    logs_by_pod = {}
+    for stream in result:
+        labels = stream["stream"]; pod_key = f"{labels['namespace']}/{labels['pod']}"; batch = logs_by_pod.get(pod_key)
+        if batch is None: batch = logs_by_pod[pod_key] = LogBatch(max_lines_per_pod)
+        label_id = batch.add_labels(labels)
+        for ts, line in stream["values"]: batch.append(int(ts), line, label_id)
+    return logs_by_pod
+
+
+def _retained(build, raw):
+    """(kết quả, bộ nhớ còn giữ sau khi bỏ phản hồi đã parse, đỉnh bộ nhớ) đo bằng tracemalloc."""
+    gc.collect(); tracemalloc.start()
+    data = json.loads(raw); result = build(data["data"]["result"]); del data; gc.collect()
+    current, peak = tracemalloc.get_traced_memory(); tracemalloc.stop()
+    return result, current, peak
+
+
+def bench_logbatch(args):
+    raw = synthetic_loki_response(args.pods, args.lines_per_pod); lines = args.pods * args.lines_per_pod
+    print(f"pods={args.pods} lines={lines} response={len(raw) / 1e6:.1f}MB max_lines_per_pod={args.max_lines_per_pod or 'unlimited'}")
+    builders = [("dict entries", legacy_log_entries), ("LogBatch", lambda result: log_batches(result, args.max_lines_per_pod))]
+    retained_by_name = {}
+    for name, build in builders:
+        parsed = json.loads(raw)["data"]["result"]; build_time, _ = _timed(lambda: build(parsed), args.repeat); del parsed
+        logs_by_pod, retained, peak = _retained(build, raw); kept = sum(len(logs) for logs in logs_by_pod.values())
+        dropped = sum(logs.dropped for logs in logs_by_pod.values() if isinstance(logs, LogBatch))
+        retained_by_name[name] = retained
+        print(f"{name:13}: build={build_time:.3f}s retained={retained / 1e6:.1f}MB ({retained / max(1, kept):.0f} B/line) peak={peak / 1e6:.1f}MB kept={kept} dropped={dropped}")
+        del logs_by_pod
+    print(f"memory ratio : {retained_by_name['dict entries'] / max(1, retained_by_name['LogBatch']):.1f}x less retained with LogBatch")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+    p = subparsers.add_parser("classifier", help="preprocess_and_filter cũ so với LogClassifier")
+    p.add_argument("--lines", type=int, default=100000); p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--min-level", default="WARNING"); p.set_defaults(func=bench_classifier)
+    p = subparsers.add_parser("batch", help="phân tích từng pod so với gom batch (model giả)")
+    p.add_argument("--pods", type=int, default=64); p.add_argument("--workers", type=int, default=16)
+    p.add_argument("--latency", type=float, default=0.5); p.add_argument("--per-item-latency", type=float, default=0.05)
+    p.add_argument("--concurrency", type=int, default=4); p.add_argument("--rate", type=float, default=4)
+    p.add_argument("--token-budget", type=int, default=24000); p.add_argument("--max-items", type=int, default=8)
+    p.add_argument("--window", type=float, default=0.2); p.add_argument("--drop-every", type=int, default=0)
+    p.set_defaults(func=bench_batch)
+    p = subparsers.add_parser("storage", help="ghi incident từng dòng so với WAL + group commit, kèm độ trễ đọc của portal")
+    p.add_argument("--incidents", type=int, default=2000); p.add_argument("--writers", type=int, default=4)
+    p.add_argument("--readers", type=int, default=4); p.set_defaults(func=bench_storage)
+    p = subparsers.add_parser("telegram", help="gửi cảnh báo chặn từng cái so với hàng đợi + digest + retry (Telegram giả)")
+    p.add_argument("--alerts", type=int, default=50); p.add_argument("--latency", type=float, default=0.05)
+    p.add_argument("--rate-limit-every", type=int, default=10); p.add_argument("--retry-after", type=int, default=1)
+    p.add_argument("--fail-every", type=int, default=0); p.add_argument("--window", type=float, default=0.5)
+    p.add_argument("--retries", type=int, default=5); p.set_defaults(func=bench_telegram)
+    p = subparsers.add_parser("sharding", help="phân chia namespace giữa các replica qua Lease giả: độ cân bằng và số khóa đổi chủ")
+    p.add_argument("--replicas", type=int, default=4); p.add_argument("--keys", type=int, default=200)
+    p.add_argument("--vnodes", type=int, default=64); p.add_argument("--lease-duration", type=int, default=30)
+    p.set_defaults(func=bench_sharding)
+    p = subparsers.add_parser("logbatch", help="bộ nhớ giữ lại của log dạng dict mỗi dòng so với LogBatch dạng cột")
+    p.add_argument("--pods", type=int, default=200); p.add_argument("--lines-per-pod", type=int, default=2000)
+    p.add_argument("--max-lines-per-pod", type=int, default=0); p.add_argument("--repeat", type=int, default=1)
+    p.set_defaults(func=bench_logbatch)
+    args = parser.parse_args(); args.func(args)
+
+
+if __name__ == "__main__":
+    main()
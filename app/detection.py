@@ -0,0 +1,108 @@
+import threading
+import time
+import logging
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from logbatch import LogBatch
+
+WAITING_REASONS = ("CrashLoopBackOff", "ImagePullBackOff", "ErrImagePull")
+TERMINATED_REASONS = ("OOMKilled", "Error", "ContainerCannotRun")
+
+
+class InvestigationQueue:
+    """Hàng đợi công việc điều tra, gộp các mục trùng pod_key cho đến khi được lấy ra.
+
+    Log của mỗi mục được gom vào một LogBatch giữ tối đa `max_log_lines_per_pod` dòng mới nhất (0 = không giới hạn).
+    """
+
+    def __init__(self, max_log_lines_per_pod=0):
+        self.max_log_lines_per_pod = max_log_lines_per_pod
+        self._items = OrderedDict()
+        self._cond = threading.Condition()
+
+    def put(self, pod_key, reason=None, logs=None):
+        with self._cond:
+            item = self._items.get(pod_key)
+            if item is None: item = self._items[pod_key] = {"reason": [], "logs": LogBatch(self.max_log_lines_per_pod)}
+            if reason and reason not in item["reason"]: item["reason"].append(reason)
+            if logs: item["logs"].extend(logs)
+            self._cond.notify()
+
+    def __len__(self):
+        with self._cond: return len(self._items)
+
+    def drain(self, timeout=None, batch_window=0.0):
+        """Chờ tối đa `timeout` giây cho mục đầu tiên, gom thêm trong `batch_window` giây rồi lấy hết."""
+        with self._cond:
+            if not self._items and not self._cond.wait_for(lambda: bool(self._items), timeout): return {}
+        if batch_window > 0: time.sleep(batch_window)
+        with self._cond:
+            items = dict(self._items); self._items.clear(); return items
+
+
+def _terminated_record(cs):
+    """Lần terminate gần nhất của container (trạng thái hiện tại hoặc last_state)."""
+    if cs.state and cs.state.terminated: return cs.state.terminated
+    if cs.last_state and cs.last_state.terminated: return cs.last_state.terminated
+    return None
+
+
+def _termination_id(terminated):
+    return (terminated.container_id, terminated.finished_at, terminated.reason) if terminated else None
+
+
+def _is_unschedulable(pod):
+    if pod.status.phase != "Pending" or not pod.status.conditions: return False
+    return any(c.type == "PodScheduled" and c.status == "False" and c.reason == "Unschedulable" for c in pod.status.conditions)
+
+
+class PodTransitionDetector:
+    """Phát hiện các chuyển trạng thái bất thường của pod giữa hai phiên bản liên tiếp từ watch.
+
+    Khác với quét định kỳ, mỗi sự kiện chỉ được báo một lần: restart count vượt ngưỡng,
+    lý do Waiting mới, lần Terminated mới, pod chuyển sang Failed/Unknown hoặc Unschedulable.
+    """
+
+    def __init__(self, work_queue, restart_threshold, termination_window, waiting_reasons=WAITING_REASONS, terminated_reasons=TERMINATED_REASONS):
+        self.work_queue = work_queue
+        self.restart_threshold = restart_threshold
+        self.termination_window = termination_window
+        self.waiting_reasons = set(waiting_reasons)
+        self.terminated_reasons = set(terminated_reasons)
+        self.transitions_detected = 0
+
+    def detect(self, old_pod, pod):
+        reasons = []
+        old_phase = old_pod.status.phase if old_pod else None
+        if pod.status.phase in ("Failed", "Unknown") and old_phase != pod.status.phase: reasons.append(f"Trạng thái Pod là {pod.status.phase}")
+        if _is_unschedulable(pod) and not (old_pod and _is_unschedulable(old_pod)): reasons.append("Pod không thể lên lịch (Unschedulable)")
+        old_statuses = {cs.name: cs for cs in (old_pod.status.container_statuses or [])} if old_pod else {}
+        for cs in pod.status.container_statuses or []:
+            old_cs = old_statuses.get(cs.name)
+            old_restarts = old_cs.restart_count if old_cs else 0
+            if old_restarts < self.restart_threshold <= cs.restart_count:
+                reasons.append(f"Container '{cs.name}' restart {cs.restart_count} lần (>= ngưỡng {self.restart_threshold})")
+            waiting = cs.state.waiting if cs.state else None
+            old_waiting = old_cs.state.waiting if old_cs and old_cs.state else None
+            if waiting and waiting.reason in self.waiting_reasons and (not old_waiting or old_waiting.reason != waiting.reason):
+                reasons.append(f"Container '{cs.name}' đang ở trạng thái Waiting với lý do '{waiting.reason}'")
+            terminated = _terminated_record(cs)
+            if terminated and terminated.reason in self.terminated_reasons and self._is_recent(pod, terminated) and _termination_id(terminated) != _termination_id(_terminated_record(old_cs) if old_cs else None):
+                reasons.append(f"Container '{cs.name}' bị Terminated với lý do '{terminated.reason}'")
+        return reasons
+
+    def _is_recent(self, pod, terminated):
+        # Giống quét định kỳ: với restartPolicy=Always chỉ quan tâm các lần terminate gần đây
+        if pod.spec.restart_policy != "Always": return True
+        return bool(terminated.finished_at and datetime.now(timezone.utc) - terminated.finished_at < self.termination_window)
+
+    def __call__(self, event_type, pod, old_pod):
+        if event_type == "DELETED": return
+        reasons = self.detect(old_pod, pod)
+        if not reasons: return
+        pod_key = f"{pod.metadata.namespace}/{pod.metadata.name}"
+        self.transitions_detected += len(reasons)
+        for reason in reasons:
+            logging.warning(f"Phát hiện chuyển trạng thái bất thường (K8s Watch): {pod_key}. Lý do: {reason}")
+            self.work_queue.put(pod_key, reason=f"K8s: {reason}")
@@ -0,0 +1,175 @@
+"""Test double cho các dịch vụ bên ngoài, dùng chung cho replay.py, benchmark.py và tests/.
+
+Module chỉ phục vụ chạy thử offline: main.py và các module production không import nó.
+"""
+import copy
+import re
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from kubernetes import client
+from kubernetes.client.exceptions import ApiException
+
+from model_client import ModelClient, ModelResponse, estimate_tokens
+
+
+class FakeTelegramServer:
+    """Bot API giả chạy cục bộ (chỉ sendMessage) để thử nghiệm notifier mà không cần Telegram thật.
+
+    Cứ `rate_limit_every` yêu cầu thì trả 429 kèm retry_after, cứ `fail_every` yêu cầu thì trả 500;
+    các tin nhắn nhận thành công được lưu trong `.messages`.
+    """
+
+    def __init__(self, rate_limit_every=0, retry_after=1, fail_every=0, latency_seconds=0.0):
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.fail_every = fail_every
+        self.latency_seconds = latency_seconds
+        self.messages = []
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                status, body = fake._respond(payload)
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status); self.send_header("Content-Type", "application/json"); self.send_header("Content-Length", str(len(data)))
+                self.end_headers(); self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def _respond(self, payload):
+        time.sleep(self.latency_seconds)
+        with self._lock:
+            self.requests += 1; number = self.requests
+            if self.rate_limit_every and number % self.rate_limit_every == 0:
+                return 429, {"ok": False, "error_code": 429, "description": f"Too Many Requests: retry after {self.retry_after}", "parameters": {"retry_after": self.retry_after}}
+            if self.fail_every and number % self.fail_every == 0:
+                return 500, {"ok": False, "error_code": 500, "description": "Internal Server Error"}
+            self.messages.append(payload)
+            return 200, {"ok": True, "result": {"message_id": len(self.messages), "chat": {"id": payload.get("chat_id")}, "text": payload.get("text")}}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-telegram", daemon=True); self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown(); self._server.server_close()
+
+
+class FakeLeaseApi:
+    """CoordinationV1Api trong bộ nhớ (read/create/replace/list/delete Lease), kiểm tra resourceVersion như API server.
+
+    Đặt `.unavailable = True` để mô phỏng API server không truy cập được (mọi lời gọi trả 503).
+    """
+
+    def __init__(self):
+        self.unavailable = False
+        self._leases = {}
+        self._version = 0
+        self._lock = threading.Lock()
+
+    def _check(self):
+        if self.unavailable: raise ApiException(status=503, reason="Service Unavailable")
+
+    def _store(self, namespace, name, lease):
+        self._version += 1; lease = copy.deepcopy(lease)
+        lease.metadata.namespace = namespace; lease.metadata.resource_version = str(self._version)
+        self._leases[(namespace, name)] = lease
+        return copy.deepcopy(lease)
+
+    def read_namespaced_lease(self, name, namespace, **kwargs):
+        with self._lock:
+            self._check(); lease = self._leases.get((namespace, name))
+            if lease is None: raise ApiException(status=404, reason="Not Found")
+            return copy.deepcopy(lease)
+
+    def create_namespaced_lease(self, namespace, body, **kwargs):
+        with self._lock:
+            self._check()
+            if (namespace, body.metadata.name) in self._leases: raise ApiException(status=409, reason="AlreadyExists")
+            return self._store(namespace, body.metadata.name, body)
+
+    def replace_namespaced_lease(self, name, namespace, body, **kwargs):
+        with self._lock:
+            self._check(); current = self._leases.get((namespace, name))
+            if current is None: raise ApiException(status=404, reason="Not Found")
+            if body.metadata.resource_version != current.metadata.resource_version: raise ApiException(status=409, reason="Conflict")
+            return self._store(namespace, name, body)
+
+    def list_namespaced_lease(self, namespace, label_selector=None, **kwargs):
+        selector = dict(part.split("=", 1) for part in (label_selector or "").split(",") if "=" in part)
+        with self._lock:
+            self._check()
+            items = [copy.deepcopy(lease) for (ns, _), lease in sorted(self._leases.items(), key=lambda item: item[0])
+                     if ns == namespace and all((lease.metadata.labels or {}).get(key) == value for key, value in selector.items())]
+        return client.V1LeaseList(items=items)
+
+    def delete_namespaced_lease(self, name, namespace, **kwargs):
+        with self._lock:
+            self._check()
+            if self._leases.pop((namespace, name), None) is None: raise ApiException(status=404, reason="Not Found")
+
+
+# Quy tắc đơn giản để model giả trả về kết quả ổn định theo nội dung ngữ cảnh
+_FAKE_RULES = [
+    ("OOMKilled", "CRITICAL", "Container bị OOMKilled, cần kiểm tra giới hạn bộ nhớ."),
+    ("CrashLoopBackOff", "ERROR", "Container liên tục khởi động lại (CrashLoopBackOff)."),
+    ("ImagePullBackOff", "ERROR", "Không kéo được image của container."),
+    ("ErrImagePull", "ERROR", "Không kéo được image của container."),
+    ("Unschedulable", "WARNING", "Pod không thể lên lịch."),
+]
+_BATCH_ITEM = re.compile(r"^=== POD id=(\S+) ===$(.*?)(?=^=== POD id=|\Z)", re.MULTILINE | re.DOTALL)
+# Phần dữ liệu của prompt đơn lẻ (bỏ qua câu ví dụ trong hướng dẫn)
+_SINGLE_BODY = re.compile(r"--- START CONTEXT ---(.*)--- END LOGS ---", re.DOTALL)
+
+
+class FakeModelClient(ModelClient):
+    """Model giả chạy cục bộ: phản hồi theo luật từ khóa, có độ trễ cấu hình được.
+
+    Hiểu cả prompt đơn lẻ lẫn prompt batch (trả về mảng JSON); `drop_every` > 0 sẽ bỏ bớt
+    phần tử trong phản hồi batch để mô phỏng model trả thiếu.
+    """
+    name = "fake"
+
+    def __init__(self, latency_seconds=0.0, per_item_latency_seconds=0.0, drop_every=0):
+        self.latency_seconds = latency_seconds
+        self.per_item_latency_seconds = per_item_latency_seconds
+        self.drop_every = drop_every
+        self.calls = 0
+
+    @staticmethod
+    def _judge(text):
+        for keyword, severity, summary in _FAKE_RULES:
+            if keyword in text: return {"severity": severity, "summary": summary}
+        return {"severity": "INFO", "summary": ""}
+
+    def generate(self, prompt, max_output_tokens=300, timeout=90, json_response=False):
+        self.calls += 1
+        items = _BATCH_ITEM.findall(prompt)
+        time.sleep(self.latency_seconds + self.per_item_latency_seconds * max(1, len(items)))
+        if not items:
+            body = _SINGLE_BODY.search(prompt)
+            text = json.dumps(self._judge(body.group(1) if body else prompt), ensure_ascii=False)
+        else:
+            results = []
+            for index, (item_id, body) in enumerate(items, start=1):
+                if self.drop_every and index % self.drop_every == 0: continue
+                results.append({"id": item_id, **self._judge(body)})
+            text = json.dumps(results, ensure_ascii=False)
+        return ModelResponse(text, estimate_tokens(prompt), estimate_tokens(text))
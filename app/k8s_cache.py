@@ -0,0 +1,173 @@
+import threading
+import time
+import logging
+from kubernetes import watch
+from kubernetes.client.exceptions import ApiException
+
+HTTP_GONE = 410
+
+
+def object_key(obj):
+    """Khóa của object trong cache: 'namespace/name' hoặc 'name' với resource cluster-scope."""
+    meta = obj.metadata
+    return f"{meta.namespace}/{meta.name}" if meta.namespace else meta.name
+
+
+class ResourceInformer:
+    """Informer kiểu client-go: list một lần, sau đó watch tiếp từ resourceVersion.
+
+    Khi watch hết hạn (410 Gone) thì list lại toàn bộ. Các handler được gọi với
+    (event_type, obj, old_obj) trong thread của informer, nên cần xử lý nhanh.
+    """
+
+    def __init__(self, name, list_func, list_kwargs=None, watch_timeout_seconds=300, retry_backoff_seconds=5):
+        self.name = name
+        self.list_func = list_func
+        self.list_kwargs = dict(list_kwargs or {})
+        self.watch_timeout_seconds = watch_timeout_seconds
+        self.retry_backoff_seconds = retry_backoff_seconds
+        self.resource_version = None
+        self.synced = threading.Event()
+        self._store = {}
+        self._lock = threading.RLock()
+        self._handlers = []
+        self._stopped = threading.Event()
+        self._watch = None
+        self._thread = None
+
+    def add_handler(self, handler):
+        self._handlers.append(handler)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=f"informer-{self.name}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._watch: self._watch.stop()
+
+    def get(self, key):
+        with self._lock: return self._store.get(key)
+
+    def items(self):
+        with self._lock: return list(self._store.values())
+
+    def _notify(self, event_type, obj, old_obj):
+        for handler in self._handlers:
+            try: handler(event_type, obj, old_obj)
+            except Exception as e: logging.error(f"Informer '{self.name}' handler error: {e}", exc_info=True)
+
+    def _relist(self):
+        result = self.list_func(**self.list_kwargs)
+        fresh = {object_key(obj): obj for obj in result.items}
+        with self._lock:
+            old_store = self._store; self._store = fresh
+            self.resource_version = result.metadata.resource_version
+        for key, obj in fresh.items():
+            old_obj = old_store.get(key)
+            if old_obj is None or old_obj.metadata.resource_version != obj.metadata.resource_version:
+                self._notify("MODIFIED" if old_obj else "ADDED", obj, old_obj)
+        for key, old_obj in old_store.items():
+            if key not in fresh: self._notify("DELETED", old_obj, old_obj)
+        self.synced.set()
+        logging.info(f"Informer '{self.name}' listed {len(fresh)} objects at resourceVersion {self.resource_version}")
+
+    def _watch_once(self):
+        self._watch = watch.Watch()
+        stream = self._watch.stream(self.list_func, resource_version=self.resource_version,
+                                    timeout_seconds=self.watch_timeout_seconds, allow_watch_bookmarks=True, **self.list_kwargs)
+        for event in stream:
+            event_type = event["type"]; obj = event["object"]
+            if event_type == "BOOKMARK":
+                self.resource_version = event["raw_object"]["metadata"]["resourceVersion"]; continue
+            key = object_key(obj)
+            with self._lock:
+                old_obj = self._store.get(key)
+                if event_type == "DELETED": self._store.pop(key, None)
+                else: self._store[key] = obj
+                self.resource_version = obj.metadata.resource_version
+            self._notify(event_type, obj, old_obj)
+            if self._stopped.is_set(): break
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                if self.resource_version is None: self._relist()
+                self._watch_once()
+            except ApiException as e:
+                if e.status == HTTP_GONE:
+                    logging.info(f"Informer '{self.name}' resourceVersion {self.resource_version} expired (410 Gone). Relisting.")
+                    self.resource_version = None; continue
+                logging.warning(f"Informer '{self.name}' API error: {e.status} {e.reason}. Retrying in {self.retry_backoff_seconds}s.")
+                self._stopped.wait(self.retry_backoff_seconds)
+            except Exception as e:
+                logging.error(f"Informer '{self.name}' watch error: {e}. Retrying in {self.retry_backoff_seconds}s.", exc_info=True)
+                self._stopped.wait(self.retry_backoff_seconds)
+
+
+class ClusterCache:
+    """Cache trong bộ nhớ cho Pods, Events (theo namespace) và Nodes, giữ đồng bộ bằng watch."""
+
+    def __init__(self, core_v1, namespaces, watch_timeout_seconds=300):
+        self.namespaces = list(namespaces)
+        self.pod_informers = {ns: ResourceInformer(f"pods/{ns}", core_v1.list_namespaced_pod, {"namespace": ns}, watch_timeout_seconds) for ns in self.namespaces}
+        self.event_informers = {ns: ResourceInformer(f"events/{ns}", core_v1.list_namespaced_event, {"namespace": ns}, watch_timeout_seconds) for ns in self.namespaces}
+        self.node_informer = ResourceInformer("nodes", core_v1.list_node, None, watch_timeout_seconds)
+        # Chỉ mục events theo pod: (namespace, pod_name) -> {event_key: event}
+        self._events_by_pod = {}
+        self._events_lock = threading.Lock()
+        for informer in self.event_informers.values(): informer.add_handler(self._index_event)
+
+    def _index_event(self, event_type, event, old_event):
+        involved = event.involved_object
+        if not involved or involved.kind != "Pod": return
+        pod_ref = (involved.namespace or event.metadata.namespace, involved.name); key = object_key(event)
+        with self._events_lock:
+            if event_type == "DELETED":
+                bucket = self._events_by_pod.get(pod_ref)
+                if bucket is not None:
+                    bucket.pop(key, None)
+                    if not bucket: del self._events_by_pod[pod_ref]
+            else: self._events_by_pod.setdefault(pod_ref, {})[key] = event
+
+    def add_pod_handler(self, handler):
+        for informer in self.pod_informers.values(): informer.add_handler(handler)
+
+    def informers(self):
+        return [*self.pod_informers.values(), *self.event_informers.values(), self.node_informer]
+
+    def start(self):
+        for informer in self.informers(): informer.start()
+        return self
+
+    def stop(self):
+        for informer in self.informers(): informer.stop()
+
+    def wait_for_sync(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for informer in self.informers():
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if not informer.synced.wait(remaining): return False
+        return True
+
+    def has_synced_pods(self, namespace):
+        informer = self.pod_informers.get(namespace)
+        return bool(informer and informer.synced.is_set())
+
+    def list_pods(self, namespace):
+        return self.pod_informers[namespace].items()
+
+    def get_pod(self, namespace, name):
+        informer = self.pod_informers.get(namespace)
+        return informer.get(f"{namespace}/{name}") if informer and informer.synced.is_set() else None
+
+    def get_node(self, name):
+        return self.node_informer.get(name) if self.node_informer.synced.is_set() else None
+
+    def has_synced_events(self, namespace):
+        informer = self.event_informers.get(namespace)
+        return bool(informer and informer.synced.is_set())
+
+    def events_for_pod(self, namespace, name):
+        with self._events_lock: return list(self._events_by_pod.get((namespace, name), {}).values())
@@ -0,0 +1,96 @@
+import re
+
+LOG_LEVELS = ["DEBUG", "INFO", "NOTICE", "WARNING", "ERROR", "CRITICAL", "ALERT", "EMERGENCY"]
+PROBLEM_KEYWORDS = ["FAIL", "ERROR", "CRASH", "EXCEPTION", "UNAVAILABLE", "FATAL", "PANIC"]
+# Từ khóa dùng trong truy vấn LogQL khi quét Loki (ngoài các mức log)
+SCAN_KEYWORDS = ["fail", "crash", "exception", "panic", "fatal"]
+# Các tên viết tắt thường gặp trong trường level có cấu trúc (level=warn, "level":"fatal")
+LEVEL_ALIASES = {"WARN": "WARNING", "ERR": "ERROR", "CRIT": "CRITICAL", "FATAL": "CRITICAL", "EMERG": "EMERGENCY"}
+LEVEL_INDEX = {level: i for i, level in enumerate(LOG_LEVELS)}
+LEVEL_INDEX.update({alias: LEVEL_INDEX[level] for alias, level in LEVEL_ALIASES.items()})
+NO_LEVEL = -1
+WARNING_INDEX = LEVEL_INDEX["WARNING"]
+
+
+def level_index(level_name, default="WARNING"):
+    """Vị trí của mức log trong LOG_LEVELS; ném ValueError nếu không hợp lệ và không có default."""
+    name = (level_name or "").upper()
+    if name in LEVEL_INDEX: return LEVEL_INDEX[name]
+    if default is None: raise ValueError(f"Unknown log level: {level_name}")
+    return LEVEL_INDEX[default]
+
+
+def _alternation(words):
+    return "|".join(re.escape(w) for w in sorted(words, key=len, reverse=True))
+
+
+class LogClassifier:
+    """Phân loại dòng log trong một lần quét bằng một regex kết hợp đã biên dịch sẵn.
+
+    Nhận diện cùng lúc: trường level có cấu trúc (level=..., "level":"..."), token mức log
+    (" ERROR ", "ERROR:" ở đầu dòng, "[ERROR]") và các từ khóa báo lỗi. Mức của dòng là mức
+    cao nhất tìm thấy, giống quy tắc cũ của preprocess_and_filter.
+    """
+
+    def __init__(self, levels=LOG_LEVELS, keywords=PROBLEM_KEYWORDS):
+        self._levels = frozenset(level.upper() for level in levels)
+        self._keywords = frozenset(keyword.upper() for keyword in keywords)
+        structured_words = _alternation([*self._levels, *LEVEL_ALIASES])
+        # Chạy trên chuỗi đã upper(); mọi nhánh đều bắt đầu bằng ký tự cố định để regex engine
+        # lọc nhanh theo ký tự đầu thay vì thử từng nhánh ở mọi vị trí.
+        self._pattern = re.compile(
+            rf"""(?:LEVEL\s*=\s*"?|"LEVEL"\s*:\s*")(?P<slevel>{structured_words})\b"""
+            rf"""|\[(?P<blevel>{_alternation(self._levels)})\]"""
+            rf"""|(?P<word>{_alternation(self._levels | self._keywords)})""")
+
+    def classify(self, message):
+        """Trả về (chỉ số mức log cao nhất hoặc NO_LEVEL, có từ khóa báo lỗi hay không)."""
+        return self.classify_batch([message])[0]
+
+    def classify_batch(self, messages):
+        """Phân loại cả danh sách dòng log (ví dụ toàn bộ values của một stream Loki).
+
+        Các dòng được upper() rồi nối lại, regex chạy một lượt trên toàn bộ văn bản;
+        mỗi kết quả được gán về dòng của nó theo offset.
+        """
+        results = [(NO_LEVEL, False)] * len(messages)
+        if not messages: return results
+        # Offset tính trên dòng đã upper(): upper() có thể đổi độ dài ("ß" -> "SS")
+        upper_messages = [message.upper() for message in messages]
+        text = "\n".join(upper_messages)
+        line_ends = []; offset = -1
+        for message in upper_messages: offset += len(message) + 1; line_ends.append(offset)
+        levels = self._levels; keywords = self._keywords
+        line = 0; line_start = 0; line_end = line_ends[0]; best = NO_LEVEL; has_keyword = False
+        for match in self._pattern.finditer(text):
+            start, end = match.span()
+            if start >= line_end:
+                results[line] = (best, has_keyword); best = NO_LEVEL; has_keyword = False
+                while start >= line_ends[line]: line += 1
+                line_start = line_ends[line - 1] + 1; line_end = line_ends[line]
+            group = match.lastgroup; word = match.group(group)
+            if group == "word":
+                # Token mức log: đứng riêng giữa khoảng trắng, hoặc dạng "ERROR:" ở đầu dòng
+                if word in levels and (
+                        (start == line_start or text[start - 1].isspace()) and (end == line_end or text[end].isspace())
+                        or (start == line_start and end < line_end and text[end] == ":")):
+                    pass
+                else:
+                    if word in keywords: has_keyword = True
+                    continue
+            index = LEVEL_INDEX[word]
+            if index > best: best = index
+        results[line] = (best, has_keyword)
+        return results
+
+    def is_relevant(self, classification, min_level_index):
+        level, has_keyword = classification
+        return level >= min_level_index or (has_keyword and min_level_index <= WARNING_INDEX)
+
+    def filter_batch(self, messages, min_level_index):
+        """Trả về chỉ số các dòng đạt mức tối thiểu hoặc chứa từ khóa báo lỗi."""
+        is_relevant = self.is_relevant
+        return [i for i, classification in enumerate(self.classify_batch(messages)) if is_relevant(classification, min_level_index)]
+
+
+DEFAULT_CLASSIFIER = LogClassifier()
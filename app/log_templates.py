@@ -0,0 +1,124 @@
+import re
+import json
+from datetime import datetime, timezone
+
+WILDCARD = "<*>"
+# Các phần thay đổi giữa những lần lặp lại của cùng một loại log, được thay bằng WILDCARD trước khi gom nhóm
+_MASKS = [
+    re.compile(r"\b\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(?:[.,]\d+)?(?:Z|[+-]\d{2}:?\d{2})?\b"),
+    re.compile(r"\b[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}\b"),
+    re.compile(r"\b\d{1,3}(?:\.\d{1,3}){3}(?::\d+)?\b"),
+    re.compile(r"\b0x[0-9a-fA-F]+\b"),
+    re.compile(r"\b[0-9a-fA-F]{16,}\b"),
+    re.compile(r"(?<![A-Za-z])[-+]?\d+(?:\.\d+)?(?:ms|s|m|h|%|[KMG]i?B?)?\b"),
+]
+
+
+def mask_message(message):
+    for pattern in _MASKS: message = pattern.sub(WILDCARD, message)
+    return message
+
+
+class LogTemplate:
+    """Một cụm log cùng mẫu: template, số lần xuất hiện, thời điểm đầu/cuối (nano-giây) và một dòng ví dụ."""
+    __slots__ = ("tokens", "count", "first_seen_ns", "last_seen_ns", "exemplar", "level")
+
+    def __init__(self, tokens, message, timestamp_ns):
+        self.tokens = tokens; self.count = 0
+        self.first_seen_ns = self.last_seen_ns = timestamp_ns
+        self.exemplar = message; self.level = None
+
+    @property
+    def template(self):
+        return " ".join(self.tokens)
+
+    @property
+    def first_seen(self):
+        return datetime.fromtimestamp(self.first_seen_ns / 1e9, tz=timezone.utc)
+
+    @property
+    def last_seen(self):
+        return datetime.fromtimestamp(self.last_seen_ns / 1e9, tz=timezone.utc)
+
+    def add(self, timestamp_ns, level=None):
+        self.count += 1
+        if timestamp_ns < self.first_seen_ns: self.first_seen_ns = timestamp_ns
+        if timestamp_ns > self.last_seen_ns: self.last_seen_ns = timestamp_ns
+        if level and (self.level is None or _level_rank(level) > _level_rank(self.level)): self.level = level
+
+    def to_dict(self):
+        return {"template": self.template, "count": self.count, "first_seen": self.first_seen.isoformat(),
+                "last_seen": self.last_seen.isoformat(), "level": self.level, "exemplar": self.exemplar}
+
+
+_LEVEL_RANK = {"DEBUG": 0, "INFO": 1, "NOTICE": 2, "WARNING": 3, "ERROR": 4, "CRITICAL": 5, "ALERT": 6, "EMERGENCY": 7}
+
+
+def _level_rank(level):
+    return _LEVEL_RANK.get(level, -1) if level else -1
+
+
+class TemplateMiner:
+    """Gom nhóm log theo kiểu Drain: phân nhóm theo số token và token đầu, rồi ghép vào cụm
+    giống nhất nếu tỉ lệ token trùng khớp >= similarity_threshold; vị trí khác nhau thành WILDCARD."""
+
+    def __init__(self, similarity_threshold=0.5, max_clusters_per_group=100):
+        self.similarity_threshold = similarity_threshold
+        self.max_clusters_per_group = max_clusters_per_group
+        self._groups = {}
+        self.templates = []
+
+    @staticmethod
+    def _similarity(template_tokens, tokens):
+        same = 0; wildcards = 0
+        for a, b in zip(template_tokens, tokens):
+            if a == WILDCARD: wildcards += 1
+            elif a == b: same += 1
+        return same / len(tokens), wildcards
+
+    def add(self, message, timestamp_ns, level=None):
+        tokens = mask_message(message).split()
+        if not tokens: tokens = [""]
+        first = tokens[0] if not any(ch.isdigit() for ch in tokens[0]) else WILDCARD
+        group = self._groups.setdefault((len(tokens), first), [])
+        best = None; best_score = (-1.0, -1)
+        for cluster in group:
+            similarity, wildcards = self._similarity(cluster.tokens, tokens)
+            if (similarity, wildcards) > best_score: best, best_score = cluster, (similarity, wildcards)
+        if best is None or (best_score[0] < self.similarity_threshold and len(group) < self.max_clusters_per_group):
+            best = LogTemplate(tokens, message, timestamp_ns); group.append(best); self.templates.append(best)
+        else:
+            best.tokens = [a if a == b else WILDCARD for a, b in zip(best.tokens, tokens)]
+        best.add(timestamp_ns, level)
+        return best
+
+
+def mine_templates(log_batch, similarity_threshold=0.5):
+    """Gom các dòng của một LogBatch thành template, sắp xếp theo thời điểm xuất hiện đầu tiên."""
+    miner = TemplateMiner(similarity_threshold)
+    for i in range(len(log_batch)): miner.add(log_batch.message(i), log_batch.timestamp_ns(i), log_batch.level_name(i))
+    return sorted(miner.templates, key=lambda t: t.first_seen_ns)
+
+
+def format_templates_for_prompt(templates, max_chars=20000, exemplar_chars=300):
+    """Định dạng template cho prompt. Khi vượt ngân sách ký tự thì ưu tiên template có mức log
+    cao hơn và xuất hiện sớm hơn, nhưng vẫn giữ thứ tự thời gian khi in ra."""
+    blocks = {}
+    for template in templates:
+        block = f"[x{template.count}] {template.first_seen.isoformat()} .. {template.last_seen.isoformat()}"
+        if template.level: block += f" {template.level}"
+        block += f"\n    {template.template[:exemplar_chars]}"
+        if template.count > 1 or template.template != template.exemplar: block += f"\n    ví dụ: {template.exemplar[:exemplar_chars]}"
+        blocks[id(template)] = block
+    chosen = set(); used = 0; omitted = 0
+    for template in sorted(templates, key=lambda t: (-_level_rank(t.level), t.first_seen_ns)):
+        size = len(blocks[id(template)]) + 1
+        if used + size > max_chars: omitted += 1; continue
+        chosen.add(id(template)); used += size
+    lines = [blocks[id(t)] for t in templates if id(t) in chosen]
+    if omitted: lines.append(f"... ({omitted} template khác bị lược bỏ do giới hạn độ dài)")
+    return "\n".join(lines)
+
+
+def templates_to_json(templates):
+    return json.dumps([t.to_dict() for t in templates], ensure_ascii=False)
@@ -0,0 +1,139 @@
+"""Lô log dạng cột, gọn bộ nhớ, dùng cho cả đường quét Loki lẫn log chi tiết của pod.
+
+Thay cho một dict cho mỗi dòng (datetime + chuỗi + dict label): timestamp là int64 nano-giây trong
+array, bộ label được intern một lần cho mỗi stream, nội dung dòng được nối vào một bộ đệm bytes
+chung và chỉ giải mã khi được đọc. `max_lines` > 0 biến lô thành ring buffer: dòng mới đẩy dòng
+cũ nhất ra và `dropped` đếm số dòng bị đẩy ra.
+"""
+import threading
+from array import array
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from log_classifier import LOG_LEVELS
+
+# Bảng intern dùng chung: mọi lô cùng trỏ tới một dict cho mỗi bộ label khác nhau. Worker điều tra, Loki ingestor
+# và luồng bulk fetch cùng gọi intern_labels nên bảng được khóa; LRU để label của các pod đã mất bị đẩy ra dần
+_LABEL_SETS = OrderedDict()
+_LABEL_SETS_LOCK = threading.Lock()
+_MAX_LABEL_SETS = 50000
+
+
+def intern_labels(labels):
+    key = tuple(sorted(labels.items()))
+    with _LABEL_SETS_LOCK:
+        interned = _LABEL_SETS.get(key)
+        if interned is not None: _LABEL_SETS.move_to_end(key); return interned
+        interned = _LABEL_SETS[key] = dict(labels)
+        if len(_LABEL_SETS) > _MAX_LABEL_SETS: _LABEL_SETS.popitem(last=False)
+    return interned
+
+
+def ns_to_datetime(ts_ns):
+    return datetime.fromtimestamp(ts_ns / 1e9, tz=timezone.utc)
+
+
+class LogBatch:
+    __slots__ = ("max_lines", "dropped", "_ts", "_label_ids", "_levels", "_offsets", "_buffer", "_head",
+                 "_labels", "_label_ids_by_key", "_last_labels", "_last_label_id")
+
+    def __init__(self, max_lines=0):
+        self.max_lines = max_lines
+        self.dropped = 0
+        self._ts = array("q"); self._label_ids = array("H"); self._levels = array("b")
+        # _offsets[i].._offsets[i+1] là vị trí của dòng i trong _buffer (UTF-8, đã strip)
+        self._offsets = array("q", [0]); self._buffer = bytearray()
+        self._head = 0
+        self._labels = []; self._label_ids_by_key = {}
+        self._last_labels = None; self._last_label_id = None
+
+    def __len__(self):
+        return len(self._ts) - self._head
+
+    def __repr__(self):
+        return f"LogBatch({len(self)} lines, {len(self._labels)} label sets, dropped={self.dropped})"
+
+    def add_labels(self, labels):
+        """Trả về chỉ số của bộ label trong lô (intern); gọi lặp lại với cùng dict của một stream rất rẻ."""
+        if labels is self._last_labels: return self._last_label_id
+        interned = intern_labels(labels); label_id = self._label_ids_by_key.get(id(interned))
+        if label_id is None:
+            label_id = self._label_ids_by_key[id(interned)] = len(self._labels); self._labels.append(interned)
+        self._last_labels = labels; self._last_label_id = label_id
+        return label_id
+
+    def append(self, ts_ns, line, label_id=0, level=-1):
+        if not self._labels: self.add_labels({})
+        data = line.strip().encode("utf-8")
+        self._ts.append(ts_ns); self._label_ids.append(label_id); self._levels.append(level)
+        self._buffer += data; self._offsets.append(len(self._buffer))
+        if self.max_lines and len(self) > self.max_lines:
+            self._head += 1; self.dropped += 1
+            if self._head >= self.max_lines: self._compact()
+
+    def _compact(self):
+        # Dồn các dòng còn giữ về đầu khi số dòng đã bị đẩy ra bằng số dòng còn giữ (chi phí khấu hao O(1) mỗi dòng)
+        head = self._head; base = self._offsets[head]
+        del self._ts[:head]; del self._label_ids[:head]; del self._levels[:head]; del self._buffer[:base]
+        self._offsets = array("q", (offset - base for offset in self._offsets[head:])); self._head = 0
+
+    def extend(self, other):
+        """Thêm mọi dòng của lô khác (giữ mức log và label)."""
+        for i in range(len(other)):
+            self.append(other.timestamp_ns(i), other.message(i), self.add_labels(other.labels(i)), other.level(i))
+        self.dropped += other.dropped
+
+    def timestamp_ns(self, i):
+        return self._ts[self._head + i]
+
+    def timestamp(self, i):
+        return ns_to_datetime(self._ts[self._head + i])
+
+    def message(self, i):
+        i += self._head
+        return self._buffer[self._offsets[i]:self._offsets[i + 1]].decode("utf-8", "replace")
+
+    def messages(self):
+        return [self.message(i) for i in range(len(self))]
+
+    def labels(self, i):
+        return self._labels[self._label_ids[self._head + i]]
+
+    def level(self, i):
+        return self._levels[self._head + i]
+
+    def level_name(self, i):
+        level = self._levels[self._head + i]
+        return LOG_LEVELS[level] if level >= 0 else None
+
+    def set_level(self, i, level):
+        self._levels[self._head + i] = level
+
+    def select(self, indexes, levels=None, max_lines=None):
+        """Lô mới chỉ gồm các dòng `indexes` (theo thứ tự đưa vào), tùy chọn gán mức log mới cho từng dòng."""
+        selected = LogBatch(self.max_lines if max_lines is None else max_lines)
+        for n, i in enumerate(indexes):
+            selected.append(self.timestamp_ns(i), self.message(i), selected.add_labels(self.labels(i)), self.level(i) if levels is None else levels[n])
+        return selected
+
+    def sorted(self):
+        """Lô mới sắp theo thời gian (ổn định)."""
+        return self.select(sorted(range(len(self)), key=self.timestamp_ns))
+
+    @classmethod
+    def merge(cls, batches, max_lines=None):
+        """Gộp nhiều lô thành một lô sắp theo thời gian; mặc định giới hạn bằng giới hạn lớn nhất của các lô đầu vào."""
+        batches = [batch for batch in batches if batch is not None]
+        if max_lines is None: max_lines = max((batch.max_lines for batch in batches), default=0)
+        if len(batches) == 1 and batches[0].max_lines == max_lines: return batches[0]
+        order = sorted(((batch.timestamp_ns(i), n, i) for n, batch in enumerate(batches) for i in range(len(batch))))
+        merged = cls(max_lines); merged.dropped = sum(batch.dropped for batch in batches)
+        for ts_ns, n, i in order:
+            batch = batches[n]; merged.append(ts_ns, batch.message(i), merged.add_labels(batch.labels(i)), batch.level(i))
+        return merged
+
+    @property
+    def nbytes(self):
+        """Dung lượng ước lượng của dữ liệu dòng (không tính các dict label dùng chung)."""
+        return (self._ts.itemsize * len(self._ts) + self._label_ids.itemsize * len(self._label_ids) + len(self._levels)
+                + self._offsets.itemsize * len(self._offsets) + len(self._buffer))
@@ -0,0 +1,246 @@
+import re
+import time
+import logging
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+
+from logbatch import LogBatch
+
+
+def stream_key(labels):
+    """Khóa ổn định cho một stream Loki từ bộ label của nó."""
+    return ",".join(f"{k}={v}" for k, v in sorted(labels.items()))
+
+
+class _StreamCursor:
+    __slots__ = ("last_ts", "lines_at_last_ts")
+
+    def __init__(self):
+        self.last_ts = 0; self.lines_at_last_ts = set()
+
+
+class LokiCursorIngestor:
+    """Đọc liên tục kết quả của một truy vấn LogQL bằng query_range phân trang theo con trỏ.
+
+    Mỗi lần poll tiếp tục từ timestamp nano-giây cuối cùng đã thấy (không dùng cửa sổ cố định),
+    bỏ các dòng trùng theo (stream, ts) và dừng tải khi bộ đệm đầy (backpressure). Log của mỗi pod được
+    đệm trong một LogBatch giữ tối đa `max_lines_per_pod` dòng mới nhất; dòng cũ bị đẩy ra được đếm vào lines_dropped.
+    """
+
+    def __init__(self, loki_url, query, page_limit=1000, max_pages_per_poll=20, ingest_delay_seconds=5,
+                 initial_lookback_seconds=60, max_buffered_lines=50000, max_lines_per_pod=2000, timeout=60, session=None):
+        self.endpoint = f"{loki_url}/loki/api/v1/query_range"
+        self.query = query
+        self.page_limit = page_limit
+        self.max_pages_per_poll = max_pages_per_poll
+        self.ingest_delay_ns = int(ingest_delay_seconds * 1e9)
+        self.initial_lookback_ns = int(initial_lookback_seconds * 1e9)
+        self.max_buffered_lines = max_buffered_lines
+        self.max_lines_per_pod = max_lines_per_pod
+        self.timeout = timeout
+        self.session = session or requests
+        self.cursor_ns = None
+        self._streams = {}
+        self._buffer = {}
+        self._buffered_lines = 0
+        self.stats = {"pages_fetched": 0, "lines_received": 0, "lines_ingested": 0, "duplicates_skipped": 0,
+                      "lines_dropped": 0, "backpressure_pauses": 0, "errors": 0}
+
+    def _fetch_page(self, start_ns, end_ns):
+        params = {'query': self.query, 'start': start_ns, 'end': end_ns, 'limit': self.page_limit, 'direction': 'forward'}
+        response = self.session.get(self.endpoint, params=params, headers={'Accept': 'application/json'}, timeout=self.timeout)
+        response.raise_for_status(); data = response.json()
+        self.stats["pages_fetched"] += 1
+        return data.get('data', {}).get('result', [])
+
+    def _accept(self, skey, ts, line):
+        cursor = self._streams.get(skey)
+        if cursor is None: cursor = self._streams[skey] = _StreamCursor()
+        if ts < cursor.last_ts: return False
+        if ts == cursor.last_ts:
+            if line in cursor.lines_at_last_ts: return False
+            cursor.lines_at_last_ts.add(line); return True
+        cursor.last_ts = ts; cursor.lines_at_last_ts = {line}
+        return True
+
+    def _stream_batch(self, labels):
+        """LogBatch đệm của pod mà stream thuộc về (None nếu stream không có namespace/pod)."""
+        ns = labels.get('namespace'); pod_name = labels.get('pod')
+        if not ns or not pod_name: return None
+        pod_key = f"{ns}/{pod_name}"; batch = self._buffer.get(pod_key)
+        if batch is None: batch = self._buffer[pod_key] = LogBatch(self.max_lines_per_pod)
+        return batch
+
+    def _buffer_entry(self, batch, labels, ts, line):
+        if batch is None: return
+        dropped = batch.dropped; batch.append(ts, line, batch.add_labels(labels)); self.stats["lines_ingested"] += 1
+        if batch.dropped > dropped: self.stats["lines_dropped"] += 1
+        else: self._buffered_lines += 1
+
+    def _prune_streams(self):
+        # Bỏ con trỏ của các stream đã im lặng lâu hơn cửa sổ lookback để bộ nhớ không tăng mãi
+        horizon = self.cursor_ns - self.initial_lookback_ns
+        for skey in [k for k, c in self._streams.items() if c.last_ts < horizon]: del self._streams[skey]
+
+    def poll(self, now_ns=None):
+        """Tải các trang mới kể từ con trỏ. Trả về số dòng mới được đưa vào bộ đệm."""
+        now_ns = now_ns or time.time_ns()
+        end_ns = now_ns - self.ingest_delay_ns
+        if self.cursor_ns is None: self.cursor_ns = end_ns - self.initial_lookback_ns
+        ingested_before = self.stats["lines_ingested"]
+        for _ in range(self.max_pages_per_poll):
+            if self.cursor_ns >= end_ns: break
+            if self._buffered_lines >= self.max_buffered_lines:
+                self.stats["backpressure_pauses"] += 1
+                logging.warning(f"Loki ingest buffer full ({self._buffered_lines} lines). Pausing until it is drained.")
+                break
+            try: streams = self._fetch_page(self.cursor_ns, end_ns)
+            except (requests.exceptions.RequestException, ValueError) as e:
+                self.stats["errors"] += 1; logging.error(f"Error fetching Loki page from cursor {self.cursor_ns}: {e}"); break
+            page_lines = 0; max_ts = self.cursor_ns
+            for stream in streams:
+                labels = stream.get('stream', {}); skey = stream_key(labels); batch = self._stream_batch(labels)
+                for ts_str, line in stream.get('values', []):
+                    ts = int(ts_str); page_lines += 1
+                    if ts > max_ts: max_ts = ts
+                    if self._accept(skey, ts, line): self._buffer_entry(batch, labels, ts, line)
+                    else: self.stats["duplicates_skipped"] += 1
+            self.stats["lines_received"] += page_lines
+            if page_lines < self.page_limit:
+                # Trang chưa đầy: đã đọc hết tới end_ns
+                self.cursor_ns = end_ns; break
+            # Trang đầy: tiếp tục từ timestamp lớn nhất (inclusive, các dòng trùng sẽ bị bỏ qua).
+            # Nếu cả trang cùng một timestamp thì phải nhảy qua để không lặp vô hạn.
+            if max_ts == self.cursor_ns:
+                logging.warning(f"Loki page of {page_lines} lines shares a single timestamp {max_ts}; skipping ahead 1ns.")
+                max_ts += 1
+            self.cursor_ns = max_ts
+        self._prune_streams()
+        return self.stats["lines_ingested"] - ingested_before
+
+    def drain(self):
+        """Lấy toàn bộ log đã đệm ({'namespace/pod': LogBatch}) và giải phóng bộ đệm."""
+        buffered = {pod_key: batch for pod_key, batch in self._buffer.items() if batch}; self._buffer = {}; self._buffered_lines = 0
+        return buffered
+
+
+class LokiBulkFetcher:
+    """Lấy log chi tiết của nhiều pod bằng ít truy vấn LogQL nhất có thể.
+
+    Pod được gom theo namespace thành selector `pod=~"a|b|..."` (tối đa `max_pods_per_query` pod và
+    `max_selector_chars` ký tự mỗi truy vấn); cửa sổ dài được chia thành các khoảng `sub_range_seconds`
+    tải song song. Stream trả về được tách lại theo pod và mỗi pod giữ tối đa `max_lines_per_pod` dòng
+    sớm nhất, giống truy vấn từng pod với limit + direction=forward.
+    """
+
+    def __init__(self, loki_url, session=None, max_pods_per_query=20, max_selector_chars=2000, max_lines_per_pod=500,
+                 sub_range_seconds=600, page_limit=5000, max_pages=5, max_parallel=4, timeout=45):
+        self.endpoint = f"{loki_url}/loki/api/v1/query_range"
+        self.session = session or requests
+        self.max_pods_per_query = max(1, max_pods_per_query)
+        self.max_selector_chars = max_selector_chars
+        self.max_lines_per_pod = max_lines_per_pod
+        self.sub_range_ns = int(sub_range_seconds * 1e9)
+        self.page_limit = page_limit
+        self.max_pages = max_pages
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_parallel, thread_name_prefix="loki-bulk")
+        # Luồng điều phối riêng để submit() không chiếm worker của chính các truy vấn con
+        self._coordinator = ThreadPoolExecutor(max_workers=1, thread_name_prefix="loki-bulk-dispatch")
+        self.stats = {"fetches": 0, "pods": 0, "queries": 0, "pages": 0, "lines": 0, "lines_dropped": 0, "errors": 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, **values):
+        with self._stats_lock:
+            for key, value in values.items(): self.stats[key] += value
+
+    def build_chunks(self, pod_keys):
+        """Chia pod thành các nhóm (namespace, [pod_name, ...]) vừa giới hạn số pod và độ dài selector."""
+        by_namespace = {}
+        for pod_key in dict.fromkeys(pod_keys):
+            namespace, pod_name = pod_key.split('/', 1); by_namespace.setdefault(namespace, []).append(pod_name)
+        chunks = []
+        for namespace, pod_names in by_namespace.items():
+            current = []; size = 0
+            for pod_name in pod_names:
+                pattern_len = len(re.escape(pod_name)) + 1
+                if current and (len(current) >= self.max_pods_per_query or size + pattern_len > self.max_selector_chars):
+                    chunks.append((namespace, current)); current = []; size = 0
+                current.append(pod_name); size += pattern_len
+            if current: chunks.append((namespace, current))
+        return chunks
+
+    @staticmethod
+    def build_query(namespace, pod_names):
+        if len(pod_names) == 1: return f'{{namespace="{namespace}", pod="{pod_names[0]}"}}'
+        return f'{{namespace="{namespace}", pod=~`{"|".join(re.escape(pod_name) for pod_name in pod_names)}`}}'
+
+    def split_range(self, start_ns, end_ns):
+        if self.sub_range_ns <= 0 or end_ns - start_ns <= self.sub_range_ns: return [(start_ns, end_ns)]
+        return [(t, min(t + self.sub_range_ns, end_ns)) for t in range(start_ns, end_ns, self.sub_range_ns)]
+
+    def _fetch_page(self, query, start_ns, end_ns, limit):
+        params = {'query': query, 'start': start_ns, 'end': end_ns, 'limit': limit, 'direction': 'forward'}
+        response = self.session.get(self.endpoint, params=params, headers={'Accept': 'application/json'}, timeout=self.timeout)
+        response.raise_for_status(); data = response.json()
+        self._count(pages=1)
+        return data.get('data', {}).get('result', [])
+
+    def _fetch_range(self, namespace, pod_names, start_ns, end_ns):
+        """Tải một nhóm pod trong một khoảng con; trả về {pod_key: [(ts, line, labels)]}."""
+        results = {}; remaining = list(pod_names); cursor_ns = start_ns; seen_at_cursor = set()
+        self._count(queries=1)
+        for _ in range(self.max_pages):
+            limit = min(self.page_limit, self.max_lines_per_pod * len(remaining)); wanted = set(remaining)
+            streams = self._fetch_page(self.build_query(namespace, remaining), cursor_ns, end_ns, limit)
+            page_lines = 0; max_ts = cursor_ns; at_max_ts = set()
+            for stream in streams:
+                labels = stream.get('stream', {}); pod_name = labels.get('pod')
+                if labels.get('namespace') != namespace or pod_name not in wanted: continue
+                skey = stream_key(labels); entries = results.setdefault(f"{namespace}/{pod_name}", [])
+                for ts_str, line in stream.get('values', []):
+                    ts = int(ts_str); page_lines += 1
+                    if (skey, ts, line) in seen_at_cursor: continue
+                    entries.append((ts, line, labels))
+                    if ts > max_ts: max_ts = ts; at_max_ts = set()
+                    if ts == max_ts: at_max_ts.add((skey, ts, line))
+            self._count(lines=page_lines)
+            if page_lines < limit: break
+            # Trang đầy: đọc tiếp từ timestamp lớn nhất (inclusive, bỏ các dòng đã thấy) chỉ cho các pod chưa đủ dòng
+            remaining = [pod_name for pod_name in remaining if len(results.get(f"{namespace}/{pod_name}", ())) < self.max_lines_per_pod]
+            if not remaining: break
+            if max_ts == cursor_ns: max_ts += 1; at_max_ts = set()
+            cursor_ns = max_ts; seen_at_cursor = at_max_ts
+        return results
+
+    def fetch(self, pod_keys, start_time, end_time):
+        """Trả về {pod_key: LogBatch} (sắp theo thời gian); pod thuộc truy vấn bị lỗi không có trong kết quả."""
+        start_ns = int(start_time.timestamp() * 1e9); end_ns = int(end_time.timestamp() * 1e9)
+        chunks = self.build_chunks(pod_keys); ranges = self.split_range(start_ns, end_ns)
+        tasks = [(namespace, pod_names, self._executor.submit(self._fetch_range, namespace, pod_names, sub_start, sub_end))
+                 for namespace, pod_names in chunks for sub_start, sub_end in ranges]
+        merged = {}; failed = set()
+        for namespace, pod_names, future in tasks:
+            pod_keys_in_chunk = [f"{namespace}/{pod_name}" for pod_name in pod_names]
+            try: results = future.result()
+            except Exception as e:
+                # Một khoảng con lỗi thì cả nhóm pod bị coi là lỗi để không trả về log thiếu
+                self._count(errors=1); failed.update(pod_keys_in_chunk)
+                logging.error(f"Error fetching Loki logs for {len(pod_names)} pods in namespace '{namespace}': {e}"); continue
+            for pod_key in pod_keys_in_chunk: merged.setdefault(pod_key, []).extend(results.get(pod_key, ()))
+        logs_by_pod = {}
+        for pod_key, entries in merged.items():
+            if pod_key in failed: continue
+            entries.sort(key=lambda entry: entry[0])
+            if len(entries) > self.max_lines_per_pod: self._count(lines_dropped=len(entries) - self.max_lines_per_pod); del entries[self.max_lines_per_pod:]
+            batch = logs_by_pod[pod_key] = LogBatch()
+            for ts, line, labels in entries: batch.append(ts, line, batch.add_labels(labels))
+        self._count(fetches=1, pods=len(logs_by_pod))
+        logging.info(f"Bulk Loki fetch: {len(logs_by_pod)}/{len(set(pod_keys))} pods in {len(tasks)} queries "
+                     f"({len(chunks)} selector chunks x {len(ranges)} sub-ranges), {sum(len(v) for v in logs_by_pod.values())} lines.")
+        return logs_by_pod
+
+    def submit(self, pod_keys, start_time, end_time):
+        """Chạy fetch() ở nền; trả về Future để các worker điều tra cùng chờ một kết quả."""
+        return self._coordinator.submit(self.fetch, list(pod_keys), start_time, end_time)
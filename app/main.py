@@ -1,10 +1,11 @@
 import os
 import time
 import requests
-import google.generativeai as genai
 import json
+import socket
 import logging
 from datetime import datetime, timedelta, timezone, MINYEAR
+from collections import Counter
 from dotenv import load_dotenv
 import re
 from kubernetes import client, config, watch
@@ -12,17 +13,36 @@ from kubernetes.client.exceptions import ApiException
 try:
     from zoneinfo import ZoneInfo
 except ImportError:
-    logging.error("zoneinfo module not found. Please use Python 3.9+ or install pytz and uncomment the fallback.")
-    exit(1)
+    # Python < 3.9: cảnh báo hiển thị giờ UTC thay vì thoát ngay khi import
+    ZoneInfo = None
 import sqlite3
+import cProfile
+import storage
+import metrics
+import schema
 import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from backends import build_backends, check_deadline, DeadlineExceeded, CircuitOpenError
+from k8s_cache import ClusterCache
+from detection import InvestigationQueue, PodTransitionDetector
+from loki import LokiCursorIngestor, LokiBulkFetcher
+from analysis_cache import AnalysisCache, analysis_fingerprint
+from alert_state import AlertState, parse_severity_cooldowns
+from triage import TriageEngine, build_facts, DEFAULT_RULES_FILE as DEFAULT_TRIAGE_RULES_FILE
+from model_client import create_model_client
+from batch_analysis import BatchAnalyzer
+from notifier import TelegramNotifier
+from sharding import LeaseCoordinator, workload_shard_key
+from workloads import WorkloadResolver, group_by_workload, format_workload_context
+from log_templates import mine_templates, format_templates_for_prompt, templates_to_json
+from logbatch import LogBatch
+from log_classifier import DEFAULT_CLASSIFIER as log_classifier, LOG_LEVELS, SCAN_KEYWORDS, level_index
 
 
 # --- Tải biến môi trường từ file .env (cho phát triển cục bộ) ---
 load_dotenv()
 
-# --- Cấu hình Logging ---
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
 
 # --- Tải cấu hình từ biến môi trường ---
 LOKI_URL = os.environ.get("LOKI_URL", "http://loki-read.monitoring.svc.cluster.local:3100")
@@ -42,6 +62,107 @@ ALERT_SEVERITY_LEVELS = [level.strip().upper() for level in ALERT_SEVERITY_LEVEL
 RESTART_COUNT_THRESHOLD = int(os.environ.get("RESTART_COUNT_THRESHOLD", 5))
 DB_PATH = os.environ.get("DB_PATH", "/data/agent_stats.db")
 STATS_UPDATE_INTERVAL_SECONDS = int(os.environ.get("STATS_UPDATE_INTERVAL_SECONDS", 300))
+# Số thao tác ghi tối đa được gom vào một lần commit
+DB_WRITE_BATCH_SIZE = int(os.environ.get("DB_WRITE_BATCH_SIZE", 200))
+# Ngữ cảnh/log của incident dài hơn ngưỡng này (byte) được nén zlib
+DB_COMPRESS_MIN_BYTES = int(os.environ.get("DB_COMPRESS_MIN_BYTES", 512))
+# Incident cũ hơn số ngày này được gộp vào incident_rollups rồi xóa (0 = giữ mãi)
+INCIDENT_RETENTION_DAYS = int(os.environ.get("INCIDENT_RETENTION_DAYS", 30))
+# Bucket theo giờ của /api/timeseries cũ hơn số ngày này bị xóa (0 = giữ mãi)
+HOURLY_ROLLUP_RETENTION_DAYS = int(os.environ.get("HOURLY_ROLLUP_RETENTION_DAYS", 90))
+RETENTION_INTERVAL_MINUTES = int(os.environ.get("RETENTION_INTERVAL_MINUTES", 60))
+ALERT_COOLDOWN_MINUTES = int(os.environ.get("ALERT_COOLDOWN_MINUTES", 30))
+# Cooldown theo mức độ, ví dụ "CRITICAL=10,ERROR=30,WARNING=60" (phút); mức không có trong danh sách dùng ALERT_COOLDOWN_MINUTES
+ALERT_COOLDOWN_MINUTES_BY_SEVERITY = parse_severity_cooldowns(os.environ.get("ALERT_COOLDOWN_MINUTES_BY_SEVERITY", ""))
+# Ghi bộ đếm chưa flush xuống DB mỗi N giây để khởi động lại không làm mất chúng (0 = chỉ ghi khi flush thống kê)
+STATS_CHECKPOINT_INTERVAL_SECONDS = int(os.environ.get("STATS_CHECKPOINT_INTERVAL_SECONDS", 15))
+# Điều tra đang chạy dở khi agent dừng được tiếp tục sau khi khởi động lại nếu chưa quá số phút này
+INTERRUPTED_INVESTIGATION_MAX_AGE_MINUTES = int(os.environ.get("INTERRUPTED_INVESTIGATION_MAX_AGE_MINUTES", 30))
+# Số pod được điều tra song song và hạn chót cho mỗi chu kỳ
+INVESTIGATION_WORKERS = int(os.environ.get("INVESTIGATION_WORKERS", 8))
+CYCLE_DEADLINE_SECONDS = float(os.environ.get("CYCLE_DEADLINE_SECONDS", max(SCAN_INTERVAL_SECONDS, 10)))
+# Giới hạn đồng thời và tốc độ gọi (lần/giây) cho từng backend
+K8S_MAX_CONCURRENCY = int(os.environ.get("K8S_MAX_CONCURRENCY", 8))
+K8S_RATE_PER_SECOND = float(os.environ.get("K8S_RATE_PER_SECOND", 20))
+LOKI_MAX_CONCURRENCY = int(os.environ.get("LOKI_MAX_CONCURRENCY", 4))
+LOKI_RATE_PER_SECOND = float(os.environ.get("LOKI_RATE_PER_SECOND", 5))
+GEMINI_MAX_CONCURRENCY = int(os.environ.get("GEMINI_MAX_CONCURRENCY", 4))
+GEMINI_RATE_PER_SECOND = float(os.environ.get("GEMINI_RATE_PER_SECOND", 1))
+TELEGRAM_MAX_CONCURRENCY = int(os.environ.get("TELEGRAM_MAX_CONCURRENCY", 1))
+TELEGRAM_RATE_PER_SECOND = float(os.environ.get("TELEGRAM_RATE_PER_SECOND", 1))
+# Timeout thích ứng (3 x p99 độ trễ gần đây, kẹp trong [min, max] giây) và circuit breaker cho Loki / Gemini
+LOKI_TIMEOUT_MIN_SECONDS = float(os.environ.get("LOKI_TIMEOUT_MIN_SECONDS", 5))
+LOKI_TIMEOUT_MAX_SECONDS = float(os.environ.get("LOKI_TIMEOUT_MAX_SECONDS", 60))
+GEMINI_TIMEOUT_MIN_SECONDS = float(os.environ.get("GEMINI_TIMEOUT_MIN_SECONDS", 10))
+GEMINI_TIMEOUT_MAX_SECONDS = float(os.environ.get("GEMINI_TIMEOUT_MAX_SECONDS", 90))
+BACKEND_BREAKER_FAILURE_THRESHOLD = int(os.environ.get("BACKEND_BREAKER_FAILURE_THRESHOLD", 5))
+BACKEND_BREAKER_RESET_SECONDS = float(os.environ.get("BACKEND_BREAKER_RESET_SECONDS", 30))
+# Cache informer (list + watch) cho Pods/Nodes/Events thay cho việc list lại mỗi chu kỳ
+K8S_WATCH_CACHE_ENABLED = os.environ.get("K8S_WATCH_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+K8S_WATCH_TIMEOUT_SECONDS = int(os.environ.get("K8S_WATCH_TIMEOUT_SECONDS", 300))
+# Chế độ phát hiện: "interval" (quét định kỳ) hoặc "event" (theo chuyển trạng thái từ watch, cần watch cache)
+DETECTION_MODE = os.environ.get("DETECTION_MODE", "interval").strip().lower()
+EVENT_BATCH_WINDOW_SECONDS = float(os.environ.get("EVENT_BATCH_WINDOW_SECONDS", 2))
+# Quét Loki: "window" (query lại cửa sổ LOKI_SCAN_RANGE_MINUTES) hoặc "cursor" (đọc tiếp từ timestamp cuối, phân trang)
+LOKI_INGEST_MODE = os.environ.get("LOKI_INGEST_MODE", "window").strip().lower()
+LOKI_SCAN_QUERY_LIMIT = int(os.environ.get("LOKI_SCAN_QUERY_LIMIT", 2000))
+LOKI_INGEST_DELAY_SECONDS = float(os.environ.get("LOKI_INGEST_DELAY_SECONDS", 5))
+LOKI_INGEST_MAX_PAGES_PER_POLL = int(os.environ.get("LOKI_INGEST_MAX_PAGES_PER_POLL", 20))
+LOKI_INGEST_MAX_BUFFERED_LINES = int(os.environ.get("LOKI_INGEST_MAX_BUFFERED_LINES", 50000))
+LOKI_INGEST_MAX_LINES_PER_POD = int(os.environ.get("LOKI_INGEST_MAX_LINES_PER_POD", 2000))
+# Số dòng log đáng ngờ tối đa giữ cho mỗi pod (giữ các dòng mới nhất) khi quét Loki và khi gom log chờ điều tra
+LOG_BATCH_MAX_LINES_PER_POD = int(os.environ.get("LOG_BATCH_MAX_LINES_PER_POD", 2000))
+# Gom log thành template (kiểu Drain) trước khi gửi Gemini
+LOG_TEMPLATE_MINING_ENABLED = os.environ.get("LOG_TEMPLATE_MINING_ENABLED", "true").lower() in ("1", "true", "yes")
+LOG_TEMPLATE_SIMILARITY = float(os.environ.get("LOG_TEMPLATE_SIMILARITY", 0.5))
+GEMINI_LOG_PROMPT_MAX_CHARS = int(os.environ.get("GEMINI_LOG_PROMPT_MAX_CHARS", 20000))
+# Triage tất định: lỗi quen thuộc (OOMKilled, ImagePullBackOff, Unschedulable...) được phân loại bằng luật, không gọi Gemini
+TRIAGE_ENABLED = os.environ.get("TRIAGE_ENABLED", "true").lower() in ("1", "true", "yes")
+# File luật YAML/JSON (thường mount từ ConfigMap); để trống dùng bộ luật mặc định app/triage_rules.yaml
+TRIAGE_RULES_FILE = os.environ.get("TRIAGE_RULES_FILE", "").strip() or DEFAULT_TRIAGE_RULES_FILE
+# Luật có confidence thấp hơn ngưỡng này vẫn chuyển pod cho Gemini
+TRIAGE_MIN_CONFIDENCE = float(os.environ.get("TRIAGE_MIN_CONFIDENCE", 0.8))
+# Cache kết quả phân tích Gemini theo fingerprint ngữ cảnh + template log
+ANALYSIS_CACHE_ENABLED = os.environ.get("ANALYSIS_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+ANALYSIS_CACHE_TTL_MINUTES = int(os.environ.get("ANALYSIS_CACHE_TTL_MINUTES", 60))
+ANALYSIS_CACHE_MAX_ENTRIES = int(os.environ.get("ANALYSIS_CACHE_MAX_ENTRIES", 1000))
+# Gom các pod lỗi theo workload (Deployment/StatefulSet/DaemonSet/Job) để phân tích và cảnh báo một lần
+WORKLOAD_GROUPING_ENABLED = os.environ.get("WORKLOAD_GROUPING_ENABLED", "true").lower() in ("1", "true", "yes")
+# Model dùng để phân tích (hiện chỉ có "gemini"; replay và test thay bằng model giả trong tests/fakes.py)
+MODEL_CLIENT = os.environ.get("MODEL_CLIENT", "gemini").strip().lower()
+# Gom nhiều pod vào một lần gọi Gemini (phản hồi là mảng JSON), giới hạn theo ngân sách token ước lượng
+GEMINI_BATCH_ENABLED = os.environ.get("GEMINI_BATCH_ENABLED", "true").lower() in ("1", "true", "yes")
+GEMINI_BATCH_TOKEN_BUDGET = int(os.environ.get("GEMINI_BATCH_TOKEN_BUDGET", 24000))
+GEMINI_BATCH_MAX_ITEMS = int(os.environ.get("GEMINI_BATCH_MAX_ITEMS", 8))
+GEMINI_BATCH_WINDOW_SECONDS = float(os.environ.get("GEMINI_BATCH_WINDOW_SECONDS", 1.0))
+# Gửi Telegram bất đồng bộ: gom cảnh báo cùng chat trong cửa sổ thành digest, retry với backoff / retry_after
+TELEGRAM_API_URL = os.environ.get("TELEGRAM_API_URL", "https://api.telegram.org")
+TELEGRAM_COALESCE_WINDOW_SECONDS = float(os.environ.get("TELEGRAM_COALESCE_WINDOW_SECONDS", 2))
+TELEGRAM_MAX_RETRIES = int(os.environ.get("TELEGRAM_MAX_RETRIES", 5))
+TELEGRAM_QUEUE_SIZE = int(os.environ.get("TELEGRAM_QUEUE_SIZE", 1000))
+# Lấy log chi tiết cho mọi pod trong chu kỳ bằng vài truy vấn gộp (selector pod=~"a|b|...") thay vì mỗi pod một truy vấn
+LOKI_BULK_FETCH_ENABLED = os.environ.get("LOKI_BULK_FETCH_ENABLED", "true").lower() in ("1", "true", "yes")
+LOKI_BULK_MAX_PODS_PER_QUERY = int(os.environ.get("LOKI_BULK_MAX_PODS_PER_QUERY", 20))
+LOKI_BULK_SUB_RANGE_MINUTES = float(os.environ.get("LOKI_BULK_SUB_RANGE_MINUTES", 10))
+LOKI_BULK_PAGE_LIMIT = int(os.environ.get("LOKI_BULK_PAGE_LIMIT", 5000))
+# Cổng HTTP phục vụ /metrics cho Prometheus (0 = tắt)
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 9090))
+# Ghi cProfile của từng chu kỳ ra CYCLE_PROFILE_DIR (có thể bật tạm thời qua GET /debug/profile?cycles=N trên cổng metrics)
+CYCLE_PROFILE_ENABLED = os.environ.get("CYCLE_PROFILE_ENABLED", "false").lower() in ("1", "true", "yes")
+CYCLE_PROFILE_DIR = os.environ.get("CYCLE_PROFILE_DIR", "/tmp/agent-profiles")
+CYCLE_PROFILE_KEEP = int(os.environ.get("CYCLE_PROFILE_KEEP", 20))
+# Endpoint /debug/profile không có xác thực: mặc định tắt (trả 404), mỗi yêu cầu profile tối đa PROFILE_MAX_CYCLES_PER_REQUEST chu kỳ
+DEBUG_PROFILE_ENDPOINT_ENABLED = os.environ.get("DEBUG_PROFILE_ENDPOINT_ENABLED", "false").lower() in ("1", "true", "yes")
+PROFILE_MAX_CYCLES_PER_REQUEST = 10
+# Chạy nhiều replica: mỗi replica giữ một Lease (coordination.k8s.io) và chỉ quét / truy vấn Loki / cảnh báo cho phần
+# namespace hoặc workload (SHARD_BY) được chia cho mình bằng consistent hashing
+SHARDING_ENABLED = os.environ.get("SHARDING_ENABLED", "false").lower() in ("1", "true", "yes")
+SHARD_BY = os.environ.get("SHARD_BY", "namespace").strip().lower()
+SHARD_IDENTITY = os.environ.get("SHARD_IDENTITY") or os.environ.get("POD_NAME") or socket.gethostname()
+SHARD_LEASE_NAMESPACE = os.environ.get("SHARD_LEASE_NAMESPACE") or os.environ.get("POD_NAMESPACE", "kube-observability")
+SHARD_GROUP = os.environ.get("SHARD_GROUP", "k8s-log-agent")
+SHARD_LEASE_DURATION_SECONDS = int(os.environ.get("SHARD_LEASE_DURATION_SECONDS", 30))
+SHARD_RENEW_INTERVAL_SECONDS = float(os.environ.get("SHARD_RENEW_INTERVAL_SECONDS", 10))
 
 
 try:
@@ -50,123 +171,331 @@ except Exception as e:
     logging.error(f"Could not load timezone 'Asia/Ho_Chi_Minh': {e}. Ensure timezone data is available.")
     HCM_TZ = timezone.utc
 
-# --- Cấu hình Kubernetes Client ---
-try: config.load_incluster_config(); logging.info("Loaded in-cluster Kubernetes config.")
-except config.ConfigException:
-    try: config.load_kube_config(); logging.info("Loaded local Kubernetes config (kubeconfig).")
-    except config.ConfigException: logging.error("Could not configure Kubernetes client. Exiting."); exit(1)
+# Các client bên ngoài được khởi tạo trong main() (hoặc được thay bằng stub khi replay), không phải lúc import
+k8s_core_v1 = None
+k8s_apps_v1 = None
+model_client = None
+cluster_cache = None
+cycle_wakeup_event = threading.Event()
+investigation_queue = InvestigationQueue(LOG_BATCH_MAX_LINES_PER_POD)
+loki_ingestor = None
+analysis_cache = None
+alert_state = None
+triage_engine = None
+workload_resolver = None
+batch_analyzer = None
+telegram_notifier = None
+loki_bulk_fetcher = None
+shard_coordinator = None
 
-k8s_core_v1 = client.CoreV1Api()
-k8s_apps_v1 = client.AppsV1Api()
+# --- Cấu hình Kubernetes Client / Gemini Client ---
+def init_kubernetes():
+    global k8s_core_v1, k8s_apps_v1
+    try: config.load_incluster_config(); logging.info("Loaded in-cluster Kubernetes config.")
+    except config.ConfigException:
+        try: config.load_kube_config(); logging.info("Loaded local Kubernetes config (kubeconfig).")
+        except config.ConfigException: logging.error("Could not configure Kubernetes client."); return False
+    k8s_core_v1 = client.CoreV1Api(); k8s_apps_v1 = client.AppsV1Api(); return True
 
-# Cấu hình Gemini Client
-if not GEMINI_API_KEY: logging.error("GEMINI_API_KEY is not set!"); exit(1)
-genai.configure(api_key=GEMINI_API_KEY)
-gemini_model = genai.GenerativeModel(GEMINI_MODEL_NAME)
+def init_model_client():
+    global model_client
+    if MODEL_CLIENT == "gemini" and not GEMINI_API_KEY: logging.error("GEMINI_API_KEY is not set!"); return False
+    try: model_client = create_model_client(MODEL_CLIENT, GEMINI_MODEL_NAME, GEMINI_API_KEY); return True
+    except ValueError as e: logging.error(f"{e}"); return False
+
+# --- Giới hạn đồng thời / tốc độ cho các backend ---
+BACKENDS = build_backends({
+    "k8s": (K8S_MAX_CONCURRENCY, K8S_RATE_PER_SECOND),
+    "loki": (LOKI_MAX_CONCURRENCY, LOKI_RATE_PER_SECOND),
+    "gemini": (GEMINI_MAX_CONCURRENCY, GEMINI_RATE_PER_SECOND),
+    "telegram": (TELEGRAM_MAX_CONCURRENCY, TELEGRAM_RATE_PER_SECOND),
+}, timeouts={"loki": (LOKI_TIMEOUT_MIN_SECONDS, LOKI_TIMEOUT_MAX_SECONDS), "gemini": (GEMINI_TIMEOUT_MIN_SECONDS, GEMINI_TIMEOUT_MAX_SECONDS)},
+   failure_threshold=BACKEND_BREAKER_FAILURE_THRESHOLD, reset_timeout_seconds=BACKEND_BREAKER_RESET_SECONDS)
+
+# --- Metric Prometheus (/metrics) ---
+METRICS = metrics.Registry()
+STAGE_SECONDS = METRICS.histogram("agent_stage_duration_seconds", "Duration of agent pipeline stages.", ["stage"])
+CYCLE_SECONDS = METRICS.histogram("agent_cycle_duration_seconds", "Duration of a monitoring cycle (scan, dispatch and wait for investigations).")
+PODS_INVESTIGATED = METRICS.counter("agent_pods_investigated_total", "Finished investigations by outcome.", ["outcome"])
+PODS_DISPATCHED = METRICS.gauge("agent_pods_dispatched", "Pods/workloads dispatched for investigation in the last cycle.")
+QUEUE_DEPTH = METRICS.gauge("agent_queue_depth", "Items waiting in internal queues.", ["queue"])
+IN_FLIGHT_INVESTIGATIONS = METRICS.gauge("agent_investigations_in_flight", "Investigations currently running.")
+COOLDOWN_ENTRIES = METRICS.gauge("agent_cooldown_entries", "Pods/workloads currently tracked for alert cooldown.")
+COOLDOWN_SUPPRESSED = METRICS.counter("agent_cooldown_suppressed_total", "Investigations skipped because the pod/workload was in alert cooldown.")
+PROMPT_CHARS = METRICS.histogram("agent_gemini_prompt_chars", "Size of Gemini prompts in characters.", ["kind"], buckets=metrics.SIZE_BUCKETS)
+PROMPT_TOKENS = METRICS.histogram("agent_gemini_prompt_tokens", "Size of Gemini prompts in tokens.", ["kind"], buckets=metrics.SIZE_BUCKETS)
+BACKEND_CIRCUIT_OPEN = METRICS.gauge("agent_backend_circuit_open", "1 if the backend circuit breaker is open.", ["backend"])
+BACKEND_TIMEOUT = METRICS.gauge("agent_backend_timeout_seconds", "Current adaptive timeout of the backend.", ["backend"])
+BACKEND_CALLS = METRICS.counter("agent_backend_calls_total", "Backend calls by result since start.", ["backend", "result"])
+for backend_name, backend in BACKENDS.items():
+    BACKEND_CIRCUIT_OPEN.set_function(lambda backend=backend: 0 if backend.available() else 1, backend=backend_name)
+    BACKEND_TIMEOUT.set_function(backend.timeout, backend=backend_name)
+    for result in ("calls", "errors", "timeouts", "rejected"): BACKEND_CALLS.set_function(lambda backend=backend, result=result: backend.stats[result], backend=backend_name, result=result)
+QUEUE_DEPTH.set_function(lambda: len(investigation_queue), queue="investigation")
+IN_FLIGHT_INVESTIGATIONS.set_function(lambda: alert_state.in_flight_count if alert_state else None)
+COOLDOWN_ENTRIES.set_function(lambda: alert_state.cooldown_count if alert_state else None)
+COOLDOWN_SUPPRESSED.set_function(lambda: alert_state.stats["suppressed"] if alert_state else None)
+QUEUE_DEPTH.set_function(lambda: db.pending(), queue="db_write")
+QUEUE_DEPTH.set_function(lambda: telegram_notifier.pending if telegram_notifier else None, queue="telegram")
+LOG_LINES_DROPPED = METRICS.counter("agent_log_lines_dropped_total", "Suspicious log lines evicted by the per-pod line cap.", ["path"])
+TRIAGE_RESULTS = METRICS.counter("agent_triage_results_total", "Triage rule evaluations by result (hit, low_confidence, miss).", ["result"])
+TRIAGE_RULE_HITS = METRICS.counter("agent_triage_rule_hits_total", "Pods matched by each triage rule (including low-confidence matches sent to Gemini).", ["rule"])
+for result, key in (("hit", "hits"), ("low_confidence", "low_confidence"), ("miss", "misses")): TRIAGE_RESULTS.set_function(lambda key=key: triage_engine.stats[key] if triage_engine else None, result=result)
+SHARD_MEMBERS = METRICS.gauge("agent_shard_members", "Live agent replicas sharing the scan (sharded mode).")
+SHARD_OWNED_NAMESPACES = METRICS.gauge("agent_shard_owned_namespaces", "Namespaces scanned by this replica.")
+SHARD_REBALANCES = METRICS.counter("agent_shard_rebalances_total", "Shard membership changes seen by this replica.")
+SHARD_MEMBERS.set_function(lambda: len(shard_coordinator.members) if shard_coordinator else None)
+SHARD_OWNED_NAMESPACES.set_function(lambda: len(owned_namespaces()))
+SHARD_REBALANCES.set_function(lambda: shard_coordinator.stats["rebalances"] if shard_coordinator else None)
+
+def timed_stage(stage):
+    return metrics.timed(STAGE_SECONDS, stage=stage)
+
+# --- cProfile theo chu kỳ (chỉ đo luồng vòng lặp chính: quét K8s/Loki và dispatch) ---
+profile_cycles_requested = 0
+
+def request_cycle_profile(query):
+    global profile_cycles_requested
+    try: cycles = int(query.get("cycles", ["1"])[0])
+    except ValueError: return 400, "cycles must be an integer\n"
+    profile_cycles_requested = min(max(0, cycles), PROFILE_MAX_CYCLES_PER_REQUEST)
+    return 200, f"Profiling the next {profile_cycles_requested} cycles into {CYCLE_PROFILE_DIR}\n"
+
+def metrics_handlers():
+    # Đường dẫn không đăng ký được server metrics trả 404
+    return {"/debug/profile": request_cycle_profile} if DEBUG_PROFILE_ENDPOINT_ENABLED else {}
+
+def start_cycle_profile():
+    if not CYCLE_PROFILE_ENABLED and profile_cycles_requested <= 0: return None
+    profiler = cProfile.Profile(); profiler.enable(); return profiler
+
+def finish_cycle_profile(profiler):
+    global profile_cycles_requested
+    if profiler is None: return
+    profiler.disable(); profile_cycles_requested = max(0, profile_cycles_requested - 1)
+    try:
+        os.makedirs(CYCLE_PROFILE_DIR, exist_ok=True)
+        path = os.path.join(CYCLE_PROFILE_DIR, f"cycle-{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')}.prof"); profiler.dump_stats(path)
+        for old in sorted(f for f in os.listdir(CYCLE_PROFILE_DIR) if f.endswith(".prof"))[:-CYCLE_PROFILE_KEEP or None]: os.remove(os.path.join(CYCLE_PROFILE_DIR, old))
+        logging.info(f"Wrote cycle profile to {path}")
+    except OSError as e: logging.error(f"Could not write cycle profile: {e}")
 
 # --- Logic Database ---
-gemini_calls_counter = 0
-telegram_alerts_counter = 0
-db_lock = threading.Lock()
+# Bộ đếm chờ ghi xuống DB (daily_stats + hourly_stats) ở lần flush kế tiếp
+pending_stats = Counter()
+counters_lock = threading.Lock()
+DAILY_STAT_COLUMNS = ("gemini_calls", "telegram_alerts", "analysis_cache_hits", "analysis_cache_misses")
+DAILY_STAT_COLUMNS += ("triage_hits", "triage_misses")
+HOURLY_STAT_COLUMNS = DAILY_STAT_COLUMNS + ("gemini_latency_ms", "gemini_prompt_tokens", "gemini_output_tokens")
+
+def count_stat(**values):
+    with counters_lock: pending_stats.update(values)
+
+def save_pending_stats(cursor):
+    # Chạy trên luồng writer: ảnh chụp lấy lúc ghi nên luôn mới hơn mọi lần flush đã xếp hàng trước đó
+    with counters_lock: values = [(column, pending_stats[column]) for column in HOURLY_STAT_COLUMNS]
+    cursor.executemany('INSERT OR REPLACE INTO pending_stats (name, value) VALUES (?, ?)', values)
+# Kết nối ghi lâu dài; mọi thao tác ghi đi qua luồng writer của storage
+db = storage.Storage(DB_PATH, max_batch_size=DB_WRITE_BATCH_SIZE, on_commit=lambda seconds, ops: STAGE_SECONDS.observe(seconds, stage="db_write"))
 
 def init_db():
-    db_dir = os.path.dirname(DB_PATH)
-    if not os.path.exists(db_dir):
-        try: os.makedirs(db_dir); logging.info(f"Created directory for database: {db_dir}")
-        except OSError as e: logging.error(f"Could not create directory {db_dir}: {e}"); return False
-    try:
-        with db_lock:
-            conn = sqlite3.connect(DB_PATH, timeout=10); cursor = conn.cursor()
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS incidents (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp TEXT NOT NULL, pod_key TEXT NOT NULL,
-                    severity TEXT NOT NULL, summary TEXT, initial_reasons TEXT, k8s_context TEXT, sample_logs TEXT ) ''')
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS daily_stats (
-                    date TEXT PRIMARY KEY, gemini_calls INTEGER DEFAULT 0,
-                    telegram_alerts INTEGER DEFAULT 0, incident_count INTEGER DEFAULT 0 ) ''')
-            conn.commit(); conn.close(); logging.info(f"Database initialized successfully at {DB_PATH}"); return True
+    try: db.open(schema.MIGRATIONS)
+    except OSError as e: logging.error(f"Could not create directory for database {DB_PATH}: {e}"); return False
     except sqlite3.Error as e: logging.error(f"Database error during initialization: {e}"); return False
     except Exception as e: logging.error(f"Unexpected error during DB initialization: {e}", exc_info=True); return False
+    logging.info(f"Database initialized successfully at {DB_PATH} (WAL mode)."); restore_pending_stats(); return True
 
-def record_incident(pod_key, severity, summary, initial_reasons, k8s_context, sample_logs):
-    timestamp_str = datetime.now(timezone.utc).isoformat()
-    try:
-        with db_lock:
-            conn = sqlite3.connect(DB_PATH, timeout=10); cursor = conn.cursor()
-            cursor.execute(''' INSERT INTO incidents (timestamp, pod_key, severity, summary, initial_reasons, k8s_context, sample_logs)
-                                VALUES (?, ?, ?, ?, ?, ?, ?) ''',
-                            (timestamp_str, pod_key, severity, summary, initial_reasons, k8s_context, sample_logs))
-            today_str = datetime.now(timezone.utc).strftime('%Y-%m-%d')
-            cursor.execute(''' INSERT INTO daily_stats (date, incident_count) VALUES (?, 1)
-                                ON CONFLICT(date) DO UPDATE SET incident_count = incident_count + 1 ''', (today_str,))
-            conn.commit(); conn.close(); logging.info(f"Recorded incident for {pod_key} with severity {severity}")
-    except sqlite3.Error as e: logging.error(f"Database error recording incident for {pod_key}: {e}")
-    except Exception as e: logging.error(f"Unexpected error recording incident for {pod_key}: {e}", exc_info=True)
+def restore_pending_stats():
+    """Nạp lại các bộ đếm chưa kịp flush vào daily_stats/hourly_stats trước lần dừng trước."""
+    try: rows = db.run(lambda cursor: cursor.execute('SELECT name, value FROM pending_stats WHERE value != 0').fetchall())
+    except sqlite3.Error as e: logging.error(f"Database error restoring pending stats: {e}"); return
+    restored = {name: value for name, value in rows if name in HOURLY_STAT_COLUMNS}
+    if restored:
+        with counters_lock: pending_stats.update(restored)
+        logging.info(f"Restored unflushed stats counters from the previous run: {restored}")
+
+last_stats_checkpoint = None
+
+def checkpoint_stats():
+    """Ghi bộ đếm chưa flush xuống bảng pending_stats (chỉ khi có thay đổi từ lần ghi trước)."""
+    global last_stats_checkpoint
+    with counters_lock: values = {column: pending_stats[column] for column in HOURLY_STAT_COLUMNS}
+    if values == last_stats_checkpoint: return
+    last_stats_checkpoint = values; db.write(save_pending_stats)
+
+def record_incident(pod_key, severity, summary, initial_reasons, k8s_context, sample_logs, log_templates=None, workload=None):
+    now_utc = datetime.now(timezone.utc); timestamp_str = now_utc.isoformat(); today_str = now_utc.strftime('%Y-%m-%d')
+    # Nén trước ở luồng gọi để luồng writer chỉ phải ghi
+    details = tuple(storage.compress_text(value, DB_COMPRESS_MIN_BYTES) for value in (k8s_context, sample_logs, log_templates))
+    hour_epoch = int(now_utc.timestamp()) // 3600 * 3600; namespace = pod_key.split('/', 1)[0]
+    def write(cursor):
+        cursor.execute(''' INSERT INTO incidents (timestamp, ts_epoch, pod_key, severity, summary, initial_reasons, workload)
+                            VALUES (?, ?, ?, ?, ?, ?, ?) ''',
+                        (timestamp_str, int(now_utc.timestamp()), pod_key, severity, summary, initial_reasons, workload))
+        cursor.execute('INSERT INTO incident_details (incident_id, k8s_context, sample_logs, log_templates) VALUES (?, ?, ?, ?)', (cursor.lastrowid, *details))
+        cursor.execute(''' INSERT INTO daily_stats (date, incident_count) VALUES (?, 1)
+                            ON CONFLICT(date) DO UPDATE SET incident_count = incident_count + 1 ''', (today_str,))
+        cursor.execute(''' INSERT INTO hourly_incidents (hour, namespace, severity, incident_count) VALUES (?, ?, ?, 1)
+                            ON CONFLICT(hour, namespace, severity) DO UPDATE SET incident_count = incident_count + 1 ''', (hour_epoch, namespace, severity))
+    # Không chờ commit: writer gom các incident lại và commit theo nhóm
+    db.write(write); logging.info(f"Queued incident record for {pod_key} with severity {severity}")
 
 def update_daily_stats():
-    global gemini_calls_counter, telegram_alerts_counter
-    if gemini_calls_counter == 0 and telegram_alerts_counter == 0: return
-    today_str = datetime.now(timezone.utc).strftime('%Y-%m-%d')
-    calls_to_add = gemini_calls_counter; alerts_to_add = telegram_alerts_counter
+    with counters_lock:
+        if not any(pending_stats[column] for column in HOURLY_STAT_COLUMNS): return
+    now_utc = datetime.now(timezone.utc); today_str = now_utc.strftime('%Y-%m-%d'); hour_epoch = int(now_utc.timestamp()) // 3600 * 3600; to_add = {}
+    def write(cursor):
+        # Lấy và trừ bộ đếm ngay trên luồng writer, cùng transaction với việc ghi phần còn lại vào pending_stats
+        with counters_lock: to_add.update({column: pending_stats[column] for column in HOURLY_STAT_COLUMNS}); pending_stats.subtract(to_add)
+        cursor.execute('INSERT OR IGNORE INTO daily_stats (date) VALUES (?)', (today_str,))
+        cursor.execute(f''' UPDATE daily_stats SET {", ".join(f"{column} = {column} + ?" for column in DAILY_STAT_COLUMNS)}
+                            WHERE date = ? ''', (*(to_add[column] for column in DAILY_STAT_COLUMNS), today_str))
+        # Bộ đếm được gán cho giờ của lần flush (sai lệch tối đa STATS_UPDATE_INTERVAL_SECONDS)
+        cursor.execute('INSERT OR IGNORE INTO hourly_stats (hour) VALUES (?)', (hour_epoch,))
+        cursor.execute(f''' UPDATE hourly_stats SET {", ".join(f"{column} = {column} + ?" for column in HOURLY_STAT_COLUMNS)}
+                            WHERE hour = ? ''', (*(to_add[column] for column in HOURLY_STAT_COLUMNS), hour_epoch))
+        save_pending_stats(cursor)
     try:
-        with db_lock:
-            conn = sqlite3.connect(DB_PATH, timeout=10); cursor = conn.cursor()
-            cursor.execute('INSERT OR IGNORE INTO daily_stats (date) VALUES (?)', (today_str,))
-            cursor.execute(''' UPDATE daily_stats SET gemini_calls = gemini_calls + ?, telegram_alerts = telegram_alerts + ?
-                                WHERE date = ? ''', (calls_to_add, alerts_to_add, today_str))
-            conn.commit(); conn.close()
-            logging.info(f"Updated daily stats for {today_str}: +{calls_to_add} Gemini calls, +{alerts_to_add} Telegram alerts.")
-            gemini_calls_counter = 0; telegram_alerts_counter = 0
-    except sqlite3.Error as e: logging.error(f"Database error updating daily stats: {e}")
-    except Exception as e: logging.error(f"Unexpected error updating daily stats: {e}", exc_info=True)
+        db.run(write)
+        logging.info(f"Updated daily stats for {today_str}: +{to_add['gemini_calls']} Gemini calls ({to_add['gemini_latency_ms']} ms, {to_add['gemini_prompt_tokens']}/{to_add['gemini_output_tokens']} prompt/output tokens), +{to_add['telegram_alerts']} Telegram alerts, +{to_add['analysis_cache_hits']}/{to_add['analysis_cache_misses']} analysis cache hits/misses.")
+    except Exception as e:
+        # Transaction bị rollback: trả bộ đếm lại để lần flush sau ghi tiếp
+        with counters_lock: pending_stats.update(to_add)
+        if isinstance(e, sqlite3.Error): logging.error(f"Database error updating daily stats: {e}")
+        else: logging.error(f"Unexpected error updating daily stats: {e}", exc_info=True)
+
+def run_retention():
+    """Gộp và xóa incident quá hạn INCIDENT_RETENTION_DAYS, bucket theo giờ quá HOURLY_ROLLUP_RETENTION_DAYS và kết quả phân tích hết TTL,
+    sau đó thu hồi dung lượng trống của file DB."""
+    now = time.time(); pruned = pruned_hourly = pruned_cache = 0
+    try:
+        if INCIDENT_RETENTION_DAYS > 0:
+            cutoff_epoch = int(now) - INCIDENT_RETENTION_DAYS * 86400; pruned = db.run(lambda cursor: schema.prune_incidents(cursor, cutoff_epoch))
+            if pruned: logging.info(f"Retention pruned {pruned} incidents older than {INCIDENT_RETENTION_DAYS} days into daily rollups.")
+        if HOURLY_ROLLUP_RETENTION_DAYS > 0:
+            cutoff_hour = int(now) - HOURLY_ROLLUP_RETENTION_DAYS * 86400; pruned_hourly = db.run(lambda cursor: schema.prune_hourly_rollups(cursor, cutoff_hour))
+            if pruned_hourly: logging.info(f"Retention pruned {pruned_hourly} hourly rollup rows older than {HOURLY_ROLLUP_RETENTION_DAYS} days.")
+        if analysis_cache is not None:
+            pruned_cache = db.run(lambda cursor: schema.prune_analysis_cache(cursor, now - ANALYSIS_CACHE_TTL_MINUTES * 60))
+            if pruned_cache: logging.info(f"Retention pruned {pruned_cache} expired analysis cache entries.")
+        if pruned or pruned_hourly or pruned_cache: db.run(schema.incremental_vacuum, transaction=False)
+    except sqlite3.Error as e: logging.error(f"Database error during retention: {e}")
+
+def record_backend_health():
+    """Ghi ảnh chụp sức khỏe của từng backend (circuit, độ trễ, timeout, bộ đếm) để portal hiển thị qua /api/backends."""
+    now_epoch = int(time.time()); snapshots = [backend.health() for backend in BACKENDS.values()]
+    for health in snapshots:
+        if health["state"] != "closed" or health["errors"]: logging.info(f"Backend health: {health}")
+    def write(cursor):
+        cursor.executemany(''' INSERT INTO backend_health (name, health, updated_epoch) VALUES (?, ?, ?)
+                                ON CONFLICT(name) DO UPDATE SET health = excluded.health, updated_epoch = excluded.updated_epoch ''',
+                           [(health["name"], json.dumps(health), now_epoch) for health in snapshots])
+    db.write(write)
 
 def periodic_stat_update():
-    while True: time.sleep(STATS_UPDATE_INTERVAL_SECONDS); update_daily_stats()
+    next_retention = 0; next_stats_update = time.monotonic() + STATS_UPDATE_INTERVAL_SECONDS
+    while True:
+        if time.monotonic() >= next_retention: run_retention(); next_retention = time.monotonic() + RETENTION_INTERVAL_MINUTES * 60
+        wait_seconds = max(0, next_stats_update - time.monotonic())
+        time.sleep(min(wait_seconds, STATS_CHECKPOINT_INTERVAL_SECONDS) if STATS_CHECKPOINT_INTERVAL_SECONDS > 0 else wait_seconds)
+        if time.monotonic() < next_stats_update: checkpoint_stats(); continue
+        update_daily_stats(); record_backend_health(); next_stats_update = time.monotonic() + STATS_UPDATE_INTERVAL_SECONDS
+        if alert_state is not None: alert_state.prune()
 
 # --- Các hàm lấy thông tin Kubernetes ---
-def get_pod_info(namespace, pod_name):
+def k8s_call(func, deadline=None, **kwargs):
+    with BACKENDS["k8s"].slot(deadline): return func(**kwargs)
+
+def pod_to_info(pod):
+    info = {"name": pod.metadata.name,"namespace": pod.metadata.namespace,"status": pod.status.phase,"node_name": pod.spec.node_name,"start_time": pod.status.start_time.isoformat() if pod.status.start_time else "N/A","restarts": sum(cs.restart_count for cs in pod.status.container_statuses) if pod.status.container_statuses else 0,"conditions": {cond.type: {"status": cond.status, "reason": cond.reason, "message": cond.message} for cond in pod.status.conditions} if pod.status.conditions else {},"container_statuses": {}}
+    if pod.status.container_statuses:
+        for cs in pod.status.container_statuses:
+            state_info = "N/A";
+            if cs.state:
+                if cs.state.running: state_info = "Running"
+                elif cs.state.waiting: state_info = f"Waiting ({cs.state.waiting.reason})"
+                elif cs.state.terminated: state_info = f"Terminated ({cs.state.terminated.reason}, ExitCode: {cs.state.terminated.exit_code})"
+            # Lý do / exit code dạng có cấu trúc (trạng thái hiện tại và lần terminated trước) cho luật triage
+            waiting = cs.state.waiting if cs.state else None; terminated = cs.state.terminated if cs.state else None; last_terminated = cs.last_state.terminated if cs.last_state else None
+            info["container_statuses"][cs.name] = {"ready": cs.ready,"restart_count": cs.restart_count,"state": state_info,"waiting_reason": waiting.reason if waiting else None,"terminated_reason": terminated.reason if terminated else None,
+                                                   "exit_code": (terminated or last_terminated).exit_code if terminated or last_terminated else None,"last_reason": last_terminated.reason if last_terminated else None}
+    return info
+
+def node_to_info(node):
+    conditions = {cond.type: {"status": cond.status, "reason": cond.reason, "message": cond.message} for cond in node.status.conditions} if node.status.conditions else {}
+    return {"name": node.metadata.name,"conditions": conditions,"allocatable_cpu": node.status.allocatable.get('cpu', 'N/A'),"allocatable_memory": node.status.allocatable.get('memory', 'N/A'),"kubelet_version": node.status.node_info.kubelet_version}
+
+def events_to_recent(events, since_time, max_events=10):
+    recent_events = []
+    sorted_events = sorted(events, key=lambda e: e.last_timestamp or e.metadata.creation_timestamp or datetime(MINYEAR, 1, 1, tzinfo=timezone.utc), reverse=True)
+    for event in sorted_events:
+        event_time = event.last_timestamp or event.metadata.creation_timestamp
+        if event_time and event_time >= since_time: recent_events.append({"time": event_time.isoformat(),"type": event.type,"reason": event.reason,"message": event.message,"count": event.count})
+        if len(recent_events) >= max_events or (event_time and event_time < since_time): break
+    return recent_events
+
+def fetch_pod_object(namespace, pod_name):
+    pod = cluster_cache.get_pod(namespace, pod_name) if cluster_cache else None
+    return pod if pod is not None else k8s_call(k8s_core_v1.read_namespaced_pod, name=pod_name, namespace=namespace)
+
+# --- Chia shard giữa các replica ---
+def owns_namespace(namespace):
+    """Replica này có quét namespace không (luôn đúng khi không chạy sharded hoặc chia theo workload)."""
+    return shard_coordinator is None or SHARD_BY != "namespace" or shard_coordinator.owns(namespace)
+
+def owned_namespaces():
+    return [ns for ns in K8S_NAMESPACES if owns_namespace(ns)]
+
+def owns_pod(namespace, pod_name, pod=None):
+    if shard_coordinator is None: return True
+    if SHARD_BY == "namespace": return shard_coordinator.owns(namespace)
+    if pod is None:
+        try: pod = fetch_pod_object(namespace, pod_name)
+        except Exception: pod = None
+    return shard_coordinator.owns(workload_shard_key(namespace, pod_name, pod))
+
+def filter_owned_pods(pods_by_key):
+    if shard_coordinator is None: return pods_by_key
+    owned = {pod_key: value for pod_key, value in pods_by_key.items() if owns_pod(*pod_key.split('/', 1))}
+    if len(owned) < len(pods_by_key): logging.info(f"Skipping {len(pods_by_key) - len(owned)} pods owned by other shards.")
+    return owned
+
+def on_shard_change(old_members, new_members):
+    global loki_ingestor
+    logging.info(f"Shard rebalance: {len(new_members)} replicas; this replica now scans namespaces {owned_namespaces()}.")
+    # Truy vấn quét Loki của chế độ cursor chứa danh sách namespace: tạo lại ở lần poll tới theo phân chia mới
+    if SHARD_BY == "namespace": loki_ingestor = None
+
+def get_pod_info(namespace, pod_name, deadline=None):
     try:
-        pod = k8s_core_v1.read_namespaced_pod(name=pod_name, namespace=namespace)
-        info = {"name": pod.metadata.name,"namespace": pod.metadata.namespace,"status": pod.status.phase,"node_name": pod.spec.node_name,"start_time": pod.status.start_time.isoformat() if pod.status.start_time else "N/A","restarts": sum(cs.restart_count for cs in pod.status.container_statuses) if pod.status.container_statuses else 0,"conditions": {cond.type: {"status": cond.status, "reason": cond.reason, "message": cond.message} for cond in pod.status.conditions} if pod.status.conditions else {},"container_statuses": {}}
-        if pod.status.container_statuses:
-            for cs in pod.status.container_statuses:
-                state_info = "N/A";
-                if cs.state:
-                    if cs.state.running: state_info = "Running"
-                    elif cs.state.waiting: state_info = f"Waiting ({cs.state.waiting.reason})"
-                    elif cs.state.terminated: state_info = f"Terminated ({cs.state.terminated.reason}, ExitCode: {cs.state.terminated.exit_code})"
-                info["container_statuses"][cs.name] = {"ready": cs.ready,"restart_count": cs.restart_count,"state": state_info}
-        return info
+        pod = cluster_cache.get_pod(namespace, pod_name) if cluster_cache else None
+        if pod is None: pod = k8s_call(k8s_core_v1.read_namespaced_pod, deadline, name=pod_name, namespace=namespace)
+        return pod_to_info(pod)
     except ApiException as e: logging.warning(f"Could not get pod info for {namespace}/{pod_name}: {e.status} {e.reason}"); return None
+    except DeadlineExceeded: raise
     except Exception as e: logging.error(f"Unexpected error getting pod info for {namespace}/{pod_name}: {e}", exc_info=True); return None
 
-def get_node_info(node_name):
+def get_node_info(node_name, deadline=None):
     if not node_name: return None
     try:
-        node = k8s_core_v1.read_node(name=node_name)
-        conditions = {cond.type: {"status": cond.status, "reason": cond.reason, "message": cond.message} for cond in node.status.conditions} if node.status.conditions else {}
-        info = {"name": node.metadata.name,"conditions": conditions,"allocatable_cpu": node.status.allocatable.get('cpu', 'N/A'),"allocatable_memory": node.status.allocatable.get('memory', 'N/A'),"kubelet_version": node.status.node_info.kubelet_version}
-        return info
+        node = cluster_cache.get_node(node_name) if cluster_cache else None
+        if node is None: node = k8s_call(k8s_core_v1.read_node, deadline, name=node_name)
+        return node_to_info(node)
     except ApiException as e: logging.warning(f"Could not get node info for {node_name}: {e.status} {e.reason}"); return None
+    except DeadlineExceeded: raise
     except Exception as e: logging.error(f"Unexpected error getting node info for {node_name}: {e}", exc_info=True); return None
 
-def get_pod_events(namespace, pod_name, since_minutes=15):
+def get_pod_events(namespace, pod_name, since_minutes=15, deadline=None):
     try:
         since_time = datetime.now(timezone.utc) - timedelta(minutes=since_minutes)
+        if cluster_cache and cluster_cache.has_synced_events(namespace): return events_to_recent(cluster_cache.events_for_pod(namespace, pod_name), since_time)
         field_selector = f"involvedObject.kind=Pod,involvedObject.name={pod_name},involvedObject.namespace={namespace}"
-        events = k8s_core_v1.list_namespaced_event(namespace=namespace, field_selector=field_selector, limit=10)
-        recent_events = []
-        if events and events.items:
-                sorted_events = sorted(events.items, key=lambda e: e.last_timestamp or e.metadata.creation_timestamp or datetime(MINYEAR, 1, 1, tzinfo=timezone.utc), reverse=True)
-                for event in sorted_events:
-                    event_time = event.last_timestamp or event.metadata.creation_timestamp
-                    if event_time and event_time >= since_time: recent_events.append({"time": event_time.isoformat(),"type": event.type,"reason": event.reason,"message": event.message,"count": event.count})
-                    if len(recent_events) >= 10 or (event_time and event_time < since_time): break
-        return recent_events
+        events = k8s_call(k8s_core_v1.list_namespaced_event, deadline, namespace=namespace, field_selector=field_selector, limit=10)
+        return events_to_recent(events.items, since_time) if events and events.items else []
     except ApiException as e:
         if e.status != 403: logging.warning(f"Could not list events for pod {namespace}/{pod_name}: {e.status} {e.reason}")
         return []
+    except DeadlineExceeded: raise
     except Exception as e: logging.error(f"Unexpected error listing events for pod {namespace}/{pod_name}: {e}", exc_info=True); return []
 
 def format_k8s_context(pod_info, node_info, pod_events):
@@ -193,68 +522,104 @@ def format_k8s_context(pod_info, node_info, pod_events):
     context_str += "--- Kết thúc ngữ cảnh ---\n"; return context_str
 
 # --- HÀM MỚI: Quét Loki tìm log đáng ngờ ---
+def log_level_index(level_name):
+    try: return level_index(level_name, default=None)
+    except ValueError: logging.warning(f"Invalid LOKI_SCAN_MIN_LEVEL: {level_name}. Defaulting to WARNING."); return level_index("WARNING")
+
+def build_loki_scan_query(namespaces=None):
+    levels_to_scan = LOG_LEVELS[log_level_index(LOKI_SCAN_MIN_LEVEL):]
+    namespace_regex = "|".join(K8S_NAMESPACES if namespaces is None else namespaces)
+    keywords_to_find = levels_to_scan + SCAN_KEYWORDS
+    escaped_keywords = [re.escape(k) for k in keywords_to_find]
+    regex_pattern = "(?i)(" + "|".join(escaped_keywords) + ")"
+    return f'{{namespace=~"{namespace_regex}"}} |~ `{regex_pattern}`'
+
+@timed_stage("scan_loki_for_suspicious_logs")
 def scan_loki_for_suspicious_logs(start_time, end_time):
     loki_api_endpoint = f"{LOKI_URL}/loki/api/v1/query_range"
     if not K8S_NAMESPACES: logging.error("No namespaces configured."); return {}
-    log_levels_all = ["DEBUG", "INFO", "NOTICE", "WARNING", "ERROR", "CRITICAL", "ALERT", "EMERGENCY"]
-    scan_level_index = -1
-    try: scan_level_index = log_levels_all.index(LOKI_SCAN_MIN_LEVEL.upper())
-    except ValueError: logging.warning(f"Invalid LOKI_SCAN_MIN_LEVEL: {LOKI_SCAN_MIN_LEVEL}. Defaulting to WARNING."); scan_level_index = log_levels_all.index("WARNING")
-    levels_to_scan = log_levels_all[scan_level_index:]
-    namespace_regex = "|".join(K8S_NAMESPACES)
-    keywords_to_find = levels_to_scan + ["fail", "crash", "exception", "panic", "fatal"]
-    escaped_keywords = [re.escape(k) for k in keywords_to_find]
-    regex_pattern = "(?i)(" + "|".join(escaped_keywords) + ")"
-    logql_query = f'{{namespace=~"{namespace_regex}"}} |~ `{regex_pattern}`'
-    query_limit_scan = 2000
-    params = {'query': logql_query,'start': int(start_time.timestamp() * 1e9),'end': int(end_time.timestamp() * 1e9),'limit': query_limit_scan,'direction': 'forward'}
+    namespaces = owned_namespaces()
+    if not namespaces: logging.info("No namespaces assigned to this shard; skipping Loki scan."); return {}
+    logql_query = build_loki_scan_query(namespaces)
+    params = {'query': logql_query,'start': int(start_time.timestamp() * 1e9),'end': int(end_time.timestamp() * 1e9),'limit': LOKI_SCAN_QUERY_LIMIT,'direction': 'forward'}
     logging.info(f"Scanning Loki for suspicious logs (Level >= {LOKI_SCAN_MIN_LEVEL} or keywords): {logql_query[:200]}...")
     suspicious_logs_by_pod = {}
     try:
         headers = {'Accept': 'application/json'}
-        response = requests.get(loki_api_endpoint, params=params, headers=headers, timeout=60); response.raise_for_status(); data = response.json()
+        response = BACKENDS["loki"].get(loki_api_endpoint, params=params, headers=headers, timeout=60); response.raise_for_status(); data = response.json()
         if 'data' in data and 'result' in data['data']:
             count = 0
             for stream in data['data']['result']:
                 labels = stream.get('stream', {}); ns = labels.get('namespace'); pod_name = labels.get('pod')
                 if not ns or not pod_name: continue
-                pod_key = f"{ns}/{pod_name}"
-                if pod_key not in suspicious_logs_by_pod: suspicious_logs_by_pod[pod_key] = []
-                for timestamp_ns, log_line in stream['values']:
-                    log_entry = {"timestamp": datetime.fromtimestamp(int(timestamp_ns) / 1e9, tz=timezone.utc), "message": log_line.strip(), "labels": labels}
-                    suspicious_logs_by_pod[pod_key].append(log_entry); count += 1
-            logging.info(f"Loki scan found {count} suspicious log entries across {len(suspicious_logs_by_pod)} pods.")
+                pod_key = f"{ns}/{pod_name}"; batch = suspicious_logs_by_pod.get(pod_key)
+                if batch is None: batch = suspicious_logs_by_pod[pod_key] = LogBatch(LOG_BATCH_MAX_LINES_PER_POD)
+                values = stream['values']; classifications = log_classifier.classify_batch([log_line for _, log_line in values]); label_id = batch.add_labels(labels)
+                for (timestamp_ns, log_line), (level, _) in zip(values, classifications): batch.append(int(timestamp_ns), log_line, label_id, level); count += 1
+            dropped = sum(batch.dropped for batch in suspicious_logs_by_pod.values())
+            if dropped: LOG_LINES_DROPPED.inc(dropped, path="scan")
+            logging.info(f"Loki scan found {count} suspicious log entries across {len(suspicious_logs_by_pod)} pods ({dropped} dropped by the per-pod cap of {LOG_BATCH_MAX_LINES_PER_POD}).")
+            if count >= LOKI_SCAN_QUERY_LIMIT: logging.warning(f"Loki scan hit the query limit ({LOKI_SCAN_QUERY_LIMIT}); results are truncated. Consider LOKI_INGEST_MODE=cursor.")
         else: logging.info("Loki scan found no suspicious log entries.")
         return suspicious_logs_by_pod
     except requests.exceptions.HTTPError as e:
         if e.response.status_code == 400: error_detail = e.response.text[:500]; logging.error(f"Error scanning Loki (400 Bad Request): Invalid LogQL query? Query: '{logql_query}'. Loki Response: {error_detail}")
         else: logging.error(f"Error scanning Loki (HTTP Error {e.response.status_code}): {e}")
         return {}
+    except CircuitOpenError as e: logging.warning(f"Skipping Loki scan: {e}. Only Kubernetes state is scanned this cycle."); return {}
     except requests.exceptions.RequestException as e: logging.error(f"Error scanning Loki: {e}"); return {}
     except json.JSONDecodeError as e: logging.error(f"Error decoding Loki scan response: {e}"); return {}
     except Exception as e: logging.error(f"Unexpected error during Loki scan: {e}", exc_info=True); return {}
 
+@timed_stage("ingest_loki_suspicious_logs")
+def ingest_loki_suspicious_logs():
+    """Chế độ cursor: lấy các log đáng ngờ mới kể từ lần đọc trước thay vì query lại cả cửa sổ."""
+    global loki_ingestor
+    if not K8S_NAMESPACES: logging.error("No namespaces configured."); return {}
+    namespaces = owned_namespaces()
+    if not namespaces: logging.info("No namespaces assigned to this shard; skipping Loki ingest."); return {}
+    if loki_ingestor is None:
+        loki_ingestor = LokiCursorIngestor(LOKI_URL, build_loki_scan_query(namespaces), page_limit=LOKI_SCAN_QUERY_LIMIT, max_pages_per_poll=LOKI_INGEST_MAX_PAGES_PER_POLL,
+                                           ingest_delay_seconds=LOKI_INGEST_DELAY_SECONDS, initial_lookback_seconds=LOKI_SCAN_RANGE_MINUTES * 60,
+                                           max_buffered_lines=LOKI_INGEST_MAX_BUFFERED_LINES, max_lines_per_pod=LOKI_INGEST_MAX_LINES_PER_POD, session=BACKENDS["loki"])
+    dropped = loki_ingestor.stats["lines_dropped"]; loki_ingestor.poll(); suspicious_logs_by_pod = loki_ingestor.drain()
+    if loki_ingestor.stats["lines_dropped"] > dropped: LOG_LINES_DROPPED.inc(loki_ingestor.stats["lines_dropped"] - dropped, path="ingest")
+    logging.info(f"Loki cursor ingest: {sum(len(v) for v in suspicious_logs_by_pod.values())} new suspicious entries across {len(suspicious_logs_by_pod)} pods. Stats: {loki_ingestor.stats}")
+    return suspicious_logs_by_pod
+
+def fetch_suspicious_logs(start_time, end_time):
+    if LOKI_INGEST_MODE == "cursor": return filter_owned_pods(ingest_loki_suspicious_logs())
+    return filter_owned_pods(scan_loki_for_suspicious_logs(start_time, end_time))
+
 # --- HÀM MỚI: Quét Kubernetes tìm Pod có vấn đề ---
+def detect_pod_issue(pod):
+    """Trả về lý do (tiếng Việt) nếu pod có dấu hiệu bất thường, ngược lại trả về None."""
+    if pod.status.phase in ["Failed", "Unknown"]: return f"Trạng thái Pod là {pod.status.phase}"
+    if pod.status.phase == "Pending" and pod.status.conditions:
+            scheduled_condition = next((c for c in pod.status.conditions if c.type == "PodScheduled"), None)
+            if scheduled_condition and scheduled_condition.status == "False" and scheduled_condition.reason == "Unschedulable": return f"Pod không thể lên lịch (Unschedulable)"
+    if pod.status.container_statuses:
+        for cs in pod.status.container_statuses:
+            if cs.restart_count >= RESTART_COUNT_THRESHOLD: return f"Container '{cs.name}' restart {cs.restart_count} lần (>= ngưỡng {RESTART_COUNT_THRESHOLD})"
+            if cs.state:
+                if cs.state.waiting and cs.state.waiting.reason in ["CrashLoopBackOff", "ImagePullBackOff", "ErrImagePull"]: return f"Container '{cs.name}' đang ở trạng thái Waiting với lý do '{cs.state.waiting.reason}'"
+                if cs.state.terminated and cs.state.terminated.reason in ["OOMKilled", "Error", "ContainerCannotRun"]:
+                        if pod.spec.restart_policy != "Always" or (cs.state.terminated.finished_at and (datetime.now(timezone.utc) - cs.state.terminated.finished_at) < timedelta(minutes=LOKI_DETAIL_LOG_RANGE_MINUTES)): return f"Container '{cs.name}' bị Terminated với lý do '{cs.state.terminated.reason}'"
+    return None
+
+@timed_stage("scan_kubernetes_for_issues")
 def scan_kubernetes_for_issues():
     problematic_pods = {}
-    logging.info(f"Scanning Kubernetes namespaces {K8S_NAMESPACES_STR} for problematic pods...")
-    for ns in K8S_NAMESPACES:
+    namespaces = owned_namespaces()
+    logging.info(f"Scanning Kubernetes namespaces {','.join(namespaces)} for problematic pods...")
+    for ns in namespaces:
         try:
-            pods = k8s_core_v1.list_namespaced_pod(namespace=ns, watch=False, timeout_seconds=60)
-            for pod in pods.items:
-                pod_key = f"{ns}/{pod.metadata.name}"; issue_found = False; reason = ""
-                if pod.status.phase in ["Failed", "Unknown"]: issue_found = True; reason = f"Trạng thái Pod là {pod.status.phase}"
-                elif pod.status.phase == "Pending" and pod.status.conditions:
-                        scheduled_condition = next((c for c in pod.status.conditions if c.type == "PodScheduled"), None)
-                        if scheduled_condition and scheduled_condition.status == "False" and scheduled_condition.reason == "Unschedulable": issue_found = True; reason = f"Pod không thể lên lịch (Unschedulable)"
-                if not issue_found and pod.status.container_statuses:
-                    for cs in pod.status.container_statuses:
-                        if cs.restart_count >= RESTART_COUNT_THRESHOLD: issue_found = True; reason = f"Container '{cs.name}' restart {cs.restart_count} lần (>= ngưỡng {RESTART_COUNT_THRESHOLD})"; break
-                        if cs.state:
-                            if cs.state.waiting and cs.state.waiting.reason in ["CrashLoopBackOff", "ImagePullBackOff", "ErrImagePull"]: issue_found = True; reason = f"Container '{cs.name}' đang ở trạng thái Waiting với lý do '{cs.state.waiting.reason}'"; break
-                            if cs.state.terminated and cs.state.terminated.reason in ["OOMKilled", "Error", "ContainerCannotRun"]:
-                                    if pod.spec.restart_policy != "Always" or (cs.state.terminated.finished_at and (datetime.now(timezone.utc) - cs.state.terminated.finished_at) < timedelta(minutes=LOKI_DETAIL_LOG_RANGE_MINUTES)): issue_found = True; reason = f"Container '{cs.name}' bị Terminated với lý do '{cs.state.terminated.reason}'"; break
-                if issue_found:
+            if cluster_cache and cluster_cache.has_synced_pods(ns): pods = cluster_cache.list_pods(ns)
+            else: pods = k8s_call(k8s_core_v1.list_namespaced_pod, namespace=ns, watch=False, timeout_seconds=60).items
+            for pod in pods:
+                pod_key = f"{ns}/{pod.metadata.name}"; reason = detect_pod_issue(pod)
+                if reason and not owns_pod(ns, pod.metadata.name, pod): continue
+                if reason:
                     logging.warning(f"Phát hiện pod có vấn đề tiềm ẩn (K8s Scan): {pod_key}. Lý do: {reason}")
                     if pod_key not in problematic_pods: problematic_pods[pod_key] = {"namespace": ns, "pod_name": pod.metadata.name, "reason": f"K8s: {reason}"}
         except ApiException as e: logging.error(f"API Error scanning namespace {ns}: {e.status} {e.reason}")
@@ -262,59 +627,86 @@ def scan_kubernetes_for_issues():
     logging.info(f"Finished K8s scan. Found {len(problematic_pods)} potentially problematic pods from K8s state.")
     return problematic_pods
 
+def on_pod_event(event_type, pod, old_pod):
+    """Đánh thức vòng lặp chính ngay khi một pod chuyển sang trạng thái có vấn đề."""
+    if event_type == "DELETED": return
+    reason = detect_pod_issue(pod)
+    if reason and (old_pod is None or detect_pod_issue(old_pod) != reason):
+        logging.info(f"Pod {pod.metadata.namespace}/{pod.metadata.name} transitioned to a problematic state: {reason}. Waking up main loop.")
+        cycle_wakeup_event.set()
+
 # --- Hàm Query Loki cho pod cụ thể ---
-def query_loki_for_pod(namespace, pod_name, start_time, end_time):
+@timed_stage("query_loki_for_pod")
+def query_loki_for_pod(namespace, pod_name, start_time, end_time, deadline=None):
     loki_api_endpoint = f"{LOKI_URL}/loki/api/v1/query_range"
     logql_query = f'{{namespace="{namespace}", pod="{pod_name}"}}'
     params = {'query': logql_query, 'start': int(start_time.timestamp() * 1e9), 'end': int(end_time.timestamp() * 1e9), 'limit': LOKI_QUERY_LIMIT, 'direction': 'forward'}
     logging.info(f"Querying Loki for pod '{namespace}/{pod_name}' from {start_time} to {end_time}")
     try:
         headers = {'Accept': 'application/json'}
-        response = requests.get(loki_api_endpoint, params=params, headers=headers, timeout=45); response.raise_for_status(); data = response.json()
+        response = BACKENDS["loki"].get(loki_api_endpoint, params=params, headers=headers, timeout=45, deadline=deadline); response.raise_for_status(); data = response.json()
         if 'data' in data and 'result' in data['data']:
-            log_entries = []
+            log_batch = LogBatch()
             for stream in data['data']['result']:
-                for timestamp_ns, log_line in stream['values']: log_entries.append({"timestamp": datetime.fromtimestamp(int(timestamp_ns) / 1e9, tz=timezone.utc), "message": log_line.strip(), "labels": stream.get('stream', {})})
-            log_entries.sort(key=lambda x: x['timestamp']); logging.info(f"Received {len(log_entries)} log entries from Loki for pod '{namespace}/{pod_name}'."); return log_entries
-        else: logging.warning(f"No 'result' data found in Loki response for pod '{namespace}/{pod_name}'."); return []
-    except requests.exceptions.RequestException as e: logging.error(f"Error querying Loki for pod '{namespace}/{pod_name}': {e}"); return []
-    except json.JSONDecodeError as e: logging.error(f"Error decoding Loki JSON response for pod '{namespace}/{pod_name}': {e}"); return []
-    except Exception as e: logging.error(f"Unexpected error querying Loki for pod '{namespace}/{pod_name}': {e}", exc_info=True); return []
+                label_id = log_batch.add_labels(stream.get('stream', {}))
+                for timestamp_ns, log_line in stream['values']: log_batch.append(int(timestamp_ns), log_line, label_id)
+            log_batch = log_batch.sorted(); logging.info(f"Received {len(log_batch)} log entries from Loki for pod '{namespace}/{pod_name}'."); return log_batch
+        else: logging.warning(f"No 'result' data found in Loki response for pod '{namespace}/{pod_name}'."); return LogBatch()
+    except DeadlineExceeded: raise
+    except CircuitOpenError as e: logging.warning(f"Skipping Loki query for pod '{namespace}/{pod_name}': {e}"); return LogBatch()
+    except requests.exceptions.RequestException as e: logging.error(f"Error querying Loki for pod '{namespace}/{pod_name}': {e}"); return LogBatch()
+    except json.JSONDecodeError as e: logging.error(f"Error decoding Loki JSON response for pod '{namespace}/{pod_name}': {e}"); return LogBatch()
+    except Exception as e: logging.error(f"Unexpected error querying Loki for pod '{namespace}/{pod_name}': {e}", exc_info=True); return LogBatch()
 
 # --- Hàm tiền xử lý và lọc log ---
-def preprocess_and_filter(log_entries):
-    filtered_logs = []
-    log_levels = ["DEBUG", "INFO", "NOTICE", "WARNING", "ERROR", "CRITICAL", "ALERT", "EMERGENCY"]
-    min_level_index = -1
-    try: min_level_index = log_levels.index(LOKI_SCAN_MIN_LEVEL.upper())
-    except ValueError: logging.warning(f"Invalid LOKI_SCAN_MIN_LEVEL: {LOKI_SCAN_MIN_LEVEL}. Defaulting to WARNING."); min_level_index = log_levels.index("WARNING")
-    keywords_indicating_problem = ["FAIL", "ERROR", "CRASH", "EXCEPTION", "UNAVAILABLE", "FATAL", "PANIC"]
-    for entry in log_entries:
-        log_line = entry['message']; log_line_upper = log_line.upper(); level_detected = False
-        for i, level in enumerate(log_levels):
-            if f" {level} " in f" {log_line_upper} " or log_line_upper.startswith(level+":") or f"[{level}]" in log_line_upper or f"level={level.lower()}" in log_line_upper or f"\"level\":\"{level.lower()}\"" in log_line_upper:
-                if i >= min_level_index: filtered_logs.append(entry); level_detected = True; break
-        if not level_detected:
-            if any(keyword in log_line_upper for keyword in keywords_indicating_problem):
-                    warning_index = log_levels.index("WARNING")
-                    if min_level_index <= warning_index: filtered_logs.append(entry)
-    logging.info(f"Filtered {len(log_entries)} logs down to {len(filtered_logs)} relevant logs (Scan Level: {LOKI_SCAN_MIN_LEVEL}).")
+@timed_stage("preprocess_and_filter")
+def preprocess_and_filter(log_batch):
+    min_level_index = log_level_index(LOKI_SCAN_MIN_LEVEL)
+    classifications = log_classifier.classify_batch(log_batch.messages())
+    relevant = [(i, classification[0]) for i, classification in enumerate(classifications) if log_classifier.is_relevant(classification, min_level_index)]
+    filtered_logs = log_batch.select([i for i, _ in relevant], levels=[level for _, level in relevant])
+    logging.info(f"Filtered {len(log_batch)} logs down to {len(filtered_logs)} relevant logs (Scan Level: {LOKI_SCAN_MIN_LEVEL}).")
     return filtered_logs
 
 # --- Hàm tương tác với Gemini ---
-def analyze_with_gemini(log_batch, k8s_context=""):
-    global gemini_calls_counter; gemini_calls_counter += 1
+GEMINI_CONTEXT_MAX_CHARS = 10000
+
+def format_logs_for_prompt(log_batch, log_templates=None):
+    if log_templates: return format_templates_for_prompt(log_templates, max_chars=GEMINI_LOG_PROMPT_MAX_CHARS)
+    if not log_batch: return "N/A"
+    # Dừng giải mã khi đã đủ GEMINI_LOG_PROMPT_MAX_CHARS thay vì dựng chuỗi cho cả lô rồi cắt
+    lines = []; size = 0
+    for i in range(len(log_batch)):
+        line = f"[{log_batch.timestamp(i).isoformat()}] {log_batch.labels(i).get('pod', 'unknown_pod')}: {log_batch.message(i)}"
+        lines.append(line); size += len(line) + 1
+        if size >= GEMINI_LOG_PROMPT_MAX_CHARS: break
+    return "\n".join(lines)[:GEMINI_LOG_PROMPT_MAX_CHARS]
+
+def call_model(prompt, max_output_tokens, json_response=False, deadline=None):
+    # Đếm số lần gọi, độ trễ và token cho daily_stats / hourly_stats
+    kind = "batch" if json_response else "single"; PROMPT_CHARS.observe(len(prompt), kind=kind)
+    start = time.monotonic()
+    try: response = BACKENDS["gemini"].call(lambda timeout: model_client.generate(prompt, max_output_tokens=max_output_tokens, timeout=timeout, json_response=json_response), deadline)
+    finally: count_stat(gemini_calls=1, gemini_latency_ms=int((time.monotonic() - start) * 1000))
+    count_stat(gemini_prompt_tokens=response.prompt_tokens, gemini_output_tokens=response.output_tokens); PROMPT_TOKENS.observe(response.prompt_tokens, kind=kind)
+    return response.text
+
+def generate_batch_analysis(prompt, max_output_tokens, deadline=None):
+    # Mỗi batch là một lần gọi Gemini, chịu cùng giới hạn đồng thời / tốc độ như lời gọi đơn lẻ; chờ slot và timeout không vượt deadline
+    with BACKENDS["gemini"].slot(deadline): return call_model(prompt, max_output_tokens, json_response=True, deadline=deadline)
+
+@timed_stage("analyze_with_gemini")
+def analyze_with_gemini(log_batch, k8s_context="", log_templates=None, deadline=None):
     if not log_batch and not k8s_context: logging.warning("analyze_with_gemini called with no logs and no context. Skipping."); return None
     first_log_namespace = "N/A"; pod_name_in_log = "N/A"
     if log_batch:
-            first_log_namespace = log_batch[0].get('labels', {}).get('namespace', 'unknown')
-            pod_name_in_log = log_batch[0].get('labels', {}).get('pod', 'unknown_pod')
+            first_log_namespace = log_batch.labels(0).get('namespace', 'unknown')
+            pod_name_in_log = log_batch.labels(0).get('pod', 'unknown_pod')
     elif k8s_context:
             match_ns = re.search(r"Pod: (.*?)/", k8s_context); match_pod = re.search(r"Pod: .*?/(.*?)\n", k8s_context)
             if match_ns: first_log_namespace = match_ns.group(1)
             if match_pod: pod_name_in_log = match_pod.group(1)
-    log_text = "N/A"
-    if log_batch: log_text = "\n".join([f"[{entry['timestamp'].isoformat()}] {entry.get('labels', {}).get('pod', 'unknown_pod')}: {entry['message']}" for entry in log_batch])
+    log_text = format_logs_for_prompt(log_batch, log_templates)
     prompt = f"""
     Phân tích tình huống của pod Kubernetes '{first_log_namespace}/{pod_name_in_log}'.
     **Ưu tiên xem xét ngữ cảnh Kubernetes** được cung cấp dưới đây vì nó có thể là lý do chính bạn được gọi.
@@ -324,19 +716,19 @@ def analyze_with_gemini(log_batch, k8s_context=""):
     Tập trung vào các tác động tiềm ẩn.
     Ngữ cảnh Kubernetes:
     --- START CONTEXT ---
-    {k8s_context[:10000]}
+    {k8s_context[:GEMINI_CONTEXT_MAX_CHARS]}
     --- END CONTEXT ---
-    Các dòng log (có thể không có):
+    Các dòng log (có thể không có; nếu đã gom nhóm thì mỗi mục là một mẫu log kèm số lần lặp [xN], thời điểm đầu/cuối và một dòng ví dụ):
     --- START LOGS ---
-    {log_text[:20000]}
+    {log_text}
     --- END LOGS ---
     Chỉ trả lời bằng định dạng JSON với các khóa "severity" và "summary". Ví dụ: {{"severity": "CRITICAL", "summary": "Pod 'kube-system/oomkill-test-pod' bị Terminated với lý do OOMKilled và có Event OOMKilled gần đây. Cần kiểm tra giới hạn bộ nhớ và code ứng dụng."}}
     """
     logging.info(f"Sending logs ({len(log_text)} chars) and context ({len(k8s_context)} chars) for pod '{first_log_namespace}/{pod_name_in_log}' to Gemini for analysis...")
     try:
-        response = gemini_model.generate_content(prompt, generation_config=genai.types.GenerationConfig(temperature=0.2, max_output_tokens=300), request_options={'timeout': 90})
-        if not response.parts: logging.warning("Gemini response has no parts."); return None
-        response_text = response.text.strip(); logging.info(f"Received response from Gemini (raw): {response_text}")
+        response_text = call_model(prompt, max_output_tokens=300, deadline=deadline)
+        if response_text is None: logging.warning("Gemini response has no parts."); return None
+        logging.info(f"Received response from Gemini (raw): {response_text}")
         cleaned_response_text = response_text
         if cleaned_response_text.startswith("```json"): cleaned_response_text = cleaned_response_text.strip("```json").strip("`").strip()
         elif cleaned_response_text.startswith("```"): cleaned_response_text = cleaned_response_text.strip("```").strip()
@@ -344,82 +736,255 @@ def analyze_with_gemini(log_batch, k8s_context=""):
         try:
             analysis_result = json.loads(json_string_to_parse)
             if "severity" in analysis_result: logging.info(f"Successfully parsed Gemini JSON: {analysis_result}"); return analysis_result
-            else: logging.warning(f"Gemini response JSON missing 'severity' key. Raw response: {response_text}"); severity = "WARNING"; summary_vi = "Không thể phân tích JSON từ Gemini (thiếu key 'severity'). Phản hồi thô: " + response_text[:200]; return {"severity": severity, "summary": summary_vi}
-        except json.JSONDecodeError as json_err: logging.warning(f"Failed to decode Gemini response as JSON: {json_err}. Raw response: {response_text}"); severity = "WARNING"; summary_vi = f"Phản hồi Gemini không phải JSON hợp lệ ({json_err}): " + response_text[:200]; return {"severity": severity, "summary": summary_vi}
+            else: logging.warning(f"Gemini response JSON missing 'severity' key. Raw response: {response_text}"); severity = "WARNING"; summary_vi = "Không thể phân tích JSON từ Gemini (thiếu key 'severity'). Phản hồi thô: " + response_text[:200]; return {"severity": severity, "summary": summary_vi, "fallback": True}
+        except json.JSONDecodeError as json_err: logging.warning(f"Failed to decode Gemini response as JSON: {json_err}. Raw response: {response_text}"); severity = "WARNING"; summary_vi = f"Phản hồi Gemini không phải JSON hợp lệ ({json_err}): " + response_text[:200]; return {"severity": severity, "summary": summary_vi, "fallback": True}
+    except DeadlineExceeded: raise
     except Exception as e: logging.error(f"Error calling Gemini API: {e}", exc_info=True); return None
 
 # --- Hàm gửi cảnh báo Telegram ---
 def send_telegram_alert(message):
-    global telegram_alerts_counter; telegram_alerts_counter += 1
+    # Chỉ xếp hàng; telegram_alerts được đếm khi Telegram xác nhận đã nhận (xem TelegramNotifier.on_sent)
     if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID: logging.warning("Telegram Bot Token or Chat ID is not configured. Skipping alert."); return
-    telegram_api_url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"; max_len = 4096; truncated_message = message[:max_len-50] + "..." if len(message) > max_len else message
-    payload = {'chat_id': TELEGRAM_CHAT_ID, 'text': truncated_message, 'parse_mode': 'Markdown'}
-    try: response = requests.post(telegram_api_url, json=payload, timeout=10); response.raise_for_status(); logging.info(f"Sent alert to Telegram. Response: {response.json()}")
-    except requests.exceptions.RequestException as e: logging.error(f"Error sending Telegram alert: {e}");
-    except Exception as e: logging.error(f"An unexpected error occurred during Telegram send: {e}", exc_info=True)
-
-# --- Vòng lặp chính MỚI của Agent (Quét Song Song) ---
-def main_loop():
-    recently_alerted_pods = {}
-    while True:
-        start_cycle_time = datetime.now(timezone.utc)
+    if telegram_notifier is None: logging.warning("Telegram notifier is not running. Skipping alert."); return
+    if telegram_notifier.submit(message, TELEGRAM_CHAT_ID): logging.info("Queued alert for Telegram.")
+
+# --- Cache kết quả phân tích theo fingerprint nội dung ---
+def analyze_with_cache(pod_key, logs_for_analysis, k8s_context_str, log_templates, deadline):
+    fingerprint = None
+    if analysis_cache is not None:
+        fingerprint = analysis_fingerprint(k8s_context_str, log_templates, logs_for_analysis); cached_result = analysis_cache.get(fingerprint)
+        if cached_result is not None:
+            count_stat(analysis_cache_hits=1)
+            logging.info(f"Analysis cache hit for '{pod_key}' (fingerprint {fingerprint[:12]}). Skipping Gemini call.")
+            return cached_result
+        count_stat(analysis_cache_misses=1)
+    check_deadline(deadline, "gemini"); analysis_result = None
+    # Gemini đang open-circuit thì không xếp hàng chờ slot / batch vô ích
+    if not BACKENDS["gemini"].available(): logging.warning(f"Gemini circuit breaker is open; skipping analysis of '{pod_key}'."); return None
+    if batch_analyzer is not None and (logs_for_analysis or k8s_context_str):
+        analysis_result = batch_analyzer.submit(pod_key, k8s_context_str[:GEMINI_CONTEXT_MAX_CHARS], format_logs_for_prompt(logs_for_analysis, log_templates), deadline)
+        if analysis_result is not None: logging.info(f"Batched Gemini analysis for '{pod_key}': {analysis_result}")
+    if analysis_result is None:
+        with BACKENDS["gemini"].slot(deadline): analysis_result = analyze_with_gemini(logs_for_analysis, k8s_context_str, log_templates, deadline)
+    if fingerprint and analysis_result and not analysis_result.get("fallback"): analysis_cache.put(fingerprint, analysis_result)
+    return analysis_result
+
+# --- Điều tra một pod (chạy trong worker pool) ---
+@timed_stage("investigate_pod")
+def investigate_pod(workload_key, data, deadline):
+    # Mỗi workload được phân tích một lần qua pod đại diện; pod lẻ thì workload_key chính là pod_key
+    pod_key = data.get("representative", workload_key); affected_pods = data.get("pods", [pod_key])
+    namespace, pod_name = pod_key.split('/', 1); initial_reasons = "; ".join(data["reason"]); suspicious_logs_found = data["logs"]
+    logging.info(f"Investigating {workload_key} via pod {pod_key} ({len(affected_pods)} affected pods) (Initial Reasons: {initial_reasons})")
+    check_deadline(deadline, "k8s")
+    pod_info = get_pod_info(namespace, pod_name, deadline); node_info = None; pod_events = []
+    if pod_info: node_info = get_node_info(pod_info.get('node_name'), deadline); pod_events = get_pod_events(namespace, pod_name, since_minutes=LOKI_DETAIL_LOG_RANGE_MINUTES + 5, deadline=deadline)
+    k8s_context_str = format_k8s_context(pod_info, node_info, pod_events)
+    if len(affected_pods) > 1: k8s_context_str = format_workload_context(data) + k8s_context_str
+    logs_for_analysis = suspicious_logs_found
+    if not logs_for_analysis and not BACKENDS["loki"].available():
+        # Loki đang open-circuit: phân tích chỉ dựa trên ngữ cảnh Kubernetes
+        logging.warning(f"Loki circuit breaker is open; analyzing {pod_key} on Kubernetes context only.")
+        k8s_context_str += "(Không lấy được log chi tiết: Loki đang gặp sự cố)\n"
+    elif not logs_for_analysis:
+        check_deadline(deadline, "loki"); detailed_logs = None
+        if data.get("detail_logs") is not None:
+            # Kết quả truy vấn gộp của cả lượt dispatch; pod không có trong đó (truy vấn lỗi) thì query riêng
+            try: detailed_logs = data["detail_logs"].result(timeout=None if deadline is None else max(0, deadline - time.monotonic())).get(pod_key)
+            except Exception as e: logging.warning(f"Bulk Loki fetch unavailable for {pod_key}: {e!r}")
+        if detailed_logs is None:
+            log_end_time = datetime.now(timezone.utc); log_start_time = log_end_time - timedelta(minutes=LOKI_DETAIL_LOG_RANGE_MINUTES)
+            detailed_logs = query_loki_for_pod(namespace, pod_name, log_start_time, log_end_time, deadline)
+        logs_for_analysis = preprocess_and_filter(detailed_logs)
+    log_templates = mine_templates(logs_for_analysis, LOG_TEMPLATE_SIMILARITY) if LOG_TEMPLATE_MINING_ENABLED and logs_for_analysis else None
+    if log_templates: logging.info(f"Collapsed {len(logs_for_analysis)} log lines for {pod_key} into {len(log_templates)} templates.")
+    triage_result = run_triage(pod_key, pod_info, node_info, pod_events, data["reason"], log_templates, logs_for_analysis) if triage_engine else None
+    analysis_result = triage_result or analyze_with_cache(pod_key, logs_for_analysis, k8s_context_str, log_templates, deadline)
+    if not analysis_result and not BACKENDS["gemini"].available():
+        # Gemini đang open-circuit: vẫn cảnh báo theo phát hiện ban đầu thay vì bỏ sót sự cố
+        analysis_result = {"severity": "WARNING", "summary": f"Gemini tạm thời không khả dụng; cảnh báo dựa trên phát hiện ban đầu: {initial_reasons}", "fallback": True}
+    if not analysis_result: logging.warning(f"Gemini analysis failed or returned no result for pod '{pod_key}'."); return False
+    severity = analysis_result.get("severity", "UNKNOWN").upper(); summary = analysis_result.get("summary", "N/A")
+    logging.info(f"{'Triage rule ' + repr(triage_result['rule']) if triage_result else 'Gemini analysis'} result for '{pod_key}': Severity={severity}, Summary={summary}")
+    if severity not in ALERT_SEVERITY_LEVELS: return False
+    sample_logs = "\n".join([f"- `{logs_for_analysis.message(i)[:150]}`" for i in range(min(5, len(logs_for_analysis)))]) if logs_for_analysis else ""
+    alert_time_hcm = datetime.now(HCM_TZ); time_format = '%Y-%m-%d %H:%M:%S %Z'
+    rule_line = f"*Phân loại bằng luật:* `{triage_result['rule']}`\n" if triage_result else ""
+    alert_target = f"Pod: {pod_key}" if len(affected_pods) <= 1 else f"Workload: {workload_key}, {len(affected_pods)} pod"
+    alert_message = f"""🚨 *Cảnh báo K8s/Log ({alert_target})* 🚨\n*Mức độ:* `{severity}`\n*Tóm tắt:* {summary}\n{rule_line}*Lý do phát hiện ban đầu:* {initial_reasons}\n*Thời gian phát hiện:* `{alert_time_hcm.strftime(time_format)}`\n*Log mẫu (nếu có):*\n{sample_logs if sample_logs else "- Không có log mẫu liên quan."}\n\n_Vui lòng kiểm tra trạng thái pod/node/events và log trên Loki để biết thêm chi tiết._"""
+    # Cảnh báo đã có kết quả phân tích thì vẫn gửi, kể cả khi đã quá deadline; luồng sender lo retry / rate limit
+    send_telegram_alert(alert_message)
+    record_incident(pod_key, severity, summary, initial_reasons, k8s_context_str, sample_logs if sample_logs else "-", templates_to_json(log_templates) if log_templates else None, workload_key)
+    return severity
+
+def run_triage(pod_key, pod_info, node_info, pod_events, reasons, log_templates, log_batch):
+    """Kết quả của luật triage khớp đầu tiên (dạng kết quả Gemini, thêm "rule") hoặc None nếu pod cần chuyển cho Gemini."""
+    started = time.perf_counter()
+    try: result = triage_engine.evaluate(build_facts(pod_key, pod_info, node_info, pod_events, reasons, log_templates, log_batch))
+    except Exception as e: logging.error(f"Triage failed for {pod_key}: {e}", exc_info=True); result = None
+    STAGE_SECONDS.observe(time.perf_counter() - started, stage="triage")
+    count_stat(**{"triage_hits" if result else "triage_misses": 1})
+    return result
+
+def collect_pods_to_investigate(k8s_problem_pods, loki_suspicious_logs):
+    pods_to_investigate = {}
+    for pod_key, data in k8s_problem_pods.items():
+        if pod_key not in pods_to_investigate: pods_to_investigate[pod_key] = {"reason": [], "logs": LogBatch(LOG_BATCH_MAX_LINES_PER_POD)}
+        pods_to_investigate[pod_key]["reason"].append(data["reason"])
+    for pod_key, logs in loki_suspicious_logs.items():
+            # Lô log của lần quét được dùng lại trực tiếp thay vì sao chép từng dòng
+            if pod_key not in pods_to_investigate: pods_to_investigate[pod_key] = {"reason": [], "logs": logs}
+            else: pods_to_investigate[pod_key]["logs"] = logs
+            pods_to_investigate[pod_key]["reason"].append(f"Loki: Phát hiện {len(logs)} log đáng ngờ (>= {LOKI_SCAN_MIN_LEVEL})")
+    return pods_to_investigate
+
+def interrupted_investigations():
+    """Các pod có điều tra còn dở khi agent dừng lần trước (dạng pods_to_investigate), để tiếp tục ở chu kỳ đầu tiên."""
+    resumed = {pod_key: {"reason": ["Tiếp tục điều tra bị gián đoạn khi agent khởi động lại"], "logs": LogBatch(LOG_BATCH_MAX_LINES_PER_POD)}
+               for pod_key in alert_state.take_interrupted().values()}
+    if resumed: logging.info(f"Resuming {len(resumed)} investigations interrupted by the previous shutdown.")
+    return filter_owned_pods(resumed)
+
+# --- Vòng lặp chính MỚI của Agent (Quét Song Song, điều tra đồng thời) ---
+def main_loop(max_cycles=None):
+    """Vòng lặp quét; `max_cycles` (dùng khi replay/benchmark) dừng sau số chu kỳ đó và chờ mọi điều tra kết thúc."""
+    executor = ThreadPoolExecutor(max_workers=INVESTIGATION_WORKERS, thread_name_prefix="investigator")
+    resumed = interrupted_investigations()
+
+    def on_investigation_done(pod_key, future):
+        # Kết quả là mức độ của cảnh báo đã gửi (bắt đầu cooldown theo mức đó) hoặc False
+        severity = None
+        try:
+            severity = future.result() or None
+            PODS_INVESTIGATED.inc(outcome="alerted" if severity else "no_alert")
+        except DeadlineExceeded as e: logging.warning(f"Investigation of {pod_key} aborted: {e}"); PODS_INVESTIGATED.inc(outcome="aborted")
+        except Exception as e: logging.error(f"Unexpected error investigating {pod_key}: {e}", exc_info=True); PODS_INVESTIGATED.inc(outcome="error")
+        finally: alert_state.finish(pod_key, severity)
+
+    def dispatch_investigations(pods_to_investigate, deadline):
+        # Cooldown và trạng thái đang điều tra được tính theo workload
+        futures = []
+        investigations = group_by_workload(pods_to_investigate, workload_resolver) if workload_resolver else pods_to_investigate
+        if len(investigations) < len(pods_to_investigate): logging.info(f"Grouped {len(pods_to_investigate)} pods into {len(investigations)} workloads.")
+        selected = []
+        for pod_key, data in investigations.items():
+            skip_reason = alert_state.try_start(pod_key, data.get("representative", pod_key))
+            if skip_reason == "in_flight": logging.info(f"Pod {pod_key} is still being investigated. Skipping."); continue
+            if skip_reason == "cooldown": logging.info(f"Pod {pod_key} is in cooldown period. Skipping analysis."); continue
+            selected.append((pod_key, data))
+        PODS_DISPATCHED.set(len(selected))
+        # Một lần lấy log gộp cho mọi pod chưa có log đáng ngờ, chạy song song với việc lấy ngữ cảnh K8s của các worker
+        pods_needing_logs = [data.get("representative", pod_key) for pod_key, data in selected if not data["logs"]]
+        detail_logs = None
+        if loki_bulk_fetcher is not None and len(pods_needing_logs) > 1 and BACKENDS["loki"].available():
+            log_end_time = datetime.now(timezone.utc); log_start_time = log_end_time - timedelta(minutes=LOKI_DETAIL_LOG_RANGE_MINUTES)
+            detail_logs = loki_bulk_fetcher.submit(pods_needing_logs, log_start_time, log_end_time)
+        for pod_key, data in selected:
+            if detail_logs is not None and not data["logs"]: data = {**data, "detail_logs": detail_logs}
+            future = executor.submit(investigate_pod, pod_key, data, deadline)
+            future.add_done_callback(lambda f, key=pod_key: on_investigation_done(key, f)); futures.append(future)
+        return futures
+
+    if DETECTION_MODE == "event": return run_event_driven(dispatch_investigations, resumed)
+    cycles = 0
+    while max_cycles is None or cycles < max_cycles:
+        start_cycle_time = datetime.now(timezone.utc); cycle_deadline = time.monotonic() + CYCLE_DEADLINE_SECONDS; profiler = start_cycle_profile()
         logging.info("--- Starting new monitoring cycle (Parallel Scan) ---")
         k8s_problem_pods = scan_kubernetes_for_issues()
         loki_scan_end_time = start_cycle_time; loki_scan_start_time = loki_scan_end_time - timedelta(minutes=LOKI_SCAN_RANGE_MINUTES)
-        loki_suspicious_logs = scan_loki_for_suspicious_logs(loki_scan_start_time, loki_scan_end_time)
-        pods_to_investigate = {}
-        for pod_key, data in k8s_problem_pods.items():
-            if pod_key not in pods_to_investigate: pods_to_investigate[pod_key] = {"reason": [], "logs": []}
-            pods_to_investigate[pod_key]["reason"].append(data["reason"])
-        for pod_key, logs in loki_suspicious_logs.items():
-                if pod_key not in pods_to_investigate: pods_to_investigate[pod_key] = {"reason": [], "logs": []}
-                pods_to_investigate[pod_key]["reason"].append(f"Loki: Phát hiện {len(logs)} log đáng ngờ (>= {LOKI_SCAN_MIN_LEVEL})")
-                pods_to_investigate[pod_key]["logs"].extend(logs)
+        loki_suspicious_logs = fetch_suspicious_logs(loki_scan_start_time, loki_scan_end_time)
+        pods_to_investigate = collect_pods_to_investigate(k8s_problem_pods, loki_suspicious_logs)
+        for pod_key, data in resumed.items(): pods_to_investigate.setdefault(pod_key, {"reason": [], "logs": data["logs"]})["reason"].extend(data["reason"])
+        resumed = {}
         logging.info(f"Total pods to investigate this cycle: {len(pods_to_investigate)}")
-        for pod_key, data in pods_to_investigate.items():
-            namespace, pod_name = pod_key.split('/', 1); initial_reasons = "; ".join(data["reason"]); suspicious_logs_found = data["logs"]
-            now_utc = datetime.now(timezone.utc)
-            if pod_key in recently_alerted_pods:
-                last_alert_time = recently_alerted_pods[pod_key]; cooldown_duration = timedelta(minutes=30)
-                if now_utc < last_alert_time + cooldown_duration: logging.info(f"Pod {pod_key} is in cooldown period. Skipping analysis."); continue
-                else: del recently_alerted_pods[pod_key]
-            logging.info(f"Investigating pod: {pod_key} (Initial Reasons: {initial_reasons})")
-            pod_info = get_pod_info(namespace, pod_name); node_info = None; pod_events = []
-            if pod_info: node_info = get_node_info(pod_info.get('node_name')); pod_events = get_pod_events(namespace, pod_name, since_minutes=LOKI_DETAIL_LOG_RANGE_MINUTES + 5)
-            k8s_context_str = format_k8s_context(pod_info, node_info, pod_events)
-            logs_for_analysis = suspicious_logs_found
-            if not logs_for_analysis:
-                log_end_time = datetime.now(timezone.utc); log_start_time = log_end_time - timedelta(minutes=LOKI_DETAIL_LOG_RANGE_MINUTES)
-                detailed_logs = query_loki_for_pod(namespace, pod_name, log_start_time, log_end_time)
-                logs_for_analysis = preprocess_and_filter(detailed_logs)
-            analysis_result = analyze_with_gemini(logs_for_analysis, k8s_context_str)
-            if analysis_result:
-                severity = analysis_result.get("severity", "UNKNOWN").upper(); summary = analysis_result.get("summary", "N/A")
-                logging.info(f"Gemini analysis result for '{pod_key}': Severity={severity}, Summary={summary}")
-                if severity in ALERT_SEVERITY_LEVELS:
-                    sample_logs = "\n".join([f"- `{log['message'][:150]}`" for log in logs_for_analysis[:5]])
-                    alert_time_hcm = datetime.now(HCM_TZ); time_format = '%Y-%m-%d %H:%M:%S %Z'
-                    alert_message = f"""🚨 *Cảnh báo K8s/Log (Pod: {pod_key})* 🚨\n*Mức độ:* `{severity}`\n*Tóm tắt:* {summary}\n*Lý do phát hiện ban đầu:* {initial_reasons}\n*Thời gian phát hiện:* `{alert_time_hcm.strftime(time_format)}`\n*Log mẫu (nếu có):*\n{sample_logs if sample_logs else "- Không có log mẫu liên quan."}\n\n_Vui lòng kiểm tra trạng thái pod/node/events và log trên Loki để biết thêm chi tiết._"""
-                    send_telegram_alert(alert_message)
-                    record_incident(pod_key, severity, summary, initial_reasons, k8s_context_str, sample_logs if sample_logs else "-")
-                    recently_alerted_pods[pod_key] = now_utc
-            else: logging.warning(f"Gemini analysis failed or returned no result for pod '{pod_key}'.")
-            time.sleep(5)
-        cycle_duration = (datetime.now(timezone.utc) - start_cycle_time).total_seconds()
+        futures = dispatch_investigations(pods_to_investigate, cycle_deadline)
+        if futures:
+            done, not_done = wait(futures, timeout=max(0, cycle_deadline - time.monotonic()))
+            if not_done: logging.warning(f"{len(not_done)} investigations still running past the cycle deadline ({CYCLE_DEADLINE_SECONDS}s); they will finish in the background.")
+        cycle_duration = (datetime.now(timezone.utc) - start_cycle_time).total_seconds(); CYCLE_SECONDS.observe(cycle_duration); finish_cycle_profile(profiler); cycles += 1
+        if max_cycles is not None and cycles >= max_cycles: break
         sleep_time = max(0, SCAN_INTERVAL_SECONDS - cycle_duration)
         logging.info(f"--- Cycle finished in {cycle_duration:.2f}s. Sleeping for {sleep_time:.2f} seconds... ---")
-        time.sleep(sleep_time)
+        if cycle_wakeup_event.wait(sleep_time): logging.info("Woken up early by a pod state transition.")
+        cycle_wakeup_event.clear()
+    executor.shutdown(wait=True)
 
-if __name__ == "__main__":
+# --- Chế độ phát hiện theo sự kiện: detector từ watch đẩy công việc vào hàng đợi ---
+def run_event_driven(dispatch_investigations, resumed=None):
+    logging.info(f"Running in event-driven detection mode (batch window {EVENT_BATCH_WINDOW_SECONDS}s, Loki scan every {SCAN_INTERVAL_SECONDS}s).")
+    for pod_key, data in (resumed or {}).items(): investigation_queue.put(pod_key, reason=data["reason"][0])
+    next_loki_scan = time.monotonic()
+    while True:
+        if time.monotonic() >= next_loki_scan:
+            # Log không có sự kiện watch nên vẫn quét Loki định kỳ, kết quả được đưa chung vào hàng đợi
+            scan_end_time = datetime.now(timezone.utc); scan_start_time = scan_end_time - timedelta(minutes=LOKI_SCAN_RANGE_MINUTES)
+            for pod_key, logs in fetch_suspicious_logs(scan_start_time, scan_end_time).items():
+                investigation_queue.put(pod_key, reason=f"Loki: Phát hiện {len(logs)} log đáng ngờ (>= {LOKI_SCAN_MIN_LEVEL})", logs=logs)
+            next_loki_scan = time.monotonic() + SCAN_INTERVAL_SECONDS
+        pods_to_investigate = filter_owned_pods(investigation_queue.drain(timeout=max(0, next_loki_scan - time.monotonic()), batch_window=EVENT_BATCH_WINDOW_SECONDS))
+        if pods_to_investigate:
+            logging.info(f"Dispatching {len(pods_to_investigate)} pods from the event queue.")
+            profiler = start_cycle_profile()
+            dispatch_investigations(pods_to_investigate, time.monotonic() + CYCLE_DEADLINE_SECONDS); finish_cycle_profile(profiler)
+
+def start_pipeline():
+    """Khởi tạo các thành phần của pipeline điều tra (dùng chung cho main() và chế độ replay)."""
+    global workload_resolver, analysis_cache, alert_state, triage_engine, batch_analyzer, loki_bulk_fetcher, telegram_notifier
+    alert_state = AlertState(db, ALERT_COOLDOWN_MINUTES * 60, ALERT_COOLDOWN_MINUTES_BY_SEVERITY, INTERRUPTED_INVESTIGATION_MAX_AGE_MINUTES * 60); alert_state.load()
+    if TRIAGE_ENABLED:
+        try: triage_engine = TriageEngine.from_file(TRIAGE_RULES_FILE, TRIAGE_MIN_CONFIDENCE)
+        except (OSError, ValueError) as e: logging.error(f"Could not load triage rules from {TRIAGE_RULES_FILE}: {e}. Triage disabled; every pod goes to Gemini.")
+        else:
+            logging.info(f"Loaded {len(triage_engine.rules)} triage rules from {TRIAGE_RULES_FILE} (min confidence {TRIAGE_MIN_CONFIDENCE}).")
+            for name in triage_engine.rule_hits: TRIAGE_RULE_HITS.set_function(lambda name=name: triage_engine.rule_hits[name], rule=name)
+    if WORKLOAD_GROUPING_ENABLED: workload_resolver = WorkloadResolver(k8s_apps_v1, fetch_pod_object, call=k8s_call)
+    if ANALYSIS_CACHE_ENABLED: analysis_cache = AnalysisCache(db, ANALYSIS_CACHE_TTL_MINUTES * 60, ANALYSIS_CACHE_MAX_ENTRIES); analysis_cache.load()
+    if GEMINI_BATCH_ENABLED and GEMINI_BATCH_MAX_ITEMS > 1: batch_analyzer = BatchAnalyzer(generate_batch_analysis, GEMINI_BATCH_TOKEN_BUDGET, GEMINI_BATCH_MAX_ITEMS, GEMINI_BATCH_WINDOW_SECONDS, max_parallel_batches=GEMINI_MAX_CONCURRENCY).start()
+    if LOKI_BULK_FETCH_ENABLED: loki_bulk_fetcher = LokiBulkFetcher(LOKI_URL, BACKENDS["loki"], LOKI_BULK_MAX_PODS_PER_QUERY, max_lines_per_pod=LOKI_QUERY_LIMIT, sub_range_seconds=LOKI_BULK_SUB_RANGE_MINUTES * 60, page_limit=LOKI_BULK_PAGE_LIMIT, max_parallel=LOKI_MAX_CONCURRENCY)
+    if TELEGRAM_BOT_TOKEN: telegram_notifier = TelegramNotifier(TELEGRAM_BOT_TOKEN, TELEGRAM_API_URL, TELEGRAM_COALESCE_WINDOW_SECONDS, TELEGRAM_MAX_RETRIES, max_queue=TELEGRAM_QUEUE_SIZE, backend=BACKENDS["telegram"], on_sent=lambda count: count_stat(telegram_alerts=count),
+                                                           observe_send=lambda seconds: STAGE_SECONDS.observe(seconds, stage="send_telegram_alert")).start()
+
+def start_sharding():
+    global shard_coordinator
+    if SHARD_BY not in ("namespace", "workload"): logging.error(f"Invalid SHARD_BY '{SHARD_BY}' (expected namespace or workload)."); return False
+    shard_coordinator = LeaseCoordinator(client.CoordinationV1Api(), SHARD_LEASE_NAMESPACE, SHARD_IDENTITY, SHARD_GROUP, SHARD_LEASE_DURATION_SECONDS, SHARD_RENEW_INTERVAL_SECONDS)
+    shard_coordinator.add_change_handler(on_shard_change); shard_coordinator.start()
+    logging.info(f"Sharded mode: replica '{SHARD_IDENTITY}' (shard by {SHARD_BY}, leases in {SHARD_LEASE_NAMESPACE}); members: {list(shard_coordinator.members)}")
+    return True
+
+def stop_pipeline():
+    if shard_coordinator is not None: shard_coordinator.stop()
+    if telegram_notifier is not None: logging.info("Flushing pending Telegram alerts..."); telegram_notifier.close()
+    logging.info("Performing final stats update before exiting..."); update_daily_stats(); db.close()
+
+def main():
+    global DETECTION_MODE, cluster_cache
+    logging.basicConfig(level=logging.INFO, format=LOG_FORMAT, force=True)
+    if ZoneInfo is None: logging.warning("zoneinfo module not found (Python < 3.9); alert timestamps will be shown in UTC.")
+    if not K8S_NAMESPACES: logging.error("K8S_NAMESPACES environment variable is not set or is empty. Exiting."); exit(1)
+    if not all([LOKI_URL, GEMINI_API_KEY or MODEL_CLIENT != "gemini", TELEGRAM_BOT_TOKEN, TELEGRAM_CHAT_ID]): logging.error("One or more required environment variables are missing. Ensure they are set. Exiting."); exit(1)
+    if not init_kubernetes() or not init_model_client(): logging.error("Failed to initialize external clients. Exiting."); exit(1)
     if not init_db(): logging.error("Failed to initialize database. Exiting."); exit(1)
+    if SHARDING_ENABLED and not start_sharding(): logging.error("Failed to start sharding. Exiting."); exit(1)
+    start_pipeline()
+    if METRICS_PORT: metrics.start_http_server(METRICS, METRICS_PORT, handlers=metrics_handlers())
     stats_thread = threading.Thread(target=periodic_stat_update, daemon=True); stats_thread.start(); logging.info("Started periodic stats update thread.")
     logging.info(f"Starting Kubernetes Log Monitoring Agent (Parallel Scan Logic) for namespaces: {K8S_NAMESPACES_STR}")
     logging.info(f"Loki scan minimum level: {LOKI_SCAN_MIN_LEVEL}")
     logging.info(f"Alerting for severity levels: {ALERT_SEVERITY_LEVELS_STR}")
+    if ALERT_COOLDOWN_MINUTES_BY_SEVERITY: logging.info(f"Alert cooldown: {ALERT_COOLDOWN_MINUTES} min by default, per severity: { {severity: seconds / 60 for severity, seconds in ALERT_COOLDOWN_MINUTES_BY_SEVERITY.items()} } min")
     logging.info(f"Restart count threshold: {RESTART_COUNT_THRESHOLD}")
-    if not K8S_NAMESPACES: logging.error("K8S_NAMESPACES environment variable is not set or is empty. Exiting."); exit(1)
-    if not all([LOKI_URL, GEMINI_API_KEY, TELEGRAM_BOT_TOKEN, TELEGRAM_CHAT_ID]): logging.error("One or more required environment variables are missing. Ensure they are set. Exiting."); exit(1)
+    if DETECTION_MODE == "event" and not K8S_WATCH_CACHE_ENABLED: logging.warning("DETECTION_MODE=event requires K8S_WATCH_CACHE_ENABLED. Falling back to interval mode."); DETECTION_MODE = "interval"
+    if K8S_WATCH_CACHE_ENABLED:
+        cluster_cache = ClusterCache(k8s_core_v1, K8S_NAMESPACES, K8S_WATCH_TIMEOUT_SECONDS)
+        if DETECTION_MODE == "event": cluster_cache.add_pod_handler(PodTransitionDetector(investigation_queue, RESTART_COUNT_THRESHOLD, timedelta(minutes=LOKI_DETAIL_LOG_RANGE_MINUTES)))
+        else: cluster_cache.add_pod_handler(on_pod_event)
+        cluster_cache.start()
+        if cluster_cache.wait_for_sync(timeout=60): logging.info("Kubernetes watch cache synced.")
+        else: logging.warning("Kubernetes watch cache not fully synced after 60s; falling back to API calls until it is.")
     try: main_loop()
     except KeyboardInterrupt: logging.info("Agent stopped by user.")
-    finally: logging.info("Performing final stats update before exiting..."); update_daily_stats(); logging.info("Agent shutdown complete.")
+    finally: stop_pipeline(); logging.info("Agent shutdown complete.")
 
+if __name__ == "__main__":
+    main()
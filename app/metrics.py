@@ -0,0 +1,215 @@
+"""Metric tối giản theo định dạng văn bản của Prometheus (không cần thư viện prometheus_client).
+
+Hỗ trợ Counter, Gauge (kể cả gauge tính bằng hàm lúc scrape) và Histogram có label, cùng một
+HTTP server nền phục vụ /metrics.
+"""
+import time
+import math
+import logging
+import threading
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# Bucket mặc định (giây) cho độ trễ các stage: từ vài ms (regex, DB) tới hàng chục giây (Loki, Gemini)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = (100, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000)
+
+
+def _format_value(value):
+    if value == math.inf: return "+Inf"
+    if isinstance(value, float) and value.is_integer(): return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs: return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, v in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames): raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def snapshot(self):
+        """Giá trị hiện tại theo bộ label: {(label values...): value} (dùng cho báo cáo của replay/benchmark)."""
+        with self._lock: return dict(self._values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._functions = {}
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock: self._values[key] = value
+
+    def set_function(self, func, **labels):
+        """Giá trị được tính lúc scrape (ví dụ độ dài hàng đợi), không cần cập nhật thủ công."""
+        key = self._key(labels)
+        with self._lock: self._functions[key] = func
+
+    def snapshot(self):
+        with self._lock: values = dict(self._values); functions = dict(self._functions)
+        for key, func in functions.items():
+            try: values[key] = func()
+            except Exception: pass
+        return values
+
+    def _samples(self):
+        with self._lock: values = dict(self._values); functions = dict(self._functions)
+        for key, func in functions.items():
+            try: values[key] = func()
+            except Exception as e: logging.debug(f"Gauge {self.name} callback failed: {e}")
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in sorted(values.items()) if value is not None]
+
+
+class Counter(Gauge):
+    """Bộ đếm chỉ tăng; set_function dùng cho bộ đếm sẵn có ở nơi khác (ví dụ Backend.stats)."""
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock: self._values[key] = self._values.get(key, 0) + amount
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None: state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound: state[0][i] += 1; break
+            state[1] += value; state[2] += 1
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def quantile(self, q, counts):
+        """Ước lượng quantile từ số đếm theo bucket (nội suy tuyến tính như histogram_quantile của Prometheus)."""
+        total = sum(counts)
+        if not total: return None
+        rank = q * total; cumulative = 0; lower = 0.0
+        for bound, bucket_count in zip(self.buckets, counts):
+            if bucket_count and cumulative + bucket_count >= rank:
+                if bound == math.inf: return lower
+                return lower + (bound - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count; lower = bound if bound != math.inf else lower
+        return lower
+
+    def snapshot(self):
+        """{(label values...): {"count", "sum", "mean", "p50", "p95", "p99"}} tính từ các bucket."""
+        with self._lock: values = {key: ([*counts], total, count) for key, (counts, total, count) in self._values.items()}
+        return {key: {"count": count, "sum": total, "mean": total / count if count else None,
+                      **{f"p{int(q * 100)}": self.quantile(q, counts) for q in (0.5, 0.95, 0.99)}} for key, (counts, total, count) in values.items()}
+
+    def _samples(self):
+        with self._lock: values = {key: ([*counts], total, count) for key, (counts, total, count) in self._values.items()}
+        lines = []
+        for key, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', _format_value(float(bound)))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram; self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter(); return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels); return False
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics: raise ValueError(f"Metric {metric.name} already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        with self._lock: metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+def timed(histogram, **labels):
+    """Decorator đo thời gian chạy của hàm vào histogram (kể cả khi hàm ném lỗi)."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with histogram.time(**labels): return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def start_http_server(registry, port, host="0.0.0.0", handlers=None):
+    """Phục vụ /metrics (và các đường dẫn thêm trong `handlers`: {path: func(query) -> (status, text)}) trên luồng nền."""
+    handlers = dict(handlers or {})
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == "/metrics": status, body, content_type = 200, registry.render(), "text/plain; version=0.0.4; charset=utf-8"
+            elif url.path in handlers:
+                try: status, body = handlers[url.path](parse_qs(url.query))
+                except Exception as e: status, body = 500, f"error: {e}\n"
+                content_type = "text/plain; charset=utf-8"
+            else: status, body, content_type = 404, "not found\n", "text/plain; charset=utf-8"
+            data = body.encode("utf-8")
+            self.send_response(status); self.send_header("Content-Type", content_type); self.send_header("Content-Length", str(len(data)))
+            self.end_headers(); self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler); server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logging.info(f"Serving Prometheus metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
@@ -0,0 +1,43 @@
+from collections import namedtuple
+
+# Văn bản phản hồi (None nếu model không trả về nội dung) và số token đã dùng
+ModelResponse = namedtuple("ModelResponse", ["text", "prompt_tokens", "output_tokens"])
+
+
+def estimate_tokens(text):
+    """Ước lượng số token (~4 ký tự/token), đủ dùng để chia batch theo ngân sách."""
+    return len(text) // 4 + 1
+
+
+class ModelClient:
+    """Giao diện tối thiểu cho model sinh văn bản, để có thể thay Gemini bằng model giả khi chạy offline (tests/fakes.py)."""
+    name = "base"
+
+    def generate(self, prompt, max_output_tokens=300, timeout=90, json_response=False):
+        """Trả về ModelResponse; text đã strip hoặc None nếu model không trả về nội dung."""
+        raise NotImplementedError
+
+
+class GeminiModelClient(ModelClient):
+    name = "gemini"
+
+    def __init__(self, model_name, api_key):
+        import google.generativeai as genai
+        genai.configure(api_key=api_key)
+        self._genai = genai
+        self.model = genai.GenerativeModel(model_name)
+
+    def generate(self, prompt, max_output_tokens=300, timeout=90, json_response=False):
+        config = {"temperature": 0.2, "max_output_tokens": max_output_tokens}
+        if json_response: config["response_mime_type"] = "application/json"
+        response = self.model.generate_content(prompt, generation_config=self._genai.types.GenerationConfig(**config), request_options={'timeout': timeout})
+        usage = getattr(response, "usage_metadata", None)
+        prompt_tokens = getattr(usage, "prompt_token_count", 0) or estimate_tokens(prompt)
+        if not response.parts: return ModelResponse(None, prompt_tokens, 0)
+        text = response.text.strip()
+        return ModelResponse(text, prompt_tokens, getattr(usage, "candidates_token_count", 0) or estimate_tokens(text))
+
+
+def create_model_client(kind, model_name=None, api_key=None):
+    if kind == "gemini": return GeminiModelClient(model_name, api_key)
+    raise ValueError(f"Unknown model client: {kind}")
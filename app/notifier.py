@@ -0,0 +1,183 @@
+"""Gửi cảnh báo Telegram bất đồng bộ: hàng đợi + một luồng sender với session dùng lại kết nối.
+
+Worker điều tra chỉ xếp cảnh báo vào hàng đợi rồi đi tiếp. Luồng sender gom các cảnh báo của cùng
+một chat trong `coalesce_window_seconds` thành tin digest, retry với backoff lũy thừa, tuân theo
+`retry_after` khi Telegram trả về 429 và chỉ tính là đã gửi khi Telegram xác nhận.
+"""
+import time
+import queue
+import random
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+TELEGRAM_MAX_MESSAGE_CHARS = 4096
+DIGEST_SEPARATOR = "\n\n〰〰〰〰〰\n\n"
+
+
+def truncate_message(text, max_chars=TELEGRAM_MAX_MESSAGE_CHARS):
+    return text if len(text) <= max_chars else text[:max_chars - 50] + "..."
+
+
+def build_digests(texts, max_chars=TELEGRAM_MAX_MESSAGE_CHARS):
+    """Ghép các cảnh báo thành ít tin nhắn nhất có thể; trả về danh sách (text, số cảnh báo trong tin)."""
+    if len(texts) == 1: return [(truncate_message(texts[0], max_chars), 1)]
+    header = f"📦 *{len(texts)} cảnh báo mới*"
+    # Chừa chỗ cho header và dấu phân cách để từng cảnh báo luôn vừa một tin
+    texts = [truncate_message(text, max_chars - len(header) - len(DIGEST_SEPARATOR)) for text in texts]
+    digests = []; current = [header]; size = len(header)
+    for text in texts:
+        if len(current) > 1 and size + len(DIGEST_SEPARATOR) + len(text) > max_chars:
+            digests.append(current); current = [header]; size = len(header)
+        current.append(text); size += len(DIGEST_SEPARATOR) + len(text)
+    digests.append(current)
+    return [(DIGEST_SEPARATOR.join(parts), len(parts) - 1) for parts in digests]
+
+
+class _Alert:
+    __slots__ = ("chat_id", "text")
+
+    def __init__(self, chat_id, text):
+        self.chat_id = chat_id; self.text = text
+
+
+class TelegramNotifier:
+    """Hàng đợi cảnh báo ra ngoài với một luồng sender duy nhất.
+
+    `backend` (backends.Backend, tùy chọn) giới hạn tốc độ gọi API; `on_sent(n)` được gọi với số
+    cảnh báo vừa được Telegram xác nhận, dùng để cập nhật bộ đếm telegram_alerts.
+    """
+
+    def __init__(self, bot_token, api_url="https://api.telegram.org", coalesce_window_seconds=2.0, max_retries=5,
+                 backoff_seconds=1.0, max_backoff_seconds=60.0, timeout=10, max_queue=1000, backend=None, on_sent=None, parse_mode="Markdown", observe_send=None):
+        self.send_url = f"{api_url.rstrip('/')}/bot{bot_token}/sendMessage"
+        self.coalesce_window_seconds = coalesce_window_seconds
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.timeout = timeout
+        self.backend = backend
+        self.on_sent = on_sent
+        # observe_send(seconds) nhận thời gian của từng request sendMessage (kể cả request lỗi)
+        self.observe_send = observe_send
+        self.parse_mode = parse_mode
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=2)
+        self.session.mount("https://", adapter); self.session.mount("http://", adapter)
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._pending = 0
+        self._idle = threading.Condition()
+        self.stats = {"queued": 0, "sent": 0, "failed": 0, "coalesced": 0, "dropped": 0, "messages": 0, "retries": 0, "rate_limited": 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, **values):
+        with self._stats_lock:
+            for key, value in values.items(): self.stats[key] += value
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="telegram-sender", daemon=True); self._thread.start()
+        return self
+
+    def submit(self, text, chat_id):
+        """Xếp cảnh báo vào hàng đợi, không chờ gửi; trả về False nếu hàng đợi đầy (cảnh báo bị bỏ)."""
+        with self._idle: self._pending += 1
+        try: self._queue.put_nowait(_Alert(chat_id, text))
+        except queue.Full:
+            with self._idle: self._pending -= 1; self._idle.notify_all()
+            self._count(dropped=1); logging.error("Telegram alert queue is full; dropping alert."); return False
+        self._count(queued=1)
+        return True
+
+    @property
+    def pending(self):
+        """Số cảnh báo đã xếp hàng nhưng chưa gửi xong."""
+        return self._pending
+
+    def flush(self, timeout=None):
+        """Chờ tới khi mọi cảnh báo đã xếp hàng được gửi xong (hoặc thất bại hẳn); trả về False nếu hết thời gian."""
+        with self._idle: return self._idle.wait_for(lambda: self._pending == 0, timeout)
+
+    def close(self, timeout=30):
+        if self._thread is None: return
+        if not self.flush(timeout): logging.warning(f"Telegram sender still had {self._pending} alerts pending at shutdown.")
+        self._queue.put(None); self._thread.join(timeout=5); self._thread = None
+        self.session.close()
+        logging.info(f"Telegram notifier stopped: {self.stats}")
+
+    def _collect(self, first):
+        alerts = [first]; deadline = time.monotonic() + self.coalesce_window_seconds; stop = False
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0: break
+            try: alert = self._queue.get(timeout=remaining)
+            except queue.Empty: break
+            if alert is None: stop = True; break
+            alerts.append(alert)
+        return alerts, stop
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None: return
+            alerts, stop = self._collect(first)
+            by_chat = {}
+            for alert in alerts: by_chat.setdefault(alert.chat_id, []).append(alert.text)
+            for chat_id, texts in by_chat.items():
+                digests = build_digests(texts)
+                if len(digests) < len(texts):
+                    logging.info(f"Coalesced {len(texts)} alerts for chat {chat_id} into {len(digests)} Telegram messages.")
+                    self._count(coalesced=len(texts) - len(digests))
+                for text, alert_count in digests:
+                    try: self._deliver(chat_id, text, alert_count)
+                    except Exception as e: logging.error(f"Unexpected error during Telegram send: {e}", exc_info=True); self._count(failed=alert_count)
+            with self._idle: self._pending -= len(alerts); self._idle.notify_all()
+            if stop: return
+
+    def _backoff(self, attempt):
+        return min(self.max_backoff_seconds, self.backoff_seconds * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+    def _post(self, payload):
+        if self.backend is None: return self._timed_post(payload)
+        with self.backend.slot(): return self._timed_post(payload)
+
+    def _timed_post(self, payload):
+        start = time.perf_counter()
+        try: return self.session.post(self.send_url, json=payload, timeout=self.timeout)
+        finally:
+            if self.observe_send is not None: self.observe_send(time.perf_counter() - start)
+
+    def _deliver(self, chat_id, text, alert_count):
+        payload = {"chat_id": chat_id, "text": text}
+        if self.parse_mode: payload["parse_mode"] = self.parse_mode
+        for attempt in range(self.max_retries + 1):
+            delay = self._backoff(attempt)
+            try: response = self._post(payload)
+            except requests.exceptions.RequestException as e: logging.warning(f"Error sending Telegram alert (attempt {attempt + 1}): {e}")
+            else:
+                try: body = response.json()
+                except ValueError: body = {}
+                if response.ok and body.get("ok", True):
+                    self._count(sent=alert_count, messages=1)
+                    if self.on_sent: self.on_sent(alert_count)
+                    logging.info(f"Sent {alert_count} alert(s) to Telegram chat {chat_id} in one message."); return True
+                description = body.get("description", response.text[:200])
+                if response.status_code == 429:
+                    # Telegram cho biết phải chờ bao lâu trong parameters.retry_after
+                    delay = float((body.get("parameters") or {}).get("retry_after", delay)); self._count(rate_limited=1)
+                    logging.warning(f"Telegram rate limited the bot; retrying after {delay:.1f}s.")
+                elif response.status_code == 400 and "parse_mode" in payload and "parse" in description.lower():
+                    # Markdown không hợp lệ (ví dụ log chứa ký tự đặc biệt): gửi lại dạng văn bản thường
+                    logging.warning(f"Telegram could not parse alert Markdown ({description}); resending as plain text.")
+                    payload.pop("parse_mode"); delay = 0
+                elif response.status_code < 500:
+                    logging.error(f"Telegram rejected alert with HTTP {response.status_code}: {description}"); break
+                else: logging.warning(f"Telegram returned HTTP {response.status_code} (attempt {attempt + 1}): {description}")
+            if attempt == self.max_retries: break
+            self._count(retries=1); time.sleep(delay)
+        self._count(failed=alert_count); logging.error(f"Giving up on {alert_count} Telegram alert(s) for chat {chat_id}.")
+        return False
+
@@ -0,0 +1,577 @@
+"""Chạy pipeline thật của agent trên dữ liệu ghi sẵn hoặc sinh tổng hợp, không cần cluster, Loki, Gemini hay Telegram.
+
+K8s, Loki, Gemini và Telegram được thay bằng backend giả (trong bộ nhớ / cục bộ); phần còn lại
+(quét, lọc log, gom workload, batch, cache, ghi SQLite, hàng đợi cảnh báo) là code của main.py.
+Báo cáo số chu kỳ/giây, độ trễ từng stage (từ histogram agent_stage_duration_seconds) và bộ nhớ đỉnh.
+
+Ví dụ: python app/replay.py synthetic --pods 5000 --log-lines 1000000 --cycles 5
+       python app/replay.py synthetic --pods 2000 --write-fixtures /tmp/fixtures
+       python app/replay.py fixtures /tmp/fixtures --cycles 3 --json > report.json
+       python app/replay.py fixtures /tmp/fixtures --baseline report.json --max-regression 0.2
+
+Thư mục fixture (JSONL, mỗi dòng một object theo định dạng JSON của Kubernetes API / Loki):
+  pods.jsonl, nodes.jsonl, events.jsonl, replicasets.jsonl (tùy chọn)
+  loki.jsonl   - mỗi dòng là một stream {"stream": {...}, "values": [[ts_ns, line], ...]}
+                 hoặc nguyên phản hồi query_range {"data": {"result": [...]}}
+  meta.json    - {"recorded_at": "<ISO time>"} (tùy chọn): mọi timestamp được dời sao cho
+                 thời điểm ghi trùng với lúc replay, để cửa sổ thời gian của agent vẫn khớp dữ liệu
+"""
+import os
+import re
+import sys
+import json
+import time
+import heapq
+import random
+import logging
+import argparse
+import resource
+import tempfile
+import threading
+import tracemalloc
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from itertools import islice
+from urllib.parse import urlparse
+
+import requests
+from kubernetes.client.exceptions import ApiException
+
+from fakes import FakeModelClient, FakeTelegramServer
+
+# Các trường thời gian của object K8s được đổi sang datetime (và dời theo đồng hồ replay) khi nạp
+TIME_FIELDS = {"creationTimestamp", "startTime", "startedAt", "finishedAt", "lastTimestamp", "firstTimestamp", "eventTime",
+               "lastTransitionTime", "lastProbeTime", "lastHeartbeatTime", "deletionTimestamp"}
+# Các trường là map tùy ý (không phải object có schema): giữ nguyên dict
+MAP_FIELDS = {"labels", "annotations", "allocatable", "capacity", "nodeSelector", "data"}
+
+
+@lru_cache(maxsize=None)
+def _camel(name):
+    head, *rest = name.split("_")
+    return head + "".join(part[:1].upper() + part[1:] for part in rest)
+
+
+def parse_time(value):
+    return datetime.fromisoformat(value.replace("Z", "+00:00")) if isinstance(value, str) else value
+
+
+class K8sObject:
+    """Bọc JSON của Kubernetes API để truy cập như model của thư viện kubernetes (pod.status.container_statuses...).
+
+    Trường không có trả về None như model thật; trường map (labels, allocatable...) trả về dict.
+    Giá trị được chuyển đổi một lần rồi giữ lại, để các lần quét sau truy cập nhanh như thuộc tính thường.
+    """
+
+    def __init__(self, data):
+        self._data = data
+
+    def __getattr__(self, name):
+        if name.startswith("__"): raise AttributeError(name)
+        key = _camel(name); value = self._data.get(key)
+        if isinstance(value, dict): value = value if key in MAP_FIELDS else K8sObject(value)
+        elif isinstance(value, list): value = [K8sObject(item) if isinstance(item, dict) else item for item in value]
+        self.__dict__[name] = value
+        return value
+
+    def to_dict(self):
+        return self._data
+
+    def __repr__(self):
+        return f"K8sObject({self._data!r})"
+
+
+def shift_times(obj, offset):
+    """Đổi các trường thời gian sang datetime (cộng `offset`) tại chỗ, đệ quy."""
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            if key in TIME_FIELDS and isinstance(value, str): obj[key] = parse_time(value) + offset
+            elif isinstance(value, (dict, list)): shift_times(value, offset)
+    elif isinstance(obj, list):
+        for item in obj: shift_times(item, offset)
+    return obj
+
+
+def _json_default(value):
+    if isinstance(value, datetime): return value.isoformat().replace("+00:00", "Z")
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class _ListResult:
+    def __init__(self, items):
+        self.items = items
+
+
+# --- Kubernetes giả ---
+class StubCoreV1:
+    """Thay cho client.CoreV1Api: trả dữ liệu từ bộ nhớ, có thể thêm độ trễ cho mỗi lời gọi."""
+
+    def __init__(self, pods, nodes=(), events=(), latency_seconds=0.0):
+        self.latency_seconds = latency_seconds
+        self.pods_by_namespace = {}; self.pods = {}; self.nodes = {}; self.events = {}
+        for pod in pods:
+            pod = K8sObject(pod); key = (pod.metadata.namespace, pod.metadata.name)
+            self.pods[key] = pod; self.pods_by_namespace.setdefault(key[0], []).append(pod)
+        for node in nodes: node = K8sObject(node); self.nodes[node.metadata.name] = node
+        for event in events:
+            event = K8sObject(event); involved = event.involved_object
+            if involved is None: continue
+            self.events.setdefault((involved.namespace or event.metadata.namespace, involved.name), []).append(event)
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _call(self):
+        with self._lock: self.calls += 1
+        if self.latency_seconds: time.sleep(self.latency_seconds)
+
+    def list_namespaced_pod(self, namespace, **kwargs):
+        self._call(); return _ListResult(list(self.pods_by_namespace.get(namespace, ())))
+
+    def read_namespaced_pod(self, name, namespace, **kwargs):
+        self._call(); pod = self.pods.get((namespace, name))
+        if pod is None: raise ApiException(status=404, reason="Not Found")
+        return pod
+
+    def read_node(self, name, **kwargs):
+        self._call(); node = self.nodes.get(name)
+        if node is None: raise ApiException(status=404, reason="Not Found")
+        return node
+
+    def list_namespaced_event(self, namespace, field_selector=None, limit=None, **kwargs):
+        self._call()
+        selector = dict(part.split("=", 1) for part in (field_selector or "").split(",") if "=" in part)
+        if "involvedObject.name" in selector: events = self.events.get((selector.get("involvedObject.namespace", namespace), selector["involvedObject.name"]), [])
+        else: events = [event for (ns, _), items in self.events.items() if ns == namespace for event in items]
+        return _ListResult(events[:limit] if limit else list(events))
+
+
+class StubAppsV1:
+    """Thay cho client.AppsV1Api: ReplicaSet lấy từ fixture, hoặc suy ra Deployment từ tên (bỏ hậu tố hash)."""
+
+    def __init__(self, replica_sets=(), latency_seconds=0.0):
+        self.latency_seconds = latency_seconds
+        self.replica_sets = {}
+        for replica_set in replica_sets:
+            replica_set = K8sObject(replica_set); self.replica_sets[(replica_set.metadata.namespace, replica_set.metadata.name)] = replica_set
+
+    def read_namespaced_replica_set(self, name, namespace, **kwargs):
+        if self.latency_seconds: time.sleep(self.latency_seconds)
+        replica_set = self.replica_sets.get((namespace, name))
+        if replica_set is not None: return replica_set
+        deployment = name.rsplit("-", 1)[0]
+        return K8sObject({"metadata": {"name": name, "namespace": namespace, "ownerReferences": [{"kind": "Deployment", "name": deployment, "controller": True}]}})
+
+
+# --- Loki giả ---
+class TemplatedLines:
+    """Dòng log tổng hợp lưu gọn: (chỉ số template, tham số) thay cho chuỗi, render khi được đọc."""
+    __slots__ = ("templates", "template_ids", "params")
+
+    def __init__(self, templates):
+        self.templates = templates; self.template_ids = array("H"); self.params = array("l")
+
+    def append(self, template_id, param):
+        self.template_ids.append(template_id); self.params.append(param)
+
+    def __len__(self):
+        return len(self.template_ids)
+
+    def __getitem__(self, index):
+        return self.templates[self.template_ids[index]].format(self.params[index])
+
+    def matching(self, regex):
+        # Tham số chỉ là số nên kết quả lọc của một dòng giống kết quả lọc của template của nó
+        hits = {i for i, template in enumerate(self.templates) if regex.search(template)}
+        return array("l", (i for i, template_id in enumerate(self.template_ids) if template_id in hits))
+
+
+class _Stream:
+    __slots__ = ("labels", "ts", "lines", "_filtered")
+
+    def __init__(self, labels, ts, lines):
+        self.labels = labels; self.ts = ts; self.lines = lines; self._filtered = {}
+
+    def filtered(self, pattern, regex):
+        """(timestamps, chỉ số dòng) của các dòng khớp line filter; tính một lần cho mỗi pattern."""
+        cached = self._filtered.get(pattern)
+        if cached is None:
+            if isinstance(self.lines, TemplatedLines): indexes = self.lines.matching(regex)
+            else: indexes = array("l", (i for i, line in enumerate(self.lines) if regex.search(line)))
+            cached = self._filtered[pattern] = (array("q", (self.ts[i] for i in indexes)), indexes)
+        return cached
+
+
+_MATCHER = re.compile(r'\s*([A-Za-z_][A-Za-z0-9_]*)\s*(=~|!~|!=|=)\s*("(?:[^"\\]|\\.)*"|`[^`]*`)\s*,?')
+_LINE_FILTER = re.compile(r'\|~\s*("(?:[^"\\]|\\.)*"|`[^`]*`)')
+
+
+def _unquote(value):
+    return value[1:-1] if value.startswith("`") else json.loads(value)
+
+
+def _literal_alternatives(pattern):
+    """Tập tên nếu regex chỉ là phép "hoặc" của các chuỗi cố định (như selector của LokiBulkFetcher), ngược lại None."""
+    names = {re.sub(r"\\(.)", r"\1", part) for part in pattern.split("|")}
+    return names if "|".join(sorted(re.escape(name) for name in names)) == "|".join(sorted(pattern.split("|"))) else None
+
+
+def parse_logql(query):
+    """LogQL tối thiểu: selector nhãn (=, !=, =~, !~) và line filter |~ (đủ cho các truy vấn agent sinh ra)."""
+    selector_end = query.index("}"); selector = query[query.index("{") + 1:selector_end]
+    matchers = []; position = 0
+    while position < len(selector):
+        match = _MATCHER.match(selector, position)
+        if not match: raise ValueError(f"Unsupported LogQL selector: {selector!r}")
+        matchers.append((match.group(1), match.group(2), _unquote(match.group(3)))); position = match.end()
+    line_filter = _LINE_FILTER.search(query, selector_end)
+    return matchers, _unquote(line_filter.group(1)) if line_filter else None
+
+
+class LokiStore:
+    """Log theo stream (sắp theo thời gian), đánh chỉ mục theo (namespace, pod) để truy vấn theo pod không phải quét hết."""
+
+    def __init__(self):
+        self.streams = []; self.by_namespace = {}; self.by_pod = {}
+
+    def add_stream(self, labels, ts, lines):
+        stream = _Stream(labels, ts, lines); self.streams.append(stream)
+        self.by_namespace.setdefault(labels.get("namespace"), []).append(stream)
+        self.by_pod.setdefault((labels.get("namespace"), labels.get("pod")), []).append(stream)
+        return stream
+
+    def add_values(self, labels, values, offset_ns=0):
+        values = sorted((int(ts) + offset_ns, line) for ts, line in values)
+        return self.add_stream(dict(labels), array("q", (ts for ts, _ in values)), [line for _, line in values])
+
+    @property
+    def line_count(self):
+        return sum(len(stream.ts) for stream in self.streams)
+
+    def _candidates(self, matchers):
+        namespace = next((value for name, op, value in matchers if name == "namespace" and op == "="), None)
+        pod_names = None
+        for name, op, value in matchers:
+            if name == "pod" and op == "=": pod_names = {value}
+            elif name == "pod" and op == "=~": pod_names = _literal_alternatives(value)
+        if namespace is not None and pod_names is not None: return [stream for pod_name in pod_names for stream in self.by_pod.get((namespace, pod_name), ())]
+        if namespace is not None: return self.by_namespace.get(namespace, [])
+        return self.streams
+
+    @staticmethod
+    def _matches(labels, matchers):
+        for name, op, value in matchers:
+            actual = labels.get(name, "")
+            if op == "=" and actual != value: return False
+            if op == "!=" and actual == value: return False
+            if op == "=~" and not re.fullmatch(value, actual): return False
+            if op == "!~" and re.fullmatch(value, actual): return False
+        return True
+
+    @staticmethod
+    def _entries(n, ts, lo, hi, backward):
+        if backward: return ((-ts[i], n, i) for i in range(hi - 1, lo - 1, -1))
+        return ((ts[i], n, i) for i in range(lo, hi))
+
+    def query_range(self, query, start_ns, end_ns, limit, direction="forward"):
+        matchers, line_filter = parse_logql(query)
+        regex = re.compile(line_filter) if line_filter else None
+        selected = []
+        for stream in self._candidates(matchers):
+            if not self._matches(stream.labels, matchers): continue
+            ts, indexes = stream.filtered(line_filter, regex) if regex else (stream.ts, None)
+            lo = bisect_left(ts, start_ns); hi = bisect_left(ts, end_ns)
+            if lo < hi: selected.append((stream, ts, indexes, lo, hi))
+        # Giống Loki: `limit` áp cho tổng số dòng của mọi stream, lấy từ đầu (forward) hoặc cuối (backward) khoảng thời gian
+        entries = heapq.merge(*(self._entries(n, ts, lo, hi, direction == "backward") for n, (_, ts, _, lo, hi) in enumerate(selected)))
+        result = {}
+        for _, n, i in islice(entries, limit):
+            stream, ts, indexes, _, _ = selected[n]
+            result.setdefault(n, []).append([str(ts[i]), stream.lines[indexes[i] if indexes is not None else i]])
+        return [{"stream": selected[n][0].labels, "values": values} for n, values in result.items()]
+
+    def warmup(self, query):
+        """Tính trước kết quả line filter của truy vấn quét, để chi phí đó không bị tính vào stage của agent."""
+        matchers, line_filter = parse_logql(query)
+        if not line_filter: return
+        regex = re.compile(line_filter)
+        for stream in self._candidates(matchers):
+            if self._matches(stream.labels, matchers): stream.filtered(line_filter, regex)
+
+
+class StubLokiSession:
+    """Thay cho requests.Session của backend Loki: trả lời /loki/api/v1/query_range từ LokiStore."""
+
+    def __init__(self, store, latency_seconds=0.0):
+        self.store = store; self.latency_seconds = latency_seconds
+        self.stats = {"requests": 0, "lines": 0, "seconds": 0.0}
+        self._lock = threading.Lock()
+
+    def request(self, method, url, params=None, headers=None, timeout=None, **kwargs):
+        start = time.perf_counter(); path = urlparse(url).path; params = dict(params or {})
+        if path.endswith("/query_range"):
+            try:
+                streams = self.store.query_range(params["query"], int(params["start"]), int(params["end"]), int(params.get("limit", 100)), params.get("direction", "forward"))
+                status, body = 200, {"status": "success", "data": {"resultType": "streams", "result": streams}}
+            except (KeyError, ValueError, re.error) as e: status, body, streams = 400, {"status": "error", "error": f"parse error: {e}"}, []
+        else: status, body, streams = 404, {"status": "error", "error": f"unsupported path {path}"}, []
+        response = requests.Response(); response.status_code = status; response.url = url
+        response._content = json.dumps(body).encode("utf-8"); response.headers["Content-Type"] = "application/json"
+        if self.latency_seconds: time.sleep(self.latency_seconds)
+        with self._lock:
+            self.stats["requests"] += 1; self.stats["lines"] += sum(len(stream["values"]) for stream in streams)
+            self.stats["seconds"] += time.perf_counter() - start
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def close(self):
+        pass
+
+
+# --- Dữ liệu ---
+class Dataset:
+    def __init__(self, pods, nodes, events, replica_sets, loki_store):
+        self.pods = pods; self.nodes = nodes; self.events = events; self.replica_sets = replica_sets; self.loki = loki_store
+
+    @property
+    def namespaces(self):
+        return sorted({pod["metadata"]["namespace"] for pod in self.pods})
+
+    def write(self, directory):
+        """Ghi ra thư mục fixture (cùng định dạng load_fixtures đọc), để replay lại đúng bộ dữ liệu này."""
+        os.makedirs(directory, exist_ok=True)
+        for name, items in (("pods", self.pods), ("nodes", self.nodes), ("events", self.events), ("replicasets", self.replica_sets)):
+            with open(os.path.join(directory, f"{name}.jsonl"), "w") as f:
+                for item in items: f.write(json.dumps(item, default=_json_default) + "\n")
+        with open(os.path.join(directory, "loki.jsonl"), "w") as f:
+            for stream in self.loki.streams: f.write(json.dumps({"stream": stream.labels, "values": [[str(ts), stream.lines[i]] for i, ts in enumerate(stream.ts)]}) + "\n")
+        with open(os.path.join(directory, "meta.json"), "w") as f: json.dump({"recorded_at": datetime.now(timezone.utc).isoformat()}, f)
+
+
+def _read_jsonl(path):
+    if not os.path.exists(path): return []
+    with open(path) as f: return [json.loads(line) for line in f if line.strip()]
+
+
+def load_fixtures(directory):
+    meta = json.load(open(os.path.join(directory, "meta.json"))) if os.path.exists(os.path.join(directory, "meta.json")) else {}
+    loki_records = _read_jsonl(os.path.join(directory, "loki.jsonl"))
+    streams = []
+    for record in loki_records: streams.extend(record["data"]["result"] if "data" in record else [record])
+    recorded_at = parse_time(meta["recorded_at"]) if meta.get("recorded_at") else None
+    if recorded_at is None and streams:
+        # Không có meta.json: coi dòng log mới nhất là thời điểm ghi
+        latest_ns = max(int(ts) for stream in streams for ts, _ in stream.get("values", []) or [(0, "")])
+        recorded_at = datetime.fromtimestamp(latest_ns / 1e9, tz=timezone.utc) if latest_ns else None
+    offset = datetime.now(timezone.utc) - recorded_at if recorded_at else timedelta(0)
+    store = LokiStore(); offset_ns = int(offset.total_seconds() * 1e9)
+    for stream in streams: store.add_values(stream.get("stream", {}), stream.get("values", []), offset_ns)
+    load = lambda name: shift_times(_read_jsonl(os.path.join(directory, f"{name}.jsonl")), offset)
+    logging.info(f"Loaded fixtures from {directory} (time offset {offset}).")
+    return Dataset(load("pods"), load("nodes"), load("events"), load("replicasets"), store)
+
+
+# Template log tổng hợp: phần lớn là INFO, một ít WARNING/ERROR cho pod khỏe, nhiều lỗi cho pod có vấn đề
+INFO_TEMPLATES = ["INFO GET /api/v1/orders 200 {}us", "level=info msg=\"request served\" path=/healthz latency_us={}",
+                  "INFO cache hit ratio=0.93 keys={}", "DEBUG processed batch id={}", "INFO connected to upstream db:5432 conn={}"]
+WARNING_TEMPLATES = ["WARNING slow query took {}ms", "[WARNING] disk usage at 91% on /var/lib/data inode={}"]
+ERROR_TEMPLATES = ['{{"level":"error","msg":"connection refused","upstream":"db:5432","attempt":{}}}', "ERROR: failed to handle request id={}",
+                  "panic: runtime error: invalid memory address or nil pointer dereference goroutine={}",
+                  "java.lang.NullPointerException at com.example.Service.handle(Service.java:{})", "upstream service unavailable, retrying in {}s"]
+LOG_TEMPLATES = INFO_TEMPLATES + WARNING_TEMPLATES + ERROR_TEMPLATES
+PROBLEM_KINDS = ("CrashLoopBackOff", "OOMKilled", "ImagePullBackOff", "Unschedulable", "Failed")
+
+
+def _iso(moment):
+    return moment.isoformat().replace("+00:00", "Z")
+
+
+def _synthetic_pod(rng, namespace, deployment, replica_set, pod_name, node, now, problem):
+    started = now - timedelta(hours=rng.randint(1, 72))
+    container = {"name": "app", "ready": problem is None, "restartCount": rng.randint(0, 2), "image": f"registry.local/{deployment}:1.0",
+                 "state": {"running": {"startedAt": _iso(started)}}}
+    status = {"phase": "Running", "startTime": _iso(started), "containerStatuses": [container],
+              "conditions": [{"type": "Ready", "status": "True" if problem is None else "False"}, {"type": "PodScheduled", "status": "True"}]}
+    if problem == "CrashLoopBackOff":
+        container["restartCount"] = rng.randint(6, 40); container["state"] = {"waiting": {"reason": "CrashLoopBackOff", "message": "back-off restarting failed container"}}
+        # Exit code của lần chạy trước suy ra từ restartCount (không tiêu thêm số ngẫu nhiên, dữ liệu cũ giữ nguyên)
+        container["lastState"] = {"terminated": {"reason": "Error", "exitCode": (1, 137, 139)[container["restartCount"] % 3]}}
+    elif problem == "OOMKilled":
+        container["restartCount"] = rng.randint(1, 4)
+        container["state"] = {"terminated": {"reason": "OOMKilled", "exitCode": 137, "finishedAt": _iso(now - timedelta(minutes=rng.randint(1, 10)))}}
+    elif problem == "ImagePullBackOff":
+        container["state"] = {"waiting": {"reason": "ImagePullBackOff", "message": "Back-off pulling image"}}
+    elif problem == "Unschedulable":
+        status = {"phase": "Pending", "conditions": [{"type": "PodScheduled", "status": "False", "reason": "Unschedulable", "message": "0/30 nodes are available: insufficient memory."}]}
+        node = None
+    elif problem == "Failed":
+        status["phase"] = "Failed"
+    return {"metadata": {"name": pod_name, "namespace": namespace, "labels": {"app": deployment}, "creationTimestamp": _iso(started),
+                         "ownerReferences": [{"kind": "ReplicaSet", "name": replica_set, "controller": True}]},
+            "spec": {"nodeName": node, "restartPolicy": "Always"}, "status": status}
+
+
+def synthetic_dataset(pods=1000, namespaces=10, pods_per_workload=5, problem_ratio=0.02, log_lines=100000, log_problem_ratio=0.01,
+                      log_minutes=30, pods_per_node=30, seed=42):
+    """Sinh cluster tổng hợp: `pods` pod chia đều cho `namespaces`, nhóm theo Deployment; `problem_ratio` pod có lỗi K8s,
+    `log_problem_ratio` pod chỉ có lỗi trong log; `log_lines` dòng log rải trong `log_minutes` phút gần nhất."""
+    rng = random.Random(seed); now = datetime.now(timezone.utc)
+    node_names = [f"node-{i}" for i in range(max(1, pods // pods_per_node))]
+    pod_list = []; events = []; log_problem_pods = set()
+    for index in range(pods):
+        namespace = f"ns-{index % namespaces}"; workload = index // (namespaces * pods_per_workload)
+        deployment = f"svc-{workload}"; replica_set = f"{deployment}-{(workload * 2654435761) % 0xFFFFF:05x}"
+        pod_name = f"{replica_set}-{rng.getrandbits(25):07x}"
+        problem = rng.choice(PROBLEM_KINDS) if rng.random() < problem_ratio else None
+        pod = _synthetic_pod(rng, namespace, deployment, replica_set, pod_name, rng.choice(node_names), now, problem); pod_list.append(pod)
+        if problem is None and rng.random() < log_problem_ratio: log_problem_pods.add((namespace, pod_name))
+        if problem is not None:
+            last_seen = now - timedelta(minutes=rng.randint(0, 10))
+            events.append({"metadata": {"name": f"{pod_name}.{index:x}", "namespace": namespace, "creationTimestamp": _iso(last_seen - timedelta(minutes=20))},
+                           "involvedObject": {"kind": "Pod", "name": pod_name, "namespace": namespace}, "type": "Warning",
+                           "reason": "BackOff" if problem != "Unschedulable" else "FailedScheduling", "message": f"{problem}: see pod status",
+                           "count": rng.randint(1, 50), "lastTimestamp": _iso(last_seen)})
+    nodes = [{"metadata": {"name": name}, "status": {"allocatable": {"cpu": "8", "memory": "32Gi"}, "nodeInfo": {"kubeletVersion": "v1.29.4"},
+                                                     "conditions": [{"type": "Ready", "status": "True"}, {"type": "MemoryPressure", "status": "False"}]}}
+             for name in node_names]
+    store = LokiStore(); end_ns = int(now.timestamp() * 1e9); span_ns = log_minutes * 60 * 10**9
+    problem_pods = {(pod["metadata"]["namespace"], pod["metadata"]["name"]) for pod in pod_list if pod["spec"]["nodeName"] is None or pod["status"]["phase"] != "Running"
+                    or not pod["status"]["containerStatuses"][0]["ready"]}
+    info_count = len(INFO_TEMPLATES); warning_end = info_count + len(WARNING_TEMPLATES)
+    running = [pod for pod in pod_list if pod["spec"]["nodeName"] is not None]
+    lines_per_pod = log_lines // max(1, len(running)); extra = log_lines - lines_per_pod * len(running)
+    for n, pod in enumerate(running):
+        key = (pod["metadata"]["namespace"], pod["metadata"]["name"]); count = lines_per_pod + (1 if n < extra else 0)
+        if not count: continue
+        error_rate = 0.3 if key in problem_pods or key in log_problem_pods else 0.0005
+        ts = array("q"); lines = TemplatedLines(LOG_TEMPLATES); step = span_ns // count
+        for i in range(count):
+            ts.append(end_ns - span_ns + i * step + rng.randrange(max(1, step)))
+            roll = rng.random()
+            if roll < error_rate: template_id = rng.randrange(warning_end, len(LOG_TEMPLATES))
+            elif roll < error_rate * 2: template_id = rng.randrange(info_count, warning_end)
+            else: template_id = rng.randrange(info_count)
+            lines.append(template_id, rng.randrange(1, 100000))
+        store.add_stream({"namespace": key[0], "pod": key[1], "container": "app", "app": pod["metadata"]["labels"]["app"]}, ts, lines)
+    return Dataset(shift_times(pod_list, timedelta(0)), shift_times(nodes, timedelta(0)), shift_times(events, timedelta(0)), [], store)
+
+
+# --- Chạy pipeline ---
+def _peak_rss_mb():
+    # ru_maxrss tính bằng KB trên Linux, byte trên macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024, 1)
+
+
+def configure_environment(args, dataset, telegram_url, db_path):
+    """Biến môi trường cho main.py (phải đặt trước khi import main); biến người dùng đã đặt sẵn được giữ nguyên."""
+    defaults = {"K8S_NAMESPACES": ",".join(dataset.namespaces), "LOKI_URL": "http://loki.replay", "MODEL_CLIENT": "fake",
+                "TELEGRAM_BOT_TOKEN": "replay", "TELEGRAM_CHAT_ID": "replay", "TELEGRAM_COALESCE_WINDOW_SECONDS": "0.2",
+                "DB_PATH": db_path, "METRICS_PORT": "0", "SCAN_INTERVAL_SECONDS": "0", "ALERT_COOLDOWN_MINUTES": str(args.cooldown_minutes),
+                # Backend giả không cần giới hạn tốc độ: đo chi phí của chính agent (đặt biến *_RATE_PER_SECOND để mô phỏng giới hạn thật)
+                "K8S_RATE_PER_SECOND": "0", "LOKI_RATE_PER_SECOND": "0", "GEMINI_RATE_PER_SECOND": "0", "TELEGRAM_RATE_PER_SECOND": "0"}
+    for key, value in defaults.items(): os.environ.setdefault(key, value)
+    os.environ["TELEGRAM_API_URL"] = telegram_url
+    # Watch cache và chế độ event cần API watch thật; replay luôn chạy vòng lặp quét theo chu kỳ
+    os.environ["K8S_WATCH_CACHE_ENABLED"] = "false"; os.environ["DETECTION_MODE"] = "interval"
+
+
+def run_replay(dataset, args):
+    telegram = FakeTelegramServer(latency_seconds=args.telegram_latency).start()
+    db_dir = tempfile.mkdtemp(prefix="agent-replay-")
+    configure_environment(args, dataset, telegram.url, os.path.join(db_dir, "agent.db"))
+    import main
+    main.k8s_core_v1 = StubCoreV1(dataset.pods, dataset.nodes, dataset.events, args.k8s_latency)
+    main.k8s_apps_v1 = StubAppsV1(dataset.replica_sets, args.k8s_latency)
+    main.model_client = FakeModelClient(latency_seconds=args.gemini_latency, per_item_latency_seconds=args.gemini_per_item_latency)
+    loki_session = StubLokiSession(dataset.loki, args.loki_latency); main.BACKENDS["loki"]._session = loki_session
+    if not main.init_db(): raise SystemExit("Failed to initialize replay database.")
+    main.start_pipeline()
+    warmup_start = time.perf_counter(); dataset.loki.warmup(main.build_loki_scan_query()); warmup_seconds = time.perf_counter() - warmup_start
+    rss_before_mb = _peak_rss_mb()
+    if args.tracemalloc: tracemalloc.start()
+    start = time.perf_counter(); main.main_loop(max_cycles=args.cycles); wall_seconds = time.perf_counter() - start
+    traced_peak_mb = round(tracemalloc.get_traced_memory()[1] / 2**20, 1) if args.tracemalloc else None
+    if args.tracemalloc: tracemalloc.stop()
+    flush_start = time.perf_counter(); main.stop_pipeline(); flush_seconds = time.perf_counter() - flush_start
+    telegram.stop()
+    cycles = main.CYCLE_SECONDS.snapshot().get((), {})
+    stages = {labels[0]: {key: (round(value, 4) if isinstance(value, float) else value) for key, value in stats.items()}
+              for labels, stats in sorted(main.STAGE_SECONDS.snapshot().items())}
+    return {"pods": len(dataset.pods), "namespaces": len(dataset.namespaces), "log_lines": dataset.loki.line_count, "cycles": args.cycles,
+            "wall_seconds": round(wall_seconds, 3), "cycles_per_sec": round(args.cycles / wall_seconds, 3) if wall_seconds else None,
+            "cycle_mean_seconds": round(cycles["mean"], 4) if cycles.get("mean") is not None else None,
+            "stages": stages, "investigations": {labels[0]: value for labels, value in main.PODS_INVESTIGATED.snapshot().items()},
+            "alerts_delivered": main.telegram_notifier.stats["sent"] if main.telegram_notifier else 0, "telegram_messages": len(telegram.messages),
+            "telegram_flush_seconds": round(flush_seconds, 3), "model_calls": main.model_client.calls, "k8s_calls": main.k8s_core_v1.calls,
+            "loki": {**loki_session.stats, "seconds": round(loki_session.stats["seconds"], 3), "warmup_seconds": round(warmup_seconds, 3)},
+            "rss_before_run_mb": rss_before_mb, "peak_rss_mb": _peak_rss_mb(), "traced_peak_mb": traced_peak_mb}
+
+
+def print_report(report):
+    print(f"pods={report['pods']} namespaces={report['namespaces']} log_lines={report['log_lines']} cycles={report['cycles']}")
+    print(f"wall={report['wall_seconds']}s cycles/sec={report['cycles_per_sec']} mean cycle={report['cycle_mean_seconds']}s")
+    print(f"investigations={report['investigations']} model_calls={report['model_calls']} k8s_calls={report['k8s_calls']} "
+          f"alerts_delivered={report['alerts_delivered']} in {report['telegram_messages']} messages (flush {report['telegram_flush_seconds']}s)")
+    print(f"loki stub: {report['loki']}")
+    print(f"memory: rss before run {report['rss_before_run_mb']} MB, peak rss {report['peak_rss_mb']} MB, traced peak during run {report['traced_peak_mb']} MB")
+    print("per-stage latency (p50/p95/p99 estimated from histogram buckets):")
+    print(f"{'stage':32} {'count':>7} {'mean_ms':>9} {'p50_ms':>9} {'p95_ms':>9} {'p99_ms':>9}")
+    to_ms = lambda value: "-" if value is None else f"{value * 1000:.1f}"
+    for stage, stats in report["stages"].items():
+        print(f"{stage:32} {stats['count']:>7} {to_ms(stats['mean']):>9} {to_ms(stats['p50']):>9} {to_ms(stats['p95']):>9} {to_ms(stats['p99']):>9}")
+
+
+def compare_with_baseline(report, baseline, max_regression):
+    """In chênh lệch so với báo cáo trước; trả về False nếu cycles/sec giảm hoặc bộ nhớ đỉnh tăng quá `max_regression`."""
+    ok = True
+    for key, higher_is_better in (("cycles_per_sec", True), ("peak_rss_mb", False)):
+        old, new = baseline.get(key), report.get(key)
+        if not old or new is None: continue
+        change = (new - old) / old; regressed = -change > max_regression if higher_is_better else change > max_regression
+        print(f"{key}: {old} -> {new} ({change:+.1%}){' REGRESSION' if regressed else ''}"); ok = ok and not regressed
+    for stage, stats in report["stages"].items():
+        old = baseline.get("stages", {}).get(stage, {}).get("mean")
+        if old and stats.get("mean") is not None: print(f"  {stage}: mean {old * 1000:.1f}ms -> {stats['mean'] * 1000:.1f}ms ({(stats['mean'] - old) / old:+.1%})")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="source", required=True)
+    p = subparsers.add_parser("synthetic", help="cluster và log tổng hợp")
+    p.add_argument("--pods", type=int, default=1000); p.add_argument("--namespaces", type=int, default=10)
+    p.add_argument("--pods-per-workload", type=int, default=5); p.add_argument("--problem-ratio", type=float, default=0.02)
+    p.add_argument("--log-lines", type=int, default=100000); p.add_argument("--log-problem-ratio", type=float, default=0.01)
+    p.add_argument("--log-minutes", type=int, default=30); p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--write-fixtures", metavar="DIR", help="ghi bộ dữ liệu sinh ra thành thư mục fixture rồi thoát")
+    p = subparsers.add_parser("fixtures", help="dữ liệu ghi sẵn (JSONL) trong một thư mục")
+    p.add_argument("directory")
+    for p in subparsers.choices.values():
+        p.add_argument("--cycles", type=int, default=3); p.add_argument("--cooldown-minutes", type=int, default=0)
+        p.add_argument("--k8s-latency", type=float, default=0.0); p.add_argument("--loki-latency", type=float, default=0.0)
+        p.add_argument("--gemini-latency", type=float, default=0.0); p.add_argument("--gemini-per-item-latency", type=float, default=0.0)
+        p.add_argument("--telegram-latency", type=float, default=0.0); p.add_argument("--tracemalloc", action="store_true")
+        p.add_argument("--json", action="store_true"); p.add_argument("--log-level", default="WARNING")
+        p.add_argument("--baseline", help="báo cáo JSON của lần chạy trước để so sánh"); p.add_argument("--max-regression", type=float, default=0.2)
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level.upper(), format='%(asctime)s - %(levelname)s - %(message)s')
+    load_start = time.perf_counter()
+    if args.source == "synthetic":
+        dataset = synthetic_dataset(args.pods, args.namespaces, args.pods_per_workload, args.problem_ratio, args.log_lines, args.log_problem_ratio, args.log_minutes, seed=args.seed)
+        if args.write_fixtures: dataset.write(args.write_fixtures); print(f"Wrote fixtures to {args.write_fixtures}"); return
+    else: dataset = load_fixtures(args.directory)
+    load_seconds = time.perf_counter() - load_start
+    report = {**run_replay(dataset, args), "load_seconds": round(load_seconds, 3)}
+    if args.json: print(json.dumps(report, indent=2))
+    else: print_report(report)
+    if args.baseline:
+        with open(args.baseline) as f: baseline = json.load(f)
+        if not compare_with_baseline(report, baseline, args.max_regression): sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
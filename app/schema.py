@@ -0,0 +1,149 @@
+"""Schema SQLite của agent: danh sách migration (theo PRAGMA user_version) và job retention."""
+import logging
+import sqlite3
+
+from storage import compress_text
+
+# Các cột văn bản lớn của incident được tách sang incident_details và nén khi đủ dài
+DETAIL_COLUMNS = ("k8s_context", "sample_logs", "log_templates")
+
+
+def create_base_tables(cursor):
+    cursor.execute('''
+                CREATE TABLE IF NOT EXISTS incidents (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp TEXT NOT NULL, pod_key TEXT NOT NULL,
+                    severity TEXT NOT NULL, summary TEXT, initial_reasons TEXT, k8s_context TEXT, sample_logs TEXT, log_templates TEXT, workload TEXT ) ''')
+    # DB cũ chưa có các cột mới
+    incident_columns = [row[1] for row in cursor.execute('PRAGMA table_info(incidents)')]
+    for column in ('log_templates', 'workload'):
+        if column not in incident_columns: cursor.execute(f'ALTER TABLE incidents ADD COLUMN {column} TEXT')
+    cursor.execute('''
+                CREATE TABLE IF NOT EXISTS daily_stats (
+                    date TEXT PRIMARY KEY, gemini_calls INTEGER DEFAULT 0,
+                    telegram_alerts INTEGER DEFAULT 0, incident_count INTEGER DEFAULT 0,
+                    analysis_cache_hits INTEGER DEFAULT 0, analysis_cache_misses INTEGER DEFAULT 0 ) ''')
+    stats_columns = [row[1] for row in cursor.execute('PRAGMA table_info(daily_stats)')]
+    for column in ('analysis_cache_hits', 'analysis_cache_misses'):
+        if column not in stats_columns: cursor.execute(f'ALTER TABLE daily_stats ADD COLUMN {column} INTEGER DEFAULT 0')
+
+
+def add_epoch_timestamp(cursor):
+    # Timestamp dạng số nguyên (giây UTC) để sắp xếp/lọc qua index thay vì so sánh chuỗi ISO
+    cursor.execute('ALTER TABLE incidents ADD COLUMN ts_epoch INTEGER')
+    cursor.execute("UPDATE incidents SET ts_epoch = CAST(strftime('%s', timestamp) AS INTEGER)")
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_incidents_ts ON incidents (ts_epoch)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_incidents_pod_ts ON incidents (pod_key, ts_epoch)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_incidents_severity_ts ON incidents (severity, ts_epoch)')
+
+
+def move_details_to_compressed_table(cursor):
+    cursor.execute('''
+                CREATE TABLE IF NOT EXISTS incident_details (
+                    incident_id INTEGER PRIMARY KEY, k8s_context BLOB, sample_logs BLOB, log_templates BLOB ) ''')
+    rows = cursor.execute(f'SELECT id, {", ".join(DETAIL_COLUMNS)} FROM incidents').fetchall()
+    cursor.executemany('INSERT OR REPLACE INTO incident_details (incident_id, k8s_context, sample_logs, log_templates) VALUES (?, ?, ?, ?)',
+                       [(row[0], *(compress_text(value) for value in row[1:])) for row in rows])
+    cursor.execute(f'UPDATE incidents SET {", ".join(f"{column} = NULL" for column in DETAIL_COLUMNS)}')
+    logging.info(f"Moved details of {len(rows)} incidents into incident_details.")
+
+
+def create_incident_rollups(cursor):
+    # Số incident đã bị retention xóa, gộp theo ngày / pod / mức độ
+    cursor.execute('''
+                CREATE TABLE IF NOT EXISTS incident_rollups (
+                    date TEXT NOT NULL, pod_key TEXT NOT NULL, severity TEXT NOT NULL, count INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (date, pod_key, severity) ) ''')
+
+
+def create_hourly_rollups(cursor):
+    # Bucket theo giờ (epoch giây đầu giờ, UTC) để vẽ biểu đồ mà không phải quét bảng incidents
+    cursor.execute('''
+                CREATE TABLE IF NOT EXISTS hourly_incidents (
+                    hour INTEGER NOT NULL, namespace TEXT NOT NULL, severity TEXT NOT NULL, incident_count INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (hour, namespace, severity) ) ''')
+    cursor.execute('''
+                CREATE TABLE IF NOT EXISTS hourly_stats (
+                    hour INTEGER PRIMARY KEY, gemini_calls INTEGER DEFAULT 0, gemini_latency_ms INTEGER DEFAULT 0,
+                    gemini_prompt_tokens INTEGER DEFAULT 0, gemini_output_tokens INTEGER DEFAULT 0, telegram_alerts INTEGER DEFAULT 0,
+                    analysis_cache_hits INTEGER DEFAULT 0, analysis_cache_misses INTEGER DEFAULT 0 ) ''')
+    cursor.execute('''
+        INSERT INTO hourly_incidents (hour, namespace, severity, incident_count)
+            SELECT ts_epoch / 3600 * 3600, substr(pod_key, 1, instr(pod_key, '/') - 1), severity, COUNT(*)
+            FROM incidents WHERE ts_epoch IS NOT NULL GROUP BY 1, 2, 3 ''')
+
+
+def create_backend_health(cursor):
+    # Ảnh chụp sức khỏe mới nhất của từng backend (JSON từ Backend.health())
+    cursor.execute('''
+                CREATE TABLE IF NOT EXISTS backend_health (
+                    name TEXT PRIMARY KEY, health TEXT NOT NULL, updated_epoch INTEGER NOT NULL ) ''')
+
+
+def create_agent_state(cursor):
+    # Trạng thái giữ qua các lần khởi động lại agent: cooldown cảnh báo, điều tra đang chạy và bộ đếm chưa flush
+    cursor.execute('''
+                CREATE TABLE IF NOT EXISTS alert_cooldowns (
+                    key TEXT PRIMARY KEY, severity TEXT NOT NULL, alerted_at REAL NOT NULL, expires_at REAL NOT NULL ) ''')
+    cursor.execute('''
+                CREATE TABLE IF NOT EXISTS in_flight_investigations (
+                    key TEXT PRIMARY KEY, pod_key TEXT NOT NULL, started_at REAL NOT NULL ) ''')
+    cursor.execute('''
+                CREATE TABLE IF NOT EXISTS pending_stats (
+                    name TEXT PRIMARY KEY, value INTEGER NOT NULL DEFAULT 0 ) ''')
+
+
+def add_triage_stats(cursor):
+    # Số pod được phân loại bằng luật triage (không gọi Gemini) và số pod phải chuyển cho Gemini
+    for table in ('daily_stats', 'hourly_stats'):
+        for column in ('triage_hits', 'triage_misses'): cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} INTEGER DEFAULT 0')
+
+
+def create_analysis_cache(cursor):
+    # Kết quả phân tích Gemini theo fingerprint (trước đây AnalysisCache.load tự tạo bảng này, nên có thể đã tồn tại)
+    cursor.execute('''
+                CREATE TABLE IF NOT EXISTS analysis_cache (
+                    fingerprint TEXT PRIMARY KEY, result TEXT NOT NULL, created_at REAL NOT NULL ) ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_analysis_cache_created_at ON analysis_cache (created_at)')
+
+
+def drop_incident_detail_columns(cursor):
+    # Các cột chi tiết trên incidents đã rỗng từ move_details_to_compressed_table; DROP COLUMN cần SQLite >= 3.35
+    if sqlite3.sqlite_version_info < (3, 35, 0):
+        logging.warning(f"SQLite {sqlite3.sqlite_version} does not support DROP COLUMN; keeping the emptied detail columns on incidents."); return
+    columns = [row[1] for row in cursor.execute('PRAGMA table_info(incidents)')]
+    for column in DETAIL_COLUMNS:
+        if column in columns: cursor.execute(f'ALTER TABLE incidents DROP COLUMN {column}')
+
+
+MIGRATIONS = [create_base_tables, add_epoch_timestamp, move_details_to_compressed_table, create_incident_rollups, create_hourly_rollups,
+              create_backend_health, create_agent_state, add_triage_stats, create_analysis_cache, drop_incident_detail_columns]
+
+
+def prune_incidents(cursor, cutoff_epoch):
+    """Gộp các incident cũ hơn cutoff vào incident_rollups rồi xóa chúng (kèm chi tiết); trả về số incident đã xóa."""
+    cursor.execute('''
+        INSERT INTO incident_rollups (date, pod_key, severity, count)
+            SELECT date(ts_epoch, 'unixepoch'), pod_key, severity, COUNT(*) FROM incidents WHERE ts_epoch < ? GROUP BY 1, 2, 3
+        ON CONFLICT (date, pod_key, severity) DO UPDATE SET count = count + excluded.count ''', (cutoff_epoch,))
+    cursor.execute('DELETE FROM incident_details WHERE incident_id IN (SELECT id FROM incidents WHERE ts_epoch < ?)', (cutoff_epoch,))
+    cursor.execute('DELETE FROM incidents WHERE ts_epoch < ?', (cutoff_epoch,))
+    return cursor.rowcount
+
+
+def prune_hourly_rollups(cursor, cutoff_epoch):
+    """Xóa các bucket hourly_incidents / hourly_stats bắt đầu trước cutoff (số liệu theo ngày vẫn còn trong daily_stats và incident_rollups)."""
+    cursor.execute('DELETE FROM hourly_incidents WHERE hour < ?', (cutoff_epoch,)); pruned = cursor.rowcount
+    cursor.execute('DELETE FROM hourly_stats WHERE hour < ?', (cutoff_epoch,))
+    return pruned + cursor.rowcount
+
+
+def prune_analysis_cache(cursor, cutoff):
+    """Xóa các kết quả phân tích tạo trước cutoff (epoch giây, hết TTL); trả về số mục đã xóa."""
+    cursor.execute('DELETE FROM analysis_cache WHERE created_at < ?', (cutoff,))
+    return cursor.rowcount
+
+
+def incremental_vacuum(cursor):
+    """Trả các trang trống về hệ điều hành; phải chạy ngoài transaction (Storage.run(..., transaction=False))."""
+    cursor.connection.executescript('PRAGMA incremental_vacuum;')
+    return cursor.connection.execute('PRAGMA freelist_count').fetchone()[0]
@@ -0,0 +1,170 @@
+"""Chia việc quét giữa nhiều replica agent, phối hợp qua Lease (coordination.k8s.io).
+
+Mỗi replica giữ một Lease riêng `<group>-<identity>` và gia hạn định kỳ; các Lease còn hạn là các thành viên
+hiện tại. Khóa shard (namespace hoặc workload) được gán cho thành viên bằng consistent hashing, nên khi một
+replica tham gia hoặc chết chỉ khoảng 1/N số khóa đổi chủ. Replica không gia hạn được Lease của mình quá
+`lease_duration_seconds` tự coi như đã mất shard (không quét gì) để không trùng việc với replica đã nhận thay.
+"""
+import bisect
+import hashlib
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+
+from kubernetes import client
+from kubernetes.client.exceptions import ApiException
+
+# Nhãn đánh dấu Lease thuộc nhóm agent nào (dùng làm label selector khi liệt kê thành viên)
+GROUP_LABEL = "k8s-log-agent/shard-group"
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.md5(value.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """Vòng consistent hashing với `vnodes` điểm ảo cho mỗi thành viên để chia khóa đều hơn."""
+
+    def __init__(self, members=(), vnodes=64):
+        self.vnodes = vnodes
+        self.members = tuple(sorted(set(members)))
+        points = sorted((_hash(f"{member}#{i}"), member) for member in self.members for i in range(vnodes))
+        self._hashes = [point for point, _ in points]
+        self._owners = [member for _, member in points]
+
+    def owner(self, key):
+        if not self._hashes: return None
+        return self._owners[bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)]
+
+
+def workload_shard_key(namespace, pod_name, pod=None):
+    """Khóa shard theo workload: mọi pod của cùng Deployment/StatefulSet/DaemonSet/Job về cùng một replica.
+
+    Dùng ownerReferences của pod (ReplicaSet được quy về Deployment qua nhãn pod-template-hash, không cần gọi API);
+    pod không có owner hoặc không đọc được thì dùng chính tên pod.
+    """
+    if pod is not None and pod.metadata is not None:
+        refs = pod.metadata.owner_references or []
+        ref = next((ref for ref in refs if ref.controller), refs[0] if refs else None)
+        if ref is not None:
+            template_hash = (pod.metadata.labels or {}).get("pod-template-hash")
+            if ref.kind == "ReplicaSet" and template_hash and ref.name.endswith(f"-{template_hash}"):
+                return f"{namespace}/Deployment/{ref.name[:-len(template_hash) - 1]}"
+            return f"{namespace}/{ref.kind}/{ref.name}"
+    return f"{namespace}/Pod/{pod_name}"
+
+
+class LeaseCoordinator:
+    """Thành viên của một nhóm replica: gia hạn Lease của mình, theo dõi thành viên còn sống và trả lời owns(key).
+
+    `lease_api` là client.CoordinationV1Api (khi thử nghiệm: tests/fakes.py FakeLeaseApi); `clock()` trả về thời điểm UTC hiện tại.
+    Handler đăng ký bằng add_change_handler(func(old_members, new_members)) được gọi mỗi lần phân chia thay đổi.
+    """
+
+    def __init__(self, lease_api, namespace, identity, group="k8s-log-agent", lease_duration_seconds=30, renew_interval_seconds=10, vnodes=64, clock=None):
+        self.api = lease_api
+        self.namespace = namespace
+        self.identity = identity
+        self.group = group
+        self.lease_name = f"{group}-{identity}"
+        self.lease_duration_seconds = int(lease_duration_seconds)
+        self.renew_interval_seconds = renew_interval_seconds
+        self.vnodes = vnodes
+        self.clock = clock or (lambda: datetime.now(timezone.utc))
+        self.ring = HashRing((), vnodes)
+        self._renewed_at = None
+        self._handlers = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {"renewals": 0, "renew_errors": 0, "rebalances": 0, "expired_leases_deleted": 0}
+
+    def add_change_handler(self, handler):
+        self._handlers.append(handler)
+
+    @property
+    def active(self):
+        """Lease của replica này còn hạn (lần gia hạn thành công gần nhất chưa quá lease_duration_seconds)."""
+        renewed_at = self._renewed_at
+        return renewed_at is not None and self.clock() - renewed_at < timedelta(seconds=self.lease_duration_seconds)
+
+    @property
+    def members(self):
+        return self.ring.members
+
+    def owns(self, key):
+        return self.active and self.ring.owner(key) == self.identity
+
+    def _new_lease(self, now):
+        metadata = client.V1ObjectMeta(name=self.lease_name, namespace=self.namespace, labels={GROUP_LABEL: self.group})
+        spec = client.V1LeaseSpec(holder_identity=self.identity, lease_duration_seconds=self.lease_duration_seconds, acquire_time=now, renew_time=now)
+        return client.V1Lease(metadata=metadata, spec=spec)
+
+    def renew(self):
+        now = self.clock()
+        try: lease = self.api.read_namespaced_lease(self.lease_name, self.namespace)
+        except ApiException as e:
+            if e.status != 404: raise
+            self.api.create_namespaced_lease(self.namespace, self._new_lease(now))
+            logging.info(f"Created shard lease {self.namespace}/{self.lease_name}.")
+        else:
+            if lease.spec is None or lease.spec.holder_identity != self.identity: lease.spec = self._new_lease(now).spec
+            lease.spec.renew_time = now; lease.spec.lease_duration_seconds = self.lease_duration_seconds
+            self.api.replace_namespaced_lease(self.lease_name, self.namespace, lease)
+        self._renewed_at = now
+
+    def live_members(self):
+        """Các holder có Lease còn hạn; Lease đã hết hạn lâu (10 x thời hạn) của replica đã chết được dọn đi."""
+        now = self.clock(); members = set()
+        for lease in self.api.list_namespaced_lease(self.namespace, label_selector=f"{GROUP_LABEL}={self.group}").items:
+            spec = lease.spec
+            if spec is None or not spec.holder_identity or spec.renew_time is None: continue
+            expires_at = spec.renew_time + timedelta(seconds=spec.lease_duration_seconds or self.lease_duration_seconds)
+            if expires_at > now: members.add(spec.holder_identity)
+            elif now - expires_at > timedelta(seconds=10 * self.lease_duration_seconds):
+                try: self.api.delete_namespaced_lease(lease.metadata.name, self.namespace); self.stats["expired_leases_deleted"] += 1
+                except ApiException as e: logging.debug(f"Could not delete expired shard lease {lease.metadata.name}: {e.status} {e.reason}")
+        return members
+
+    def refresh(self):
+        """Gia hạn Lease rồi tính lại vòng hash theo các thành viên còn sống; trả về True nếu phân chia thay đổi."""
+        try:
+            self.renew(); members = self.live_members() | {self.identity}; self.stats["renewals"] += 1
+        except Exception as e:
+            self.stats["renew_errors"] += 1
+            logging.warning(f"Could not renew shard lease {self.namespace}/{self.lease_name}: {f'{e.status} {e.reason}' if isinstance(e, ApiException) else e}")
+            # Chưa hết hạn thì giữ nguyên phân chia cũ; hết hạn thì các replica khác đã nhận shard của mình
+            if self.active: return False
+            members = set()
+        return self._set_members(members)
+
+    def _set_members(self, members):
+        with self._lock:
+            old_members = self.ring.members
+            if tuple(sorted(members)) == old_members: return False
+            self.ring = HashRing(members, self.vnodes); self.stats["rebalances"] += 1
+        logging.info(f"Shard membership changed: {list(old_members)} -> {list(self.ring.members)} (this replica: {self.identity}).")
+        for handler in self._handlers:
+            try: handler(old_members, self.ring.members)
+            except Exception as e: logging.error(f"Shard change handler failed: {e}", exc_info=True)
+        return True
+
+    def start(self):
+        self.refresh()
+        self._thread = threading.Thread(target=self._run, name="shard-lease", daemon=True); self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.renew_interval_seconds): self.refresh()
+
+    def stop(self, release=True):
+        """Dừng gia hạn; `release` xóa Lease để các replica khác nhận shard ngay thay vì chờ hết hạn."""
+        self._stop.set()
+        if self._thread is not None: self._thread.join(timeout=5); self._thread = None
+        if release:
+            try: self.api.delete_namespaced_lease(self.lease_name, self.namespace); logging.info(f"Released shard lease {self.namespace}/{self.lease_name}.")
+            except ApiException as e:
+                if e.status != 404: logging.warning(f"Could not release shard lease {self.lease_name}: {e.status} {e.reason}")
+            except Exception as e: logging.warning(f"Could not release shard lease {self.lease_name}: {e}")
+        self._renewed_at = None; self._set_members(set())
+
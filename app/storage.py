@@ -0,0 +1,213 @@
+"""Lớp lưu trữ SQLite dùng chung cho agent (ghi) và portal (chỉ đọc).
+
+Agent giữ một kết nối ghi lâu dài; mọi thao tác ghi đi qua hàng đợi và được một luồng writer
+duy nhất gom lại, commit theo nhóm. DB chạy ở chế độ WAL nên portal đọc song song mà không
+chặn writer. Module này được copy vào image portal (xem Dockerfile.portal).
+"""
+import os
+import time
+import zlib
+import queue
+import sqlite3
+import logging
+import threading
+from concurrent.futures import Future
+
+# synchronous=NORMAL là đủ an toàn với WAL (chỉ có thể mất các commit cuối khi mất điện, không hỏng DB)
+WRITER_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA wal_autocheckpoint=1000",
+)
+READER_PRAGMAS = (
+    "PRAGMA cache_size=-8000",
+    "PRAGMA temp_store=MEMORY",
+)
+BUSY_TIMEOUT_SECONDS = 10
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+def compress_text(text, min_bytes=512):
+    """Văn bản dài được lưu dạng BLOB nén zlib, văn bản ngắn giữ nguyên TEXT (SQLite cho phép cả hai trong một cột)."""
+    if text is None: return None
+    data = text.encode("utf-8")
+    if len(data) < min_bytes: return text
+    return zlib.compress(data, 6)
+
+
+def decompress_text(value):
+    if isinstance(value, bytes): return zlib.decompress(value).decode("utf-8")
+    return value
+
+
+def connect(db_path, readonly=False, timeout=BUSY_TIMEOUT_SECONDS):
+    """Mở kết nối đã cấu hình; readonly dùng URI mode=ro nên không thể ghi nhầm vào DB."""
+    if readonly: conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=timeout, check_same_thread=False)
+    else: conn = sqlite3.connect(db_path, timeout=timeout, isolation_level=None, check_same_thread=False)
+    for pragma in READER_PRAGMAS if readonly else WRITER_PRAGMAS: conn.execute(pragma)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+class ReadOnlyConnections:
+    """Mỗi luồng (ví dụ mỗi worker Flask) giữ một kết nối chỉ đọc riêng, mở lại khi bị lỗi."""
+
+    def __init__(self, db_path, timeout=5):
+        self.db_path = db_path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def get(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if not os.path.exists(self.db_path): return None
+            conn = self._local.conn = connect(self.db_path, readonly=True, timeout=self.timeout)
+        return conn
+
+    def reset(self):
+        conn = getattr(self._local, "conn", None); self._local.conn = None
+        if conn is not None:
+            try: conn.close()
+            except sqlite3.Error: pass
+
+
+class StorageClosedError(RuntimeError):
+    """Thao tác ghi gửi tới Storage đã close()."""
+
+
+class _WriteOp:
+    __slots__ = ("func", "future", "transaction")
+
+    def __init__(self, func, future, transaction=True):
+        self.func = func; self.future = future; self.transaction = transaction
+
+
+class Storage:
+    """Kết nối ghi lâu dài + luồng writer gom các thao tác ghi và commit theo nhóm.
+
+    Mỗi thao tác là một hàm nhận cursor; các thao tác trong cùng nhóm chạy trong một transaction,
+    mỗi thao tác bọc trong SAVEPOINT riêng để lỗi của một thao tác không làm mất các thao tác khác.
+    """
+
+    def __init__(self, db_path, max_batch_size=200, max_queue_size=10000, on_commit=None):
+        self.db_path = db_path
+        self.max_batch_size = max_batch_size
+        # on_commit(seconds, op_count) được gọi sau mỗi lần commit nhóm (ví dụ để đo độ trễ ghi)
+        self.on_commit = on_commit
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._conn = None
+        self._thread = None
+        # Khóa giữa write() và close(): thao tác đã vào hàng đợi trước lệnh dừng luôn được writer xử lý
+        self._lock = threading.Lock()
+        self._closed = False
+        self.stats = {"writes": 0, "commits": 0, "errors": 0}
+
+    def open(self, migrations=()):
+        """Mở kết nối ghi, bật auto_vacuum=INCREMENTAL, chạy các migration còn thiếu rồi khởi động writer."""
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir and not os.path.exists(db_dir): os.makedirs(db_dir); logging.info(f"Created directory for database: {db_dir}")
+        self._conn = connect(self.db_path)
+        if self._conn.execute("PRAGMA auto_vacuum").fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+            # Chỉ có hiệu lực sau VACUUM; DB cũ được VACUUM đầy đủ một lần duy nhất
+            logging.info("Enabling incremental auto-vacuum (one-time VACUUM)...")
+            self._conn.execute("PRAGMA auto_vacuum=INCREMENTAL"); self._conn.execute("VACUUM")
+        apply_migrations(self._conn, migrations)
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True); self._thread.start()
+        return self
+
+    def write(self, func, transaction=True):
+        """Đưa thao tác ghi vào hàng đợi, không chờ; trả về Future (kết quả của func) nếu cần theo dõi.
+
+        transaction=False chạy func riêng, ngoài transaction (cần cho VACUUM / incremental_vacuum).
+        Sau close() không còn writer: Future trả về đã mang lỗi StorageClosedError thay vì chờ mãi.
+        """
+        future = Future()
+        with self._lock:
+            if self._closed: future.set_exception(StorageClosedError(f"database writer for {self.db_path} is closed")); return future
+            self._queue.put(_WriteOp(func, future, transaction))
+        return future
+
+    def run(self, func, timeout=None, transaction=True):
+        """Thực thi func(cursor) trên luồng writer và chờ kết quả (ném lại lỗi nếu có)."""
+        return self.write(func, transaction).result(timeout)
+
+    def pending(self):
+        """Số thao tác ghi đang chờ trong hàng đợi."""
+        return self._queue.qsize()
+
+    def flush(self, timeout=None):
+        """Chờ tới khi mọi thao tác đã xếp hàng trước đó được commit."""
+        self.run(lambda cursor: None, timeout)
+
+    def close(self, timeout=30):
+        with self._lock:
+            if self._closed: return
+            self._closed = True
+            if self._thread is None: return
+            stop = Future(); self._queue.put(_WriteOp(None, stop))
+        try: stop.result(timeout)
+        except Exception as e: logging.error(f"Error stopping database writer: {e}")
+        self._thread = None
+
+    def _run(self):
+        while True:
+            ops = [self._queue.get()]
+            while len(ops) < self.max_batch_size and ops[-1].func is not None:
+                try: ops.append(self._queue.get_nowait())
+                except queue.Empty: break
+            group = []
+            for op in ops:
+                if op.func is not None and op.transaction: group.append(op); continue
+                if group: self._commit_group(group); group = []
+                if op.func is None:
+                    self._conn.close(); self._conn = None; op.future.set_result(None); return
+                self._execute_standalone(op)
+            if group: self._commit_group(group)
+
+    def _execute_standalone(self, op):
+        try: result = op.func(self._conn.cursor())
+        except Exception as e: logging.error(f"Database error in standalone write: {e}"); self.stats["errors"] += 1; op.future.set_exception(e); return
+        self.stats["writes"] += 1; op.future.set_result(result)
+
+    def _commit_group(self, ops):
+        cursor = self._conn.cursor(); results = []; start = time.perf_counter()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            for op in ops:
+                cursor.execute("SAVEPOINT op")
+                try: results.append((op, op.func(cursor), None)); cursor.execute("RELEASE op")
+                except Exception as e:
+                    logging.error(f"Database error in queued write: {e}")
+                    cursor.execute("ROLLBACK TO op"); cursor.execute("RELEASE op"); results.append((op, None, e))
+            cursor.execute("COMMIT")
+        except sqlite3.Error as e:
+            logging.error(f"Database error committing {len(ops)} queued writes: {e}")
+            if self._conn.in_transaction: self._conn.rollback()
+            self.stats["errors"] += len(ops)
+            for op in ops: op.future.set_exception(e)
+            return
+        self.stats["writes"] += len(ops); self.stats["commits"] += 1; elapsed = time.perf_counter() - start
+        for op, result, error in results:
+            if error is None: op.future.set_result(result)
+            else: self.stats["errors"] += 1; op.future.set_exception(error)
+        # Hook lỗi không được làm chết luồng writer (mọi thao tác ghi sau đó sẽ treo)
+        if self.on_commit is not None:
+            try: self.on_commit(elapsed, len(ops))
+            except Exception as e: logging.error(f"Error in database on_commit hook: {e}")
+
+
+def apply_migrations(conn, migrations):
+    """Chạy các migration còn thiếu theo PRAGMA user_version; mỗi migration là func(cursor) trong một transaction."""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, migration in enumerate(migrations, start=1):
+        if number <= version: continue
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN IMMEDIATE"); migration(cursor)
+            cursor.execute(f"PRAGMA user_version={number}"); cursor.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction: conn.rollback()
+            raise
+        logging.info(f"Applied database migration {number}: {migration.__name__}")
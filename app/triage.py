@@ -0,0 +1,160 @@
+"""Phân loại nhanh, tất định các lỗi quen thuộc bằng luật khai báo, không cần gọi Gemini.
+
+Luật được nạp từ file YAML/JSON (xem triage_rules.yaml) và đánh giá theo thứ tự, luật khớp đầu tiên thắng:
+
+    rules:
+      - name: oom-killed
+        severity: ERROR
+        confidence: 0.95
+        match:
+          container_reason: OOMKilled
+        summary: "Container '{container}' của pod {pod_key} bị OOMKilled ..."
+
+Điều kiện trong `match` là regex (không phân biệt hoa thường; có thể là danh sách, khớp một là đủ), riêng `exit_code`
+là số hoặc danh sách số và `min_restarts` là số. Mọi điều kiện phải thỏa; các điều kiện theo container (container_reason,
+exit_code, min_restarts) phải thỏa trên cùng một container; lý do và exit code của lần chạy trước (last_reason) chỉ được
+xét khi container hiện đang waiting hoặc terminated. Summary là chuỗi format với các giá trị đã khớp
+({pod_key}, {container}, {reason}, {exit_code}, {event_message}...); khóa không có giá trị được thay bằng "?".
+Luật có confidence thấp hơn ngưỡng của engine không được dùng: pod đó vẫn được gửi cho Gemini.
+"""
+import os
+import re
+import json
+import threading
+
+try:
+    import yaml
+except ImportError:  # PyYAML có trong requirements.txt; không có thì chỉ đọc được luật dạng JSON
+    yaml = None
+
+SEVERITIES = ("INFO", "WARNING", "ERROR", "CRITICAL")
+CONTAINER_KEYS = ("container_reason", "exit_code", "min_restarts")
+POD_KEYS = ("phase", "detection_reason", "pod_condition", "node_condition", "event_reason", "event_message", "log")
+DEFAULT_RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "triage_rules.yaml")
+
+
+class _Defaults(dict):
+    def __missing__(self, key):
+        return "?"
+
+
+def _patterns(rule_name, key, value):
+    values = value if isinstance(value, list) else [value]
+    try: return [re.compile(str(item), re.IGNORECASE) for item in values]
+    except re.error as e: raise ValueError(f"Triage rule '{rule_name}': invalid regex for '{key}': {e}")
+
+
+class TriageRule:
+    __slots__ = ("name", "severity", "confidence", "summary", "patterns", "exit_codes", "min_restarts")
+
+    def __init__(self, spec):
+        self.name = spec.get("name") or "unnamed"
+        self.severity = str(spec.get("severity", "")).upper()
+        if self.severity not in SEVERITIES: raise ValueError(f"Triage rule '{self.name}': severity must be one of {SEVERITIES}")
+        self.confidence = float(spec.get("confidence", 1.0))
+        self.summary = spec.get("summary") or ""
+        match = spec.get("match") or {}
+        unknown = set(match) - set(CONTAINER_KEYS) - set(POD_KEYS)
+        if unknown: raise ValueError(f"Triage rule '{self.name}': unknown match keys {sorted(unknown)}")
+        if not match: raise ValueError(f"Triage rule '{self.name}': empty match")
+        self.patterns = {key: _patterns(self.name, key, value) for key, value in match.items() if key not in ("exit_code", "min_restarts")}
+        exit_codes = match.get("exit_code")
+        self.exit_codes = None if exit_codes is None else {int(code) for code in (exit_codes if isinstance(exit_codes, list) else [exit_codes])}
+        self.min_restarts = match.get("min_restarts")
+
+    def _search(self, key, values):
+        for value in values:
+            if value is None: continue
+            for pattern in self.patterns[key]:
+                if pattern.search(str(value)): return str(value)
+        return None
+
+    def _match_container(self, name, container):
+        """Giá trị đã khớp của container (dict) hoặc None nếu container không thỏa các điều kiện theo container."""
+        # Lý do / exit code của lần chạy trước chỉ còn đúng khi container chưa chạy lại được (đang waiting hoặc terminated);
+        # container đang chạy thì lần OOMKilled cách đây vài giờ không phải nguyên nhân của sự cố hiện tại
+        reasons = (container.get("waiting_reason"), container.get("terminated_reason"))
+        if any(reasons): reasons += (container.get("last_reason"),)
+        exit_code = container.get("exit_code") if any(reasons) else None
+        bound = {"container": name, "restarts": container.get("restart_count", 0), "exit_code": exit_code}
+        if "container_reason" in self.patterns:
+            reason = self._search("container_reason", reasons)
+            if reason is None: return None
+            bound["reason"] = reason
+        else: bound["reason"] = next((reason for reason in reasons if reason), None)
+        if self.exit_codes is not None and exit_code not in self.exit_codes: return None
+        if self.min_restarts is not None and (container.get("restart_count") or 0) < int(self.min_restarts): return None
+        return bound
+
+    def match(self, facts):
+        """Giá trị để điền vào summary nếu luật khớp với `facts` (xem build_facts), ngược lại None."""
+        bound = {}
+        for key in POD_KEYS:
+            if key not in self.patterns: continue
+            value = self._search(key, facts[key])
+            if value is None: return None
+            bound[key] = value
+        if any(key in self.patterns for key in CONTAINER_KEYS) or self.exit_codes is not None or self.min_restarts is not None:
+            container_bound = next((b for b in (self._match_container(name, c) for name, c in facts["containers"].items()) if b is not None), None)
+            if container_bound is None: return None
+            bound.update(container_bound)
+        return bound
+
+
+def build_facts(pod_key, pod_info=None, node_info=None, pod_events=(), reasons=(), log_templates=None, log_batch=None):
+    """Gom ngữ cảnh đã thu thập của một pod thành các danh sách chuỗi để luật so khớp."""
+    pod_info = pod_info or {}; node_info = node_info or {}
+    if log_templates: logs = [template.template for template in log_templates]
+    else: logs = log_batch.messages() if log_batch else []
+    return {"pod_key": pod_key, "containers": pod_info.get("container_statuses") or {},
+            "phase": [pod_info.get("status")],
+            "detection_reason": list(reasons),
+            "pod_condition": [f"{ctype}={cond.get('status')} {cond.get('reason') or ''}: {cond.get('message') or ''}" for ctype, cond in (pod_info.get("conditions") or {}).items()],
+            "node_condition": [f"{ctype}={cond.get('status')}" for ctype, cond in (node_info.get("conditions") or {}).items()],
+            "event_reason": [event.get("reason") for event in pod_events],
+            "event_message": [f"{event.get('reason')}: {event.get('message')}" for event in pod_events],
+            "log": logs,
+            "node": node_info.get("name") or pod_info.get("node_name")}
+
+
+class TriageEngine:
+    """Đánh giá các luật theo thứ tự; trả về kết quả phân tích giống Gemini ({"severity", "summary", ...}) hoặc None."""
+
+    def __init__(self, rules, min_confidence=0.8):
+        self.rules = list(rules)
+        self.min_confidence = min_confidence
+        self._lock = threading.Lock()
+        self.stats = {"evaluations": 0, "hits": 0, "low_confidence": 0, "misses": 0}
+        self.rule_hits = {rule.name: 0 for rule in self.rules}
+
+    @classmethod
+    def from_file(cls, path, min_confidence=0.8):
+        with open(path, encoding="utf-8") as f: text = f.read()
+        if path.endswith(".json"):
+            try: data = json.loads(text)
+            except json.JSONDecodeError as e: raise ValueError(f"invalid JSON: {e}")
+        elif yaml is None: raise ValueError(f"PyYAML is not installed; cannot read YAML rules file {path} (install PyYAML or use a .json rules file)")
+        else:
+            try: data = yaml.safe_load(text)
+            except yaml.YAMLError as e: raise ValueError(f"invalid YAML: {e}")
+        specs = data.get("rules", []) if isinstance(data, dict) else data
+        return cls([TriageRule(spec) for spec in specs or []], min_confidence)
+
+    def _count(self, key, rule=None):
+        with self._lock:
+            self.stats["evaluations"] += 1; self.stats[key] += 1
+            if rule is not None: self.rule_hits[rule.name] += 1
+
+    def evaluate(self, facts):
+        for rule in self.rules:
+            bound = rule.match(facts)
+            if bound is None: continue
+            if rule.confidence < self.min_confidence:
+                self._count("low_confidence", rule); return None
+            namespace, _, pod = facts["pod_key"].partition('/')
+            values = _Defaults(pod_key=facts["pod_key"], namespace=namespace, pod=pod, node=facts.get("node") or "?", phase=facts["phase"][0] or "?")
+            values.update({key: value for key, value in bound.items() if value is not None})
+            self._count("hits", rule)
+            return {"severity": rule.severity, "summary": rule.summary.format_map(values), "rule": rule.name, "confidence": rule.confidence}
+        self._count("misses")
+        return None
@@ -0,0 +1,81 @@
+import time
+import logging
+import threading
+from collections import Counter
+from kubernetes.client.exceptions import ApiException
+
+from logbatch import LogBatch
+
+# Các loại owner mà pod có thể trực tiếp thuộc về và được coi là một workload
+WORKLOAD_KINDS = ("ReplicaSet", "StatefulSet", "DaemonSet", "Job")
+
+
+def _controller_ref(metadata):
+    refs = metadata.owner_references or []
+    return next((ref for ref in refs if ref.controller), refs[0] if refs else None)
+
+
+class WorkloadResolver:
+    """Xác định workload sở hữu một pod qua ownerReferences (ReplicaSet được quy về Deployment)."""
+
+    def __init__(self, apps_v1, fetch_pod, call=None, cache_ttl_seconds=600):
+        self.apps_v1 = apps_v1
+        self.fetch_pod = fetch_pod
+        self.call = call or (lambda func, **kwargs: func(**kwargs))
+        self.cache_ttl_seconds = cache_ttl_seconds
+        self._replicaset_owners = {}
+        self._lock = threading.Lock()
+
+    def _replicaset_owner(self, namespace, name):
+        key = (namespace, name); now = time.monotonic()
+        with self._lock:
+            cached = self._replicaset_owners.get(key)
+            if cached and now - cached[1] < self.cache_ttl_seconds: return cached[0]
+        owner = ("ReplicaSet", name)
+        try:
+            replica_set = self.call(self.apps_v1.read_namespaced_replica_set, name=name, namespace=namespace)
+            ref = _controller_ref(replica_set.metadata)
+            if ref and ref.kind == "Deployment": owner = ("Deployment", ref.name)
+        except ApiException as e: logging.warning(f"Could not read ReplicaSet {namespace}/{name}: {e.status} {e.reason}")
+        with self._lock: self._replicaset_owners[key] = (owner, now)
+        return owner
+
+    def resolve(self, namespace, pod_name):
+        """Trả về (kind, name) của workload; pod không có owner được coi là workload riêng ("Pod", tên pod)."""
+        pod = self.fetch_pod(namespace, pod_name)
+        ref = _controller_ref(pod.metadata) if pod is not None else None
+        if ref is None or ref.kind not in WORKLOAD_KINDS: return ("Pod", pod_name)
+        if ref.kind == "ReplicaSet": return self._replicaset_owner(namespace, ref.name)
+        return (ref.kind, ref.name)
+
+
+def group_by_workload(pods_to_investigate, resolver):
+    """Gom các pod cần điều tra theo workload: {workload_key: {"reason", "logs", "pods", "representative", "workload"}}."""
+    groups = {}
+    for pod_key, data in pods_to_investigate.items():
+        namespace, pod_name = pod_key.split('/', 1)
+        try: kind, name = resolver.resolve(namespace, pod_name)
+        except Exception as e: logging.warning(f"Could not resolve workload for {pod_key}: {e}"); kind, name = "Pod", pod_name
+        workload_key = pod_key if kind == "Pod" else f"{namespace}/{kind}/{name}"
+        group = groups.setdefault(workload_key, {"workload": workload_key, "kind": kind, "pods": {}})
+        group["pods"][pod_key] = data
+    for group in groups.values():
+        pods = group.pop("pods")
+        # Pod đại diện: có nhiều log đáng ngờ nhất, rồi nhiều lý do nhất
+        representative = max(sorted(pods), key=lambda key: (len(pods[key]["logs"]), len(pods[key]["reason"])))
+        reason_counts = Counter(reason for data in pods.values() for reason in data["reason"])
+        group["representative"] = representative
+        group["pods"] = sorted(pods)
+        group["reason"] = [f"{reason} (x{count} pod)" if count > 1 else reason for reason, count in reason_counts.most_common()]
+        group["logs"] = LogBatch.merge([data["logs"] for data in pods.values()])
+    return groups
+
+
+def format_workload_context(group, max_pods=20):
+    """Ngữ cảnh tổng hợp cho workload có nhiều pod gặp sự cố cùng lúc."""
+    if len(group["pods"]) <= 1: return ""
+    pods = group["pods"]
+    context_str = f"Workload: {group['workload']} ({group['kind']}) - {len(pods)} pod đang gặp sự cố, pod đại diện: {group['representative']}\n"
+    context_str += f"  Các pod bị ảnh hưởng: {', '.join(p.split('/', 1)[1] for p in pods[:max_pods])}"
+    if len(pods) > max_pods: context_str += f" ... (+{len(pods) - max_pods})"
+    return context_str + "\n"
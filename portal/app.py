@@ -1,8 +1,18 @@
 import os
+import sys
+import json
+import zlib
+import time
+import queue
 import sqlite3
+import threading
 import logging
-from flask import Flask, jsonify, render_template, request
+from flask import Flask, Response, jsonify, render_template, request
 from datetime import datetime, timedelta, timezone
+# storage.py dùng chung với agent: được copy vào image portal, khi chạy từ source thì lấy trong ../app
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "app"))
+import storage
+from stream import ChangeFeed, format_sse
 
 # --- Cấu hình Logging ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -20,25 +30,27 @@ try:
 except Exception as e:
     logging.warning(f"Could not load timezone '{os.environ.get('TZ', 'UTC')}': {e}. Defaulting display to UTC.")
     DISPLAY_TZ = timezone.utc
+# Server-Sent Events: chu kỳ dò thay đổi, số kết nối tối đa, chu kỳ gửi keep-alive
+STREAM_POLL_INTERVAL_SECONDS = float(os.environ.get("STREAM_POLL_INTERVAL_SECONDS", 2))
+STREAM_MAX_SUBSCRIBERS = int(os.environ.get("STREAM_MAX_SUBSCRIBERS", 100))
+STREAM_HEARTBEAT_SECONDS = float(os.environ.get("STREAM_HEARTBEAT_SECONDS", 15))
+# Thời gian cache phản hồi /api/timeseries trong bộ nhớ
+TIMESERIES_CACHE_TTL_SECONDS = float(os.environ.get("TIMESERIES_CACHE_TTL_SECONDS", 15))
+# Kết nối chỉ đọc, giữ lâu dài cho mỗi luồng phục vụ request
+read_connections = storage.ReadOnlyConnections(DB_PATH)
 
 
 def get_db_connection():
-    """Tạo kết nối đến SQLite database."""
-    # Kiểm tra file DB tồn tại không
-    if not os.path.exists(DB_PATH):
-        logging.error(f"Database file not found at {DB_PATH}. Agent might not have run yet or PV is not mounted correctly.")
-        return None # Trả về None nếu file không tồn tại
-
+    """Lấy kết nối chỉ đọc (mode=ro) của luồng hiện tại tới SQLite database."""
     try:
-        # Kết nối ở chế độ chỉ đọc nếu có thể (an toàn hơn)
-        # conn = sqlite3.connect(f'file:{DB_PATH}?mode=ro', uri=True, timeout=5)
-        # Tuy nhiên, chế độ 'ro' có thể không hoạt động với mọi phiên bản/cài đặt SQLite
-        # Dùng chế độ mặc định (rw) cho đơn giản trước
-        conn = sqlite3.connect(DB_PATH, timeout=5)
-        conn.row_factory = sqlite3.Row # Trả về kết quả dạng dictionary-like
+        conn = read_connections.get()
+        if conn is None:
+            # File DB chưa tồn tại
+            logging.error(f"Database file not found at {DB_PATH}. Agent might not have run yet or PV is not mounted correctly.")
         return conn
     except sqlite3.Error as e:
         logging.error(f"Database connection error: {e}")
+        read_connections.reset()
         return None
 
 @app.route('/')
@@ -47,49 +59,142 @@ def index():
     # Truyền tên file DB vào template để hiển thị (cho mục đích debug)
     return render_template('index.html', db_path=DB_PATH)
 
+# --- Tham số lọc / phân trang cho /api/incidents ---
+MAX_PAGE_SIZE = 500
+SEVERITIES = ("INFO", "WARNING", "ERROR", "CRITICAL")
+
+
+def parse_time_param(value):
+    """Nhận epoch (giây) hoặc chuỗi ISO 8601; chuỗi không có múi giờ được coi là UTC."""
+    if value is None or value == '': return None
+    if value.lstrip('-').isdigit(): return int(value)
+    ts = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if ts.tzinfo is None: ts = ts.replace(tzinfo=timezone.utc)
+    return int(ts.timestamp())
+
+
+def prefix_range(prefix):
+    """Khoảng [prefix, upper) để so khớp tiền tố bằng index thay vì LIKE."""
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def build_incident_filters(args):
+    """Dựng mệnh đề WHERE từ query string; ném ValueError nếu tham số không hợp lệ."""
+    clauses = []; params = []
+    prefixes = []
+    if args.get('namespace'): prefixes.append(args['namespace'].rstrip('/') + '/')
+    if args.get('pod'): prefixes.append(args['pod'])
+    for prefix in prefixes:
+        low, high = prefix_range(prefix); clauses.append('pod_key >= ? AND pod_key < ?'); params += [low, high]
+    if args.get('severity'):
+        severities = [sev.strip().upper() for sev in args['severity'].split(',') if sev.strip()]
+        unknown = [sev for sev in severities if sev not in SEVERITIES]
+        if unknown: raise ValueError(f"Unknown severity: {', '.join(unknown)}")
+        clauses.append(f"severity IN ({', '.join('?' * len(severities))})"); params += severities
+    start = parse_time_param(args.get('start')); end = parse_time_param(args.get('end'))
+    if start is not None: clauses.append('ts_epoch >= ?'); params.append(start)
+    if end is not None: clauses.append('ts_epoch < ?'); params.append(end)
+    return clauses, params
+
+
+def encode_cursor(row):
+    return f"{row['ts_epoch']}:{row['id']}"
+
+
+def decode_cursor(cursor):
+    ts_epoch, incident_id = cursor.split(':', 1)
+    return int(ts_epoch), int(incident_id)
+
+
+def incidents_etag(conn, args):
+    # Danh sách chỉ thay đổi khi có incident mới (max id) hoặc retention xóa incident cũ (min id)
+    max_id, min_id = conn.execute('SELECT MAX(id), MIN(id) FROM incidents').fetchone()
+    query = "&".join(f"{key}={value}" for key, value in sorted(args.items(multi=True)))
+    return f'{max_id or 0}-{min_id or 0}-{zlib.crc32(query.encode("utf-8")):08x}'
+
+
 @app.route('/api/incidents')
 def get_incidents():
-    """API endpoint để lấy danh sách các sự cố gần đây."""
-    limit = request.args.get('limit', 100, type=int) # Lấy tối đa 100 sự cố mặc định
-    offset = request.args.get('offset', 0, type=int)
+    """API endpoint để lấy danh sách sự cố (keyset pagination, lọc theo namespace/pod/severity/thời gian).
+
+    - `cursor`: lấy trang tiếp theo (giá trị `next_cursor` của trang trước)
+    - `since_id`: chỉ trả về các sự cố mới hơn id này (dùng khi polling)
+    Hỗ trợ ETag / If-None-Match: trả về 304 khi dữ liệu chưa thay đổi.
+    """
+    limit = max(1, min(request.args.get('limit', 100, type=int), MAX_PAGE_SIZE))
+    try:
+        clauses, params = build_incident_filters(request.args)
+        if request.args.get('cursor'):
+            ts_epoch, incident_id = decode_cursor(request.args['cursor'])
+            clauses.append('(ts_epoch < ? OR (ts_epoch = ? AND id < ?))'); params += [ts_epoch, ts_epoch, incident_id]
+        if request.args.get('since_id'): clauses.append('id > ?'); params.append(int(request.args['since_id']))
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query parameter: {e}"}), 400
 
     conn = get_db_connection()
     if conn is None:
         return jsonify({"error": "Database connection failed or file not found."}), 500
 
-    incidents = []
     try:
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT id, timestamp, pod_key, severity, summary, initial_reasons
-            FROM incidents
-            ORDER BY timestamp DESC
-            LIMIT ? OFFSET ?
-        ''', (limit, offset))
-        rows = cursor.fetchall()
-        conn.close()
-
-        for row in rows:
-            # Chuyển đổi timestamp UTC sang múi giờ hiển thị
-            ts_utc = datetime.fromisoformat(row['timestamp'].replace('Z', '+00:00'))
-            ts_display = ts_utc.astimezone(DISPLAY_TZ)
-            incidents.append({
-                "id": row['id'],
-                # Định dạng lại thời gian cho dễ đọc
-                "timestamp": ts_display.strftime('%Y-%m-%d %H:%M:%S %Z'),
-                "pod_key": row['pod_key'],
-                "severity": row['severity'],
-                "summary": row['summary'],
-                "initial_reasons": row['initial_reasons']
-            })
-        return jsonify(incidents)
+        etag = incidents_etag(conn, request.args)
+        if request.if_none_match.contains_weak(etag):
+            response = app.response_class(status=304); response.set_etag(etag, weak=True); response.headers['Cache-Control'] = 'no-cache'
+            return response
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = conn.execute(f'''
+            SELECT id, timestamp, ts_epoch, pod_key, severity, summary, initial_reasons, workload
+            FROM incidents {where}
+            ORDER BY ts_epoch DESC, id DESC
+            LIMIT ?
+        ''', (*params, limit + 1)).fetchall()
+        # Chỉ trả về các cột nhẹ; ngữ cảnh K8s và log mẫu nằm ở /api/incidents/<id>
+        incidents = [dict(row) for row in rows[:limit]]
+        next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+        latest_id = conn.execute('SELECT MAX(id) FROM incidents').fetchone()[0] or 0
+        response = jsonify({"incidents": incidents, "next_cursor": next_cursor, "latest_id": latest_id})
+        response.set_etag(etag, weak=True); response.headers['Cache-Control'] = 'no-cache'
+        return response
     except sqlite3.Error as e:
         logging.error(f"Database error fetching incidents: {e}")
-        if conn: conn.close()
+        read_connections.reset()
         return jsonify({"error": "Failed to fetch incidents from database."}), 500
     except Exception as e:
             logging.error(f"Unexpected error fetching incidents: {e}", exc_info=True)
-            if conn: conn.close()
+            read_connections.reset()
+            return jsonify({"error": "An unexpected error occurred."}), 500
+
+
+@app.route('/api/incidents/<int:incident_id>')
+def get_incident_detail(incident_id):
+    """API endpoint trả về toàn bộ một sự cố, kèm ngữ cảnh K8s, log mẫu và template log (đã giải nén)."""
+    conn = get_db_connection()
+    if conn is None:
+        return jsonify({"error": "Database connection failed or file not found."}), 500
+
+    try:
+        row = conn.execute('''
+            SELECT i.id, i.timestamp, i.ts_epoch, i.pod_key, i.severity, i.summary, i.initial_reasons, i.workload,
+                   d.k8s_context, d.sample_logs, d.log_templates
+            FROM incidents i LEFT JOIN incident_details d ON d.incident_id = i.id
+            WHERE i.id = ?
+        ''', (incident_id,)).fetchone()
+        if row is None: return jsonify({"error": f"Incident {incident_id} not found."}), 404
+        incident = dict(row)
+        for column in ('k8s_context', 'sample_logs', 'log_templates'): incident[column] = storage.decompress_text(incident[column])
+        if incident['log_templates']: incident['log_templates'] = json.loads(incident['log_templates'])
+        if incident['ts_epoch'] is not None:
+            incident['timestamp_display'] = datetime.fromtimestamp(incident['ts_epoch'], DISPLAY_TZ).strftime('%Y-%m-%d %H:%M:%S %Z')
+        # Chi tiết của một sự cố không thay đổi sau khi ghi
+        response = jsonify(incident); response.headers['Cache-Control'] = 'private, max-age=3600'
+        return response
+    except sqlite3.Error as e:
+        logging.error(f"Database error fetching incident {incident_id}: {e}")
+        read_connections.reset()
+        return jsonify({"error": "Failed to fetch incident from database."}), 500
+    except Exception as e:
+            # Ví dụ BLOB chi tiết bị hỏng (zlib.error) hoặc log_templates không phải JSON hợp lệ
+            logging.error(f"Unexpected error fetching incident {incident_id}: {e}", exc_info=True)
+            read_connections.reset()
             return jsonify({"error": "An unexpected error occurred."}), 500
 
 
@@ -110,18 +215,19 @@ def get_stats():
         cursor = conn.cursor()
         # Lấy dữ liệu trong khoảng ngày mong muốn
         cursor.execute('''
-            SELECT date, gemini_calls, telegram_alerts, incident_count
+            SELECT date, gemini_calls, telegram_alerts, incident_count, triage_hits, triage_misses
             FROM daily_stats
             WHERE date >= ? AND date <= ?
             ORDER BY date DESC
         ''', (start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')))
         rows = cursor.fetchall()
-        conn.close()
 
         # Tính tổng và chuẩn bị dữ liệu trả về
         total_gemini_calls = 0
         total_telegram_alerts = 0
         total_incidents = 0
+        total_triage_hits = 0
+        total_triage_misses = 0
         daily_data = []
 
         for row in rows:
@@ -129,25 +235,237 @@ def get_stats():
             total_gemini_calls += row['gemini_calls']
             total_telegram_alerts += row['telegram_alerts']
             total_incidents += row['incident_count']
+            total_triage_hits += row['triage_hits'] or 0
+            total_triage_misses += row['triage_misses'] or 0
 
         stats = {
             "total_gemini_calls": total_gemini_calls,
             "total_telegram_alerts": total_telegram_alerts,
             "total_incidents": total_incidents,
+            "total_triage_hits": total_triage_hits,
+            "total_triage_misses": total_triage_misses,
+            # Tỉ lệ pod được luật triage xử lý mà không cần gọi Gemini
+            "triage_hit_rate": round(total_triage_hits / (total_triage_hits + total_triage_misses), 4) if total_triage_hits + total_triage_misses else None,
             "daily_stats": daily_data
         }
         return jsonify(stats)
 
     except sqlite3.Error as e:
         logging.error(f"Database error fetching stats: {e}")
-        if conn: conn.close()
+        read_connections.reset()
         return jsonify({"error": "Failed to fetch stats from database."}), 500
     except Exception as e:
             logging.error(f"Unexpected error fetching stats: {e}", exc_info=True)
-            if conn: conn.close()
+            read_connections.reset()
             return jsonify({"error": "An unexpected error occurred."}), 500
 
+# --- Chuỗi thời gian từ các bảng rollup theo giờ ---
+TIMESERIES_STEPS = {"hour": 3600, "day": 86400}
+TIMESERIES_GROUPS = ("namespace", "severity")
+TIMESERIES_MAX_BUCKETS = 24 * 92
+HOURLY_STAT_COLUMNS = ("gemini_calls", "gemini_latency_ms", "gemini_prompt_tokens", "gemini_output_tokens", "telegram_alerts", "analysis_cache_hits", "analysis_cache_misses", "triage_hits", "triage_misses")
+
+
+class TTLCache:
+    """Cache phản hồi nhỏ trong tiến trình, hết hạn sau ttl giây."""
+
+    def __init__(self, ttl_seconds, max_entries=256):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None or item[0] < time.monotonic(): return None
+            return item[1]
+
+    def put(self, key, value):
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                now = time.monotonic(); self._entries = {k: v for k, v in self._entries.items() if v[0] >= now}
+                if len(self._entries) >= self.max_entries: self._entries.pop(next(iter(self._entries)))
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+
+
+timeseries_cache = TTLCache(TIMESERIES_CACHE_TTL_SECONDS)
+
+
+def query_timeseries(conn, start, end, step, group_by, namespace=None, severity=None):
+    """Tổng hợp hourly_incidents / hourly_stats thành các bucket [start, end) bước `step` giây.
+
+    Chi phí chỉ phụ thuộc số bucket x số nhóm, không phụ thuộc số incident.
+    """
+    buckets = list(range(start, end, step)); index = {bucket: i for i, bucket in enumerate(buckets)}
+    clauses = ['hour >= ?', 'hour < ?']; params = [start, end]
+    if namespace: clauses.append('namespace = ?'); params.append(namespace)
+    if severity: clauses.append('severity = ?'); params.append(severity)
+    group_column = group_by if group_by in TIMESERIES_GROUPS else "'total'"
+    series = {}
+    for row in conn.execute(f'''
+            SELECT (hour - ?) / ? AS bucket, {group_column} AS grp, SUM(incident_count) AS incidents
+            FROM hourly_incidents WHERE {' AND '.join(clauses)}
+            GROUP BY bucket, grp ''', (start, step, *params)):
+        series.setdefault(row['grp'], [0] * len(buckets))[row['bucket']] = row['incidents']
+    agent = {column: [0] * len(buckets) for column in HOURLY_STAT_COLUMNS}
+    for row in conn.execute(f'''
+            SELECT (hour - ?) / ? AS bucket, {", ".join(f"SUM({column}) AS {column}" for column in HOURLY_STAT_COLUMNS)}
+            FROM hourly_stats WHERE hour >= ? AND hour < ? GROUP BY bucket ''', (start, step, start, end)):
+        for column in HOURLY_STAT_COLUMNS: agent[column][row['bucket']] = row[column]
+    agent["gemini_avg_latency_ms"] = [round(latency / calls) if calls else None for latency, calls in zip(agent["gemini_latency_ms"], agent["gemini_calls"])]
+    return {"start": start, "end": end, "step": step, "group_by": group_by, "buckets": buckets, "incidents": series, "agent": agent}
+
+
+@app.route('/api/timeseries')
+def get_timeseries():
+    """API endpoint trả về số sự cố theo giờ/ngày (nhóm theo namespace hoặc severity) và các bộ đếm của agent.
+
+    Tham số: start, end (epoch hoặc ISO, mặc định 24 giờ gần nhất), step=hour|day, group_by=namespace|severity|none,
+    namespace, severity.
+    """
+    try:
+        step = TIMESERIES_STEPS[request.args.get('step', 'hour')]
+        group_by = request.args.get('group_by', 'severity')
+        if group_by not in TIMESERIES_GROUPS + ('none',): raise ValueError(f"Unknown group_by: {group_by}")
+        # So sánh với None: epoch 0 là giá trị hợp lệ, không phải "không truyền"
+        end = parse_time_param(request.args.get('end')); start = parse_time_param(request.args.get('start'))
+        if end is None: end = int(time.time())
+        if start is None: start = end - 86400
+        # Căn theo bước (UTC) để bucket trùng với ranh giới giờ/ngày
+        start = start // step * step; end = -(-end // step) * step
+        if end <= start: raise ValueError("end must be after start")
+        if (end - start) // step > TIMESERIES_MAX_BUCKETS: raise ValueError(f"Window too large (max {TIMESERIES_MAX_BUCKETS} buckets)")
+        severity = request.args.get('severity', '').upper() or None
+    except KeyError:
+        return jsonify({"error": "Invalid query parameter: step must be 'hour' or 'day'"}), 400
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query parameter: {e}"}), 400
+
+    cache_key = (start, end, step, group_by, request.args.get('namespace'), severity)
+    cached = timeseries_cache.get(cache_key)
+    if cached is not None: return jsonify(cached)
+
+    conn = get_db_connection()
+    if conn is None:
+        return jsonify({"error": "Database connection failed or file not found."}), 500
+    try:
+        result = query_timeseries(conn, start, end, step, group_by, request.args.get('namespace'), severity)
+        timeseries_cache.put(cache_key, result)
+        return jsonify(result)
+    except sqlite3.Error as e:
+        logging.error(f"Database error fetching timeseries: {e}")
+        read_connections.reset()
+        return jsonify({"error": "Failed to fetch timeseries from database."}), 500
+
+
+@app.route('/api/backends')
+def get_backend_health():
+    """API endpoint trả về ảnh chụp sức khỏe mới nhất của từng backend của agent (circuit breaker, độ trễ, timeout)."""
+    conn = get_db_connection()
+    if conn is None:
+        return jsonify({"error": "Database connection failed or file not found."}), 500
+    try:
+        rows = conn.execute('SELECT name, health, updated_epoch FROM backend_health ORDER BY name').fetchall()
+        return jsonify({"backends": [{**json.loads(row['health']), "updated_epoch": row['updated_epoch']} for row in rows]})
+    except sqlite3.Error as e:
+        # DB chưa được agent migrate lên phiên bản có backend_health
+        logging.error(f"Database error fetching backend health: {e}")
+        read_connections.reset()
+        return jsonify({"error": "Failed to fetch backend health from database."}), 500
+
+
+# --- Đẩy thay đổi tới dashboard qua Server-Sent Events ---
+INCIDENT_LIST_COLUMNS = "id, timestamp, ts_epoch, pod_key, severity, summary, initial_reasons, workload"
+STATS_COLUMNS = ("gemini_calls", "telegram_alerts", "incident_count")
+STREAM_BACKLOG_LIMIT = 200
+
+
+def fetch_incidents_since(conn, since_id, limit=STREAM_BACKLOG_LIMIT):
+    rows = conn.execute(f'SELECT {INCIDENT_LIST_COLUMNS} FROM incidents WHERE id > ? ORDER BY id LIMIT ?', (since_id, limit)).fetchall()
+    return [dict(row) for row in rows]
+
+
+class DatabaseChangeDetector:
+    """Dò thay đổi bằng PRAGMA data_version (chỉ đổi khi agent commit) rồi mới truy vấn incident mới
+    (theo watermark id) và các dòng daily_stats thay đổi của hôm qua/hôm nay. Chỉ chạy trên luồng ChangeFeed."""
+
+    def __init__(self, connections):
+        self.connections = connections
+        self.data_version = None
+        self.last_id = None
+        self.daily_stats = {}
+
+    def _recent_stats(self, conn):
+        today = datetime.now(timezone.utc); dates = ((today - timedelta(days=1)).strftime('%Y-%m-%d'), today.strftime('%Y-%m-%d'))
+        rows = conn.execute(f'SELECT date, {", ".join(STATS_COLUMNS)} FROM daily_stats WHERE date IN (?, ?)', dates).fetchall()
+        return {row['date']: dict(row) for row in rows}
+
+    def __call__(self):
+        try:
+            conn = self.connections.get()
+            if conn is None: return []
+            version = conn.execute('PRAGMA data_version').fetchone()[0]
+            if version == self.data_version: return []
+            self.data_version = version
+            if self.last_id is None:
+                # Lần đầu: chỉ lấy mốc, client đã có dữ liệu ban đầu qua REST API
+                self.last_id = conn.execute('SELECT MAX(id) FROM incidents').fetchone()[0] or 0; self.daily_stats = self._recent_stats(conn)
+                return []
+            events = []
+            incidents = fetch_incidents_since(conn, self.last_id)
+            if incidents:
+                self.last_id = incidents[-1]['id']
+                events.append(("incidents", {"incidents": incidents[::-1]}, self.last_id))
+            stats = self._recent_stats(conn); changed = []; deltas = {}
+            for date, row in stats.items():
+                previous = self.daily_stats.get(date, {})
+                delta = {column: row[column] - previous.get(column, 0) for column in STATS_COLUMNS if row[column] != previous.get(column, 0)}
+                if delta: changed.append(row); deltas[date] = delta
+            self.daily_stats = stats
+            if changed: events.append(("stats", {"daily_stats": changed, "deltas": deltas}, None))
+            return events
+        except sqlite3.Error as e:
+            logging.error(f"Database error while polling for changes: {e}")
+            self.connections.reset(); self.data_version = None
+            return []
+
+
+change_feed = ChangeFeed(DatabaseChangeDetector(storage.ReadOnlyConnections(DB_PATH)), STREAM_POLL_INTERVAL_SECONDS, STREAM_MAX_SUBSCRIBERS)
+
+
+@app.route('/api/stream')
+def stream():
+    """Server-Sent Events: sự kiện `incidents` (sự cố mới, id = id sự cố mới nhất) và `stats` (daily_stats thay đổi).
+
+    Khi EventSource kết nối lại, header Last-Event-ID được dùng để gửi bù các sự cố bị lỡ.
+    """
+    missed = []
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+    if last_event_id is not None:
+        conn = get_db_connection()
+        if conn is not None:
+            try: missed = fetch_incidents_since(conn, last_event_id)
+            except sqlite3.Error as e: logging.error(f"Database error fetching missed incidents: {e}"); read_connections.reset()
+    subscriber = change_feed.subscribe()
+    if subscriber is None:
+        return jsonify({"error": "Too many live dashboard connections."}), 503
+
+    def generate():
+        try:
+            yield "retry: 5000\n\n"
+            if missed: yield format_sse("incidents", {"incidents": missed[::-1]}, missed[-1]['id'])
+            while not subscriber.closed:
+                try: yield subscriber.get(timeout=STREAM_HEARTBEAT_SECONDS)
+                except queue.Empty: yield ": keep-alive\n\n"
+        finally:
+            change_feed.unsubscribe(subscriber)
+
+    return Response(generate(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
 if __name__ == '__main__':
     # Chạy Flask app, host='0.0.0.0' để truy cập được từ bên ngoài container
     # debug=False khi chạy production
-    app.run(host='0.0.0.0', port=5000, debug=False)
+    # threaded=True: mỗi kết nối SSE giữ một luồng
+    app.run(host='0.0.0.0', port=5000, debug=False, threaded=True)
@@ -0,0 +1,73 @@
+import json
+import time
+import queue
+import logging
+import threading
+
+
+def format_sse(event, data, event_id=None):
+    """Định dạng một sự kiện Server-Sent Events."""
+    message = f"event: {event}\n"
+    if event_id is not None: message += f"id: {event_id}\n"
+    return message + f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class Subscriber:
+    """Hàng đợi sự kiện của một kết nối SSE; bị đóng nếu client đọc quá chậm."""
+
+    def __init__(self, max_queue):
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.closed = False
+
+    def get(self, timeout):
+        return self.queue.get(timeout=timeout)
+
+
+class ChangeFeed:
+    """Một luồng nền duy nhất dò thay đổi và phát sự kiện tới mọi subscriber.
+
+    `poll_changes()` trả về danh sách (event, data, event_id) kể từ lần gọi trước; chỉ được gọi
+    khi có ít nhất một subscriber, nên số truy vấn DB không tăng theo số dashboard đang mở.
+    """
+
+    def __init__(self, poll_changes, interval_seconds=2.0, max_subscribers=100, max_queue=100):
+        self.poll_changes = poll_changes
+        self.interval_seconds = interval_seconds
+        self.max_subscribers = max_subscribers
+        self.max_queue = max_queue
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._has_subscribers = threading.Event()
+        self._thread = None
+
+    def subscribe(self):
+        """Trả về Subscriber mới, hoặc None nếu đã đạt giới hạn số kết nối."""
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers: return None
+            subscriber = Subscriber(self.max_queue); self._subscribers.add(subscriber); self._has_subscribers.set()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="change-feed", daemon=True); self._thread.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+            if not self._subscribers: self._has_subscribers.clear()
+
+    def publish(self, event, data, event_id=None):
+        message = format_sse(event, data, event_id)
+        with self._lock: subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try: subscriber.queue.put_nowait(message)
+            except queue.Full:
+                # Client không theo kịp: đóng kết nối, EventSource sẽ tự kết nối lại và lấy bù qua Last-Event-ID
+                logging.warning("SSE subscriber is too slow; closing its stream.")
+                subscriber.closed = True; self.unsubscribe(subscriber)
+
+    def _run(self):
+        while True:
+            self._has_subscribers.wait()
+            try:
+                for event, data, event_id in self.poll_changes(): self.publish(event, data, event_id)
+            except Exception as e: logging.error(f"Error polling for changes: {e}", exc_info=True)
+            time.sleep(self.interval_seconds)
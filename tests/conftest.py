@@ -0,0 +1,26 @@
+import os
+import sys
+import importlib.util
+
+import pytest
+
+# Agent chạy dưới dạng `python app/main.py`: các module trong app/ import lẫn nhau bằng tên trần
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app"))
+
+import schema
+import storage
+
+PORTAL_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "portal")
+
+
+@pytest.fixture
+def portal(tmp_path, monkeypatch):
+    """Test client của portal trên một DB tạm đã chạy đủ migration; `.module` là module portal/app.py, `.db_path` là file DB."""
+    db_path = str(tmp_path / "agent.db"); db = storage.Storage(db_path); db.open(schema.MIGRATIONS); db.close()
+    monkeypatch.setenv("DB_PATH", db_path); monkeypatch.syspath_prepend(PORTAL_DIR)
+    # portal/app.py trùng tên với thư mục app/ của agent: nạp theo đường dẫn
+    spec = importlib.util.spec_from_file_location("portal_app", os.path.join(PORTAL_DIR, "app.py"))
+    module = importlib.util.module_from_spec(spec); spec.loader.exec_module(module)
+    client = module.app.test_client(); client.db_path = db_path; client.module = module
+    yield client
+    sys.modules.pop("portal_app", None)
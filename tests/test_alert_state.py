@@ -0,0 +1,61 @@
+import pytest
+
+import schema
+import storage
+from alert_state import AlertState, parse_severity_cooldowns
+
+
+class Clock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = storage.Storage(str(tmp_path / "agent.db")); db.open(schema.MIGRATIONS)
+    yield db
+    db.close()
+
+
+def restart(db, clock, **kwargs):
+    """Mô phỏng agent khởi động lại: AlertState mới trên cùng DB, sau khi mọi thao tác ghi nền đã commit."""
+    db.flush(); state = AlertState(db, default_cooldown_seconds=600, clock=clock, **kwargs); state.load()
+    return state
+
+
+def test_cooldowns_survive_a_restart_and_expired_rows_are_deleted(db):
+    clock = Clock(); state = AlertState(db, default_cooldown_seconds=600, severity_cooldown_seconds={"CRITICAL": 60}, clock=clock)
+    for key, severity in (("ns/api", "ERROR"), ("ns/db", "CRITICAL")):
+        assert state.try_start(key, key) is None; state.finish(key, severity)
+    clock.now += 120  # cooldown CRITICAL (60s) đã hết, ERROR (600s) vẫn còn
+    restored = restart(db, clock)
+    assert restored.stats["restored_cooldowns"] == 1 and restored.try_start("ns/api") == "cooldown"
+    assert restored.try_start("ns/db") is None
+    assert db.run(lambda cursor: [row[0] for row in cursor.execute("SELECT key FROM alert_cooldowns")]) == ["ns/api"]
+    clock.now += 600
+    assert restored.try_start("ns/api") is None
+
+
+def test_interrupted_investigations_are_returned_once(db):
+    clock = Clock(); state = AlertState(db, clock=clock)
+    state.try_start("shop/api", "shop/api-7d9f-abc")
+    clock.now += 60; state.try_start("shop/web-0", "shop/web-0"); state.finish("shop/web-0")
+    clock.now += 30
+    restored = restart(db, clock, interrupted_max_age_seconds=300)
+    assert restored.take_interrupted() == {"shop/api": "shop/api-7d9f-abc"}
+    assert restored.take_interrupted() == {}
+    assert db.run(lambda cursor: cursor.execute("SELECT COUNT(*) FROM in_flight_investigations").fetchone()[0]) == 0
+
+
+def test_stale_interrupted_investigations_are_dropped(db):
+    clock = Clock(); state = AlertState(db, clock=clock)
+    state.try_start("ns/old", "ns/old"); clock.now += 3600
+    restored = restart(db, clock, interrupted_max_age_seconds=1800)
+    assert restored.take_interrupted() == {} and restored.stats["restored_in_flight"] == 0
+
+
+def test_parse_severity_cooldowns_skips_invalid_items():
+    assert parse_severity_cooldowns("critical=10, ERROR=0.5,bad,WARNING=x") == {"CRITICAL": 600.0, "ERROR": 30.0}
@@ -0,0 +1,32 @@
+import time
+
+import schema
+import storage
+from analysis_cache import AnalysisCache
+
+
+def open_db(tmp_path):
+    db = storage.Storage(str(tmp_path / "agent.db")); db.open(schema.MIGRATIONS)
+    return db
+
+
+def test_migrations_create_analysis_cache_table(tmp_path):
+    db = open_db(tmp_path)
+    try:
+        assert db.run(lambda cursor: cursor.execute('PRAGMA user_version').fetchone()[0]) == len(schema.MIGRATIONS)
+        columns = db.run(lambda cursor: [row[1] for row in cursor.execute('PRAGMA table_info(analysis_cache)')])
+        assert columns == ["fingerprint", "result", "created_at"]
+    finally: db.close()
+
+
+def test_cache_survives_reload_and_expired_entries_are_pruned(tmp_path):
+    db = open_db(tmp_path)
+    try:
+        cache = AnalysisCache(db, ttl_seconds=60); cache.load()
+        cache.put("fresh", {"severity": "ERROR", "summary": "x"})
+        db.run(lambda cursor: cursor.execute('INSERT INTO analysis_cache VALUES (?, ?, ?)', ("stale", '{"severity": "INFO"}', time.time() - 3600)))
+        reloaded = AnalysisCache(db, ttl_seconds=60); reloaded.load()
+        assert reloaded.get("fresh") == {"severity": "ERROR", "summary": "x"} and reloaded.get("stale") is None
+        assert db.run(lambda cursor: [row[0] for row in cursor.execute('SELECT fingerprint FROM analysis_cache')]) == ["fresh"]
+        assert db.run(lambda cursor: schema.prune_analysis_cache(cursor, time.time() + 1)) == 1
+    finally: db.close()
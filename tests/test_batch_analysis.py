@@ -0,0 +1,48 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from backends import DeadlineExceeded
+from batch_analysis import BatchAnalyzer
+from fakes import FakeModelClient
+
+
+def test_submit_raises_deadline_exceeded_when_batch_call_hangs():
+    release = threading.Event(); deadlines = []
+    def call_model(prompt, max_output_tokens, deadline=None):
+        deadlines.append(deadline); release.wait(10); return "[]"
+    analyzer = BatchAnalyzer(call_model, window_seconds=0.05).start()
+    deadline = time.monotonic() + 0.3
+    def submit(i):
+        try: analyzer.submit(f"ns/pod-{i}", "CrashLoopBackOff", "", deadline); return "result"
+        except DeadlineExceeded: return "deadline"
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=2) as executor: outcomes = list(executor.map(submit, range(2)))
+    elapsed = time.monotonic() - start; release.set()
+    assert outcomes == ["deadline", "deadline"] and elapsed < 2
+    assert deadlines == [deadline] and analyzer.stats["items_timed_out"] == 2
+
+
+def test_expired_items_are_dropped_from_batch_before_calling_model():
+    calls = []
+    def call_model(prompt, max_output_tokens, deadline=None): calls.append(prompt); return "[]"
+    analyzer = BatchAnalyzer(call_model, window_seconds=0.5).start()
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        expiring = executor.submit(analyzer.submit, "ns/a", "OOMKilled", "", time.monotonic() + 0.05)
+        time.sleep(0.01); patient = executor.submit(analyzer.submit, "ns/b", "OOMKilled", "")
+        with pytest.raises(DeadlineExceeded): expiring.result()
+        # Pod còn lại đứng một mình trong batch: trả None để worker phân tích riêng
+        assert patient.result(timeout=5) is None
+    assert calls == []
+
+
+def test_batched_results_are_returned_per_pod():
+    model = FakeModelClient()
+    analyzer = BatchAnalyzer(lambda prompt, max_output_tokens, deadline=None: model.generate(prompt, max_output_tokens, json_response=True).text, window_seconds=0.2).start()
+    contexts = {"ns/oom": "Container OOMKilled", "ns/pull": "Waiting (ImagePullBackOff)", "ns/ok": "Running"}
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        futures = {pod_key: executor.submit(analyzer.submit, pod_key, context, "", time.monotonic() + 5) for pod_key, context in contexts.items()}
+    assert {pod_key: future.result()["severity"] for pod_key, future in futures.items()} == {"ns/oom": "CRITICAL", "ns/pull": "ERROR", "ns/ok": "INFO"}
+    assert model.calls == 1
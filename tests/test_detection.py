@@ -0,0 +1,67 @@
+from datetime import datetime, timedelta, timezone
+
+from kubernetes import client
+
+from detection import InvestigationQueue, PodTransitionDetector
+from logbatch import LogBatch
+
+
+def pod(restarts=0, waiting=None, terminated=None, phase="Running", restart_policy="Always"):
+    state = client.V1ContainerState(waiting=client.V1ContainerStateWaiting(reason=waiting) if waiting else None)
+    last_state = client.V1ContainerState(terminated=terminated) if terminated else None
+    status = client.V1ContainerStatus(name="app", image="app:1", image_id="", ready=False, restart_count=restarts, state=state, last_state=last_state)
+    return client.V1Pod(metadata=client.V1ObjectMeta(name="api-0", namespace="ns"), spec=client.V1PodSpec(containers=[], restart_policy=restart_policy),
+                        status=client.V1PodStatus(phase=phase, container_statuses=[status]))
+
+
+def oom(container_id, minutes_ago=1):
+    return client.V1ContainerStateTerminated(exit_code=137, reason="OOMKilled", container_id=container_id,
+                                             finished_at=datetime.now(timezone.utc) - timedelta(minutes=minutes_ago))
+
+
+def make_detector():
+    work_queue = InvestigationQueue()
+    return work_queue, PodTransitionDetector(work_queue, restart_threshold=3, termination_window=timedelta(minutes=30))
+
+
+def test_each_transition_is_reported_once():
+    work_queue, detector = make_detector()
+    first_oom = oom("containerd://1")
+    versions = [pod(restarts=2), pod(restarts=3, waiting="CrashLoopBackOff", terminated=first_oom),
+                pod(restarts=3, waiting="CrashLoopBackOff", terminated=first_oom), pod(restarts=4, waiting="CrashLoopBackOff", terminated=oom("containerd://2"))]
+    detector("ADDED", versions[0], None)
+    assert len(work_queue) == 0
+    detector("MODIFIED", versions[1], versions[0])
+    reasons = work_queue.drain(timeout=0)["ns/api-0"]["reason"]
+    assert len(reasons) == 3 and any("restart 3" in r for r in reasons) and any("CrashLoopBackOff" in r for r in reasons) and any("OOMKilled" in r for r in reasons)
+    # Cùng trạng thái, không có chuyển mới
+    detector("MODIFIED", versions[2], versions[1])
+    assert len(work_queue) == 0
+    # Đã vượt ngưỡng restart từ trước; chỉ lần OOMKilled mới được báo
+    detector("MODIFIED", versions[3], versions[2])
+    assert work_queue.drain(timeout=0)["ns/api-0"]["reason"] == ["K8s: Container 'app' bị Terminated với lý do 'OOMKilled'"]
+    detector("DELETED", versions[3], versions[3])
+    assert len(work_queue) == 0 and detector.transitions_detected == 4
+
+
+def test_old_terminations_and_unchanged_failed_phase_are_ignored():
+    work_queue, detector = make_detector()
+    detector("ADDED", pod(terminated=oom("containerd://1", minutes_ago=120)), None)
+    assert len(work_queue) == 0
+    failed = pod(phase="Failed", restart_policy="Never")
+    detector("MODIFIED", failed, pod(restart_policy="Never"))
+    detector("MODIFIED", failed, failed)
+    assert work_queue.drain(timeout=0)["ns/api-0"]["reason"] == ["K8s: Trạng thái Pod là Failed"]
+
+
+def test_queue_merges_items_for_the_same_pod_until_drained():
+    work_queue = InvestigationQueue(max_log_lines_per_pod=3)
+    logs = LogBatch(); label_id = logs.add_labels({"pod": "api-0"})
+    for i in range(4): logs.append(i, f"line {i}", label_id)
+    work_queue.put("ns/api-0", reason="K8s: a", logs=logs); work_queue.put("ns/api-0", reason="K8s: a")
+    work_queue.put("ns/api-0", reason="Loki: b"); work_queue.put("ns/web-0", reason="K8s: c")
+    assert len(work_queue) == 2
+    items = work_queue.drain(timeout=0)
+    assert list(items) == ["ns/api-0", "ns/web-0"] and items["ns/api-0"]["reason"] == ["K8s: a", "Loki: b"]
+    assert items["ns/api-0"]["logs"].messages() == ["line 1", "line 2", "line 3"] and items["ns/api-0"]["logs"].dropped == 1
+    assert len(work_queue) == 0 and work_queue.drain(timeout=0.01) == {}
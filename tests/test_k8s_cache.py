@@ -0,0 +1,59 @@
+from kubernetes import client
+from kubernetes.client.exceptions import ApiException
+
+import k8s_cache
+from k8s_cache import ResourceInformer
+
+
+def pod(name, resource_version):
+    return client.V1Pod(metadata=client.V1ObjectMeta(name=name, namespace="ns", resource_version=resource_version))
+
+
+def pod_list(resource_version, *pods):
+    return client.V1PodList(items=list(pods), metadata=client.V1ListMeta(resource_version=resource_version))
+
+
+class FakeWatch:
+    """Thay cho kubernetes.watch.Watch: mỗi lần stream() lấy kịch bản kế tiếp (ném lỗi hoặc phát các sự kiện)."""
+    scripts = []; calls = []
+
+    def stream(self, func, resource_version=None, **kwargs):
+        FakeWatch.calls.append(resource_version); script = FakeWatch.scripts.pop(0)
+        if isinstance(script, Exception): raise script
+        yield from script()
+
+    def stop(self):
+        pass
+
+
+def test_informer_relists_after_410_gone_and_resumes_watching(monkeypatch):
+    lists = [pod_list("10", pod("a", "1"), pod("c", "3")), pod_list("20", pod("a", "4"), pod("b", "5"))]
+    informer = ResourceInformer("pods", lambda **kwargs: lists.pop(0), retry_backoff_seconds=0)
+    events = []; informer.add_handler(lambda event_type, obj, old_obj: events.append((event_type, obj.metadata.name, old_obj is not None)))
+
+    def resumed():
+        yield {"type": "MODIFIED", "object": pod("b", "21")}
+        informer.stop()
+
+    FakeWatch.scripts = [ApiException(status=410, reason="Gone"), resumed]; FakeWatch.calls = []
+    monkeypatch.setattr(k8s_cache.watch, "Watch", FakeWatch)
+    informer._run()
+    assert FakeWatch.calls == ["10", "20"] and not lists
+    # Lần list đầu: ADDED a, c; list lại sau 410: a đổi, b mới, c đã mất; sau đó watch tiếp từ resourceVersion mới
+    assert events == [("ADDED", "a", False), ("ADDED", "c", False), ("MODIFIED", "a", True), ("ADDED", "b", False), ("DELETED", "c", True), ("MODIFIED", "b", True)]
+    assert informer.synced.is_set() and informer.resource_version == "21"
+    assert sorted(obj.metadata.name for obj in informer.items()) == ["a", "b"] and informer.get("ns/b").metadata.resource_version == "21"
+
+
+def test_informer_relist_skips_unchanged_objects(monkeypatch):
+    lists = [pod_list("10", pod("a", "1")), pod_list("11", pod("a", "1"))]
+    informer = ResourceInformer("pods", lambda **kwargs: lists.pop(0), retry_backoff_seconds=0)
+    events = []; informer.add_handler(lambda event_type, obj, old_obj: events.append(event_type))
+
+    def idle():
+        informer.stop(); yield from ()
+
+    FakeWatch.scripts = [ApiException(status=410, reason="Gone"), idle]; FakeWatch.calls = []
+    monkeypatch.setattr(k8s_cache.watch, "Watch", FakeWatch)
+    informer._run()
+    assert events == ["ADDED"] and informer.resource_version == "11"
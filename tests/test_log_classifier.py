@@ -0,0 +1,16 @@
+from log_classifier import DEFAULT_CLASSIFIER, LEVEL_INDEX, NO_LEVEL
+
+
+def test_classify_batch_assigns_matches_to_their_lines():
+    messages = ["all good", "ERROR: db down", "retry failed", "[WARN] slow"]
+    assert DEFAULT_CLASSIFIER.classify_batch(messages) == [
+        (NO_LEVEL, False), (LEVEL_INDEX["ERROR"], False), (NO_LEVEL, True), (NO_LEVEL, False)]
+
+
+def test_classify_batch_handles_case_expanding_characters():
+    # "ß".upper() == "SS": offset phải tính trên văn bản đã upper()
+    assert DEFAULT_CLASSIFIER.classify_batch(["ßßßßßßßßßß ERROR"]) == [(LEVEL_INDEX["ERROR"], False)]
+    messages = ["straße ßßßß ok", "ﬁne", "INFO started", "ßß CRITICAL"]
+    assert DEFAULT_CLASSIFIER.classify_batch(messages) == [
+        (NO_LEVEL, False), (NO_LEVEL, False), (LEVEL_INDEX["INFO"], False), (LEVEL_INDEX["CRITICAL"], False)]
+    assert DEFAULT_CLASSIFIER.classify_batch(messages) == [DEFAULT_CLASSIFIER.classify(message) for message in messages]
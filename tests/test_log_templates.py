@@ -0,0 +1,49 @@
+import json
+
+from logbatch import LogBatch
+from log_templates import TemplateMiner, format_templates_for_prompt, mask_message, mine_templates, templates_to_json
+
+BASE_NS = 1_700_000_000 * 10**9
+
+
+def test_variable_parts_are_masked():
+    assert mask_message("2024-05-01T10:00:00Z conn 10.0.0.7:5432 id=3fa85f64-5717-4562-b3fc-2c963f66afa6 took 15ms") == \
+        "<*> conn <*> id=<*> took <*>"
+
+
+def test_repeated_lines_collapse_into_one_template():
+    miner = TemplateMiner()
+    for i, user in enumerate(["alice", "bob", "carol"]):
+        miner.add(f"ERROR failed to load profile for user {user} after {i + 1} retries", BASE_NS + i, "ERROR")
+    miner.add("WARNING disk usage high", BASE_NS + 10, "WARNING")
+    miner.add("INFO failed to load profile for user dave after 1 retries", BASE_NS + 5, "INFO")
+    assert [template.template for template in miner.templates] == [
+        "ERROR failed to load profile for user <*> after <*> retries", "WARNING disk usage high", "INFO failed to load profile for user dave after <*> retries"]
+    first = miner.templates[0]
+    assert first.count == 3 and first.exemplar.endswith("alice after 1 retries") and first.level == "ERROR"
+    assert (first.first_seen_ns, first.last_seen_ns) == (BASE_NS, BASE_NS + 2)
+
+
+def test_mine_templates_orders_by_first_occurrence_and_serializes():
+    batch = LogBatch(); label_id = batch.add_labels({"pod": "api-0"})
+    for ts, line in ((30, "panic: nil pointer"), (10, "retrying in 5s"), (20, "retrying in 7s")): batch.append(BASE_NS + ts, line, label_id)
+    templates = mine_templates(batch)
+    assert [(t.template, t.count) for t in templates] == [("retrying in <*>", 2), ("panic: nil pointer", 1)]
+    assert [item["template"] for item in json.loads(templates_to_json(templates))] == ["retrying in <*>", "panic: nil pointer"]
+
+
+def test_prompt_budget_prefers_severe_templates_but_keeps_time_order():
+    miner = TemplateMiner()
+    for i in range(6): miner.add(f"INFO request path /p{i} served", BASE_NS + i, "INFO")
+    miner.add("INFO cache warmed", BASE_NS + 1, "INFO")
+    miner.add("ERROR database connection refused", BASE_NS + 50, "ERROR")
+    miner.add("WARNING slow query detected", BASE_NS + 40, "WARNING")
+    full = format_templates_for_prompt(miner.templates)
+    assert full.count("[x") == 4 and "lược bỏ" not in full
+    blocks = full.split("\n[x")
+    budget = len(blocks[0]) + len(blocks[2]) + len(blocks[3]) + 10  # vừa đủ cho 3 block
+    text = format_templates_for_prompt(miner.templates, max_chars=budget)
+    assert "ERROR database connection refused" in text and "WARNING slow query detected" in text
+    assert "cache warmed" not in text and text.endswith("(1 template khác bị lược bỏ do giới hạn độ dài)")
+    # In ra theo thứ tự template được tạo (thời gian), không theo độ ưu tiên
+    assert text.index("request path") < text.index("database connection refused") < text.index("slow query")
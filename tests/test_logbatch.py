@@ -0,0 +1,57 @@
+import threading
+
+import logbatch
+from logbatch import LogBatch, intern_labels
+
+
+def batch_of(entries, max_lines=0, pod="api"):
+    batch = LogBatch(max_lines); label_id = batch.add_labels({"namespace": "ns", "pod": pod})
+    for ts_ns, line in entries: batch.append(ts_ns, line, label_id)
+    return batch
+
+
+def test_ring_buffer_keeps_newest_lines_across_compactions():
+    batch = LogBatch(max_lines=3); label_id = batch.add_labels({"pod": "api"})
+    for i in range(10):
+        batch.append(i, f"line {i}", label_id, level=i % 4)
+        kept = range(max(0, i - 2), i + 1)
+        assert batch.messages() == [f"line {n}" for n in kept] and [batch.timestamp_ns(n) for n in range(len(batch))] == list(kept)
+        assert batch._head < batch.max_lines  # đã dồn lại, không giữ mãi các dòng bị đẩy ra
+    assert len(batch) == 3 and batch.dropped == 7
+    assert [batch.level(n) for n in range(3)] == [7 % 4, 8 % 4, 9 % 4] and batch.labels(2) == {"pod": "api"}
+
+
+def test_merge_orders_by_time_and_keeps_labels_and_drop_counts():
+    first = batch_of([(1, "a1"), (4, "a4"), (5, "a5")], max_lines=3, pod="a"); first.dropped = 2
+    second = batch_of([(2, "b2"), (3, "b3")], max_lines=5, pod="b")
+    merged = LogBatch.merge([first, None, second])
+    assert merged.max_lines == 5 and merged.messages() == ["a1", "b2", "b3", "a4", "a5"]
+    assert [merged.labels(n)["pod"] for n in range(len(merged))] == ["a", "b", "b", "a", "a"]
+    assert merged.dropped == 2
+    # Giới hạn nhỏ hơn: giữ các dòng mới nhất, số dòng bị bỏ được cộng dồn
+    capped = LogBatch.merge([first, second], max_lines=2)
+    assert capped.messages() == ["a4", "a5"] and capped.dropped == 2 + 3
+    assert LogBatch.merge([second]) is second
+
+
+def test_label_interning_is_an_lru(monkeypatch):
+    monkeypatch.setattr(logbatch, "_LABEL_SETS", logbatch.OrderedDict()); monkeypatch.setattr(logbatch, "_MAX_LABEL_SETS", 2)
+    a = intern_labels({"pod": "a"}); b = intern_labels({"pod": "b"})
+    assert intern_labels({"pod": "a"}) is a
+    intern_labels({"pod": "c"})
+    assert intern_labels({"pod": "a"}) is a and intern_labels({"pod": "b"}) is not b
+
+
+def test_label_interning_is_thread_safe(monkeypatch):
+    monkeypatch.setattr(logbatch, "_LABEL_SETS", logbatch.OrderedDict()); monkeypatch.setattr(logbatch, "_MAX_LABEL_SETS", 50)
+    errors = []; results = [[] for _ in range(8)]
+    def worker(n):
+        try:
+            for i in range(2000): results[n].append(intern_labels({"pod": f"p{i % 40}"}))
+        except Exception as e: errors.append(e)
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    assert not errors and len(logbatch._LABEL_SETS) == 40
+    # 40 bộ label nằm gọn trong giới hạn: mọi luồng nhận cùng một dict cho cùng một bộ label
+    assert all(results[n][i] is results[0][i] for n in range(8) for i in range(2000))
@@ -0,0 +1,50 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+import requests
+
+import main
+import metrics
+from backends import DeadlineExceeded
+from model_client import ModelResponse
+
+
+def test_query_loki_for_pod_propagates_deadline(monkeypatch):
+    def get(*args, **kwargs): raise DeadlineExceeded("loki: investigation deadline exceeded")
+    monkeypatch.setattr(main.BACKENDS["loki"], "get", get)
+    end = datetime.now(timezone.utc)
+    with pytest.raises(DeadlineExceeded): main.query_loki_for_pod("ns", "pod", end - timedelta(minutes=5), end, deadline=0)
+
+
+
+def test_single_pod_analysis_timeout_is_bounded_by_deadline(monkeypatch):
+    timeouts = []
+
+    class RecordingClient:
+        def generate(self, prompt, max_output_tokens=300, timeout=90, json_response=False):
+            timeouts.append(timeout); return ModelResponse('{"severity": "ERROR", "summary": "x"}', 1, 1)
+
+    monkeypatch.setattr(main, "model_client", RecordingClient())
+    monkeypatch.setattr(main, "analysis_cache", None); monkeypatch.setattr(main, "batch_analyzer", None)
+    result = main.analyze_with_cache("ns/pod", None, "Pod: ns/pod\nStatus: CrashLoopBackOff\n", None, time.monotonic() + 2)
+    assert result["severity"] == "ERROR"
+    assert timeouts and timeouts[0] <= 2 < main.BACKENDS["gemini"].max_timeout
+
+def test_profile_request_is_clamped(monkeypatch):
+    monkeypatch.setattr(main, "profile_cycles_requested", 0)
+    assert main.request_cycle_profile({"cycles": ["1000000"]})[0] == 200 and main.profile_cycles_requested == main.PROFILE_MAX_CYCLES_PER_REQUEST
+    assert main.request_cycle_profile({"cycles": ["-5"]})[0] == 200 and main.profile_cycles_requested == 0
+    assert main.request_cycle_profile({"cycles": ["many"]})[0] == 400
+
+
+def test_profile_endpoint_is_not_served_unless_enabled(monkeypatch):
+    monkeypatch.setattr(main, "DEBUG_PROFILE_ENDPOINT_ENABLED", False)
+    server = metrics.start_http_server(main.METRICS, 0, host="127.0.0.1", handlers=main.metrics_handlers())
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+        assert requests.get(f"{url}/debug/profile?cycles=5", timeout=5).status_code == 404
+        assert requests.get(f"{url}/metrics", timeout=5).status_code == 200
+    finally: server.shutdown(); server.server_close()
+    monkeypatch.setattr(main, "DEBUG_PROFILE_ENDPOINT_ENABLED", True)
+    assert "/debug/profile" in main.metrics_handlers()
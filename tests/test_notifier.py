@@ -0,0 +1,52 @@
+import threading
+
+import notifier
+from fakes import FakeTelegramServer
+from notifier import TelegramNotifier
+
+
+def make_notifier(server, **kwargs):
+    kwargs.setdefault("coalesce_window_seconds", 0.2)
+    return TelegramNotifier("token", server.url, backoff_seconds=0.01, **kwargs)
+
+
+def test_rate_limited_send_waits_retry_after(monkeypatch):
+    server = FakeTelegramServer(rate_limit_every=2, retry_after=7).start()
+    sleeps = []; real_sleep = notifier.time.sleep
+    def sleep(seconds):
+        # Chỉ ghi lại lần chờ của luồng sender, không chờ thật
+        if threading.current_thread().name == "telegram-sender": sleeps.append(seconds)
+        else: real_sleep(seconds)
+    monkeypatch.setattr(notifier.time, "sleep", sleep)
+    sender = make_notifier(server)
+    try:
+        sender.submit("alert a", chat_id="1"); sender.submit("alert b", chat_id="2")
+        sender.start(); assert sender.flush(timeout=10)
+    finally: sender.close(); server.stop()
+    assert sleeps == [7.0]
+    assert sender.stats["rate_limited"] == 1 and sender.stats["sent"] == 2 and sender.stats["failed"] == 0
+    assert sorted(message["text"] for message in server.messages) == ["alert a", "alert b"]
+
+
+def test_alerts_to_same_chat_are_coalesced_into_one_digest():
+    server = FakeTelegramServer().start(); sent = []
+    sender = make_notifier(server, on_sent=sent.append)
+    try:
+        for i in range(5): sender.submit(f"alert {i}", chat_id="42")
+        sender.start(); assert sender.flush(timeout=10)
+    finally: sender.close(); server.stop()
+    assert len(server.messages) == 1 and server.messages[0]["chat_id"] == "42"
+    assert all(f"alert {i}" in server.messages[0]["text"] for i in range(5))
+    assert sender.stats["coalesced"] == 4 and sender.stats["sent"] == 5 and sender.stats["messages"] == 1 and sent == [5]
+
+
+def test_queue_overflow_drops_and_counts_alerts():
+    server = FakeTelegramServer().start()
+    sender = make_notifier(server, max_queue=2)
+    try:
+        assert sender.submit("a", chat_id="1") and sender.submit("b", chat_id="1")
+        assert not sender.submit("c", chat_id="1")
+        assert sender.stats["dropped"] == 1 and sender.pending == 2
+        sender.start(); assert sender.flush(timeout=10)
+    finally: sender.close(); server.stop()
+    assert sender.stats["sent"] == 2 and sender.stats["queued"] == 2
@@ -0,0 +1,72 @@
+import json
+import sqlite3
+
+import storage
+
+
+def test_timeseries_accepts_epoch_zero_start(portal):
+    body = portal.get("/api/timeseries?start=0&end=7200&step=hour").get_json()
+    assert body["start"] == 0 and body["end"] == 7200 and body["buckets"] == [0, 3600]
+
+
+def test_timeseries_defaults_to_last_day(portal):
+    body = portal.get("/api/timeseries?end=864000&step=hour").get_json()
+    assert body["start"] == 864000 - 86400 and len(body["buckets"]) == 24
+
+
+def add_incident(db_path, ts_epoch, pod_key, severity="ERROR", details=("ctx", "logs", None)):
+    conn = sqlite3.connect(db_path)
+    try:
+        incident_id = conn.execute("INSERT INTO incidents (timestamp, ts_epoch, pod_key, severity, summary) VALUES ('', ?, ?, ?, 's')",
+                                   (ts_epoch, pod_key, severity)).lastrowid
+        conn.execute("INSERT INTO incident_details (incident_id, k8s_context, sample_logs, log_templates) VALUES (?, ?, ?, ?)", (incident_id, *details))
+        conn.commit()
+    finally: conn.close()
+    return incident_id
+
+
+def ids(response):
+    return [incident["id"] for incident in response.get_json()["incidents"]]
+
+
+def test_keyset_pagination_walks_ties_on_timestamp(portal):
+    created = [(ts, add_incident(portal.db_path, ts, "ns/api")) for ts in (100, 200, 200, 200, 300)]
+    seen = []; cursor = None
+    while True:
+        body = portal.get("/api/incidents?limit=2" + (f"&cursor={cursor}" if cursor else "")).get_json()
+        seen += [incident["id"] for incident in body["incidents"]]; cursor = body["next_cursor"]
+        if cursor is None: break
+    assert seen == [incident_id for _, incident_id in sorted(created, reverse=True)]
+
+
+def test_incident_filters(portal):
+    api = add_incident(portal.db_path, 100, "shop/api-1", "ERROR"); web = add_incident(portal.db_path, 200, "shop/web-1", "WARNING")
+    other = add_incident(portal.db_path, 300, "shopping/api-1", "CRITICAL"); late = add_incident(portal.db_path, 400, "shop/api-2", "INFO")
+    assert ids(portal.get("/api/incidents?namespace=shop")) == [late, web, api]
+    assert ids(portal.get("/api/incidents?pod=shop/api")) == [late, api]
+    assert ids(portal.get("/api/incidents?severity=critical,error")) == [other, api]
+    assert ids(portal.get("/api/incidents?start=200&end=400")) == [other, web]
+    assert portal.get("/api/incidents?severity=FATAL").status_code == 400
+
+
+def test_incidents_etag_and_since_id(portal):
+    first = add_incident(portal.db_path, 100, "ns/api")
+    response = portal.get("/api/incidents"); etag = response.headers["ETag"]
+    assert response.status_code == 200 and portal.get("/api/incidents", headers={"If-None-Match": etag}).status_code == 304
+    second = add_incident(portal.db_path, 200, "ns/api")
+    assert portal.get("/api/incidents", headers={"If-None-Match": etag}).status_code == 200
+    body = portal.get(f"/api/incidents?since_id={first}").get_json()
+    assert [incident["id"] for incident in body["incidents"]] == [second] and body["latest_id"] == second
+
+
+def test_incident_detail_decompresses_and_reports_corrupt_rows_as_json(portal):
+    templates = json.dumps([{"template": "ERROR <*>", "count": 3}])
+    good = add_incident(portal.db_path, 100, "ns/api", details=(storage.compress_text("x" * 1000, min_bytes=1), "logs", templates))
+    body = portal.get(f"/api/incidents/{good}").get_json()
+    assert body["k8s_context"] == "x" * 1000 and body["log_templates"][0]["count"] == 3
+    corrupt = add_incident(portal.db_path, 200, "ns/api", details=(b"not zlib", "logs", None))
+    bad_json = add_incident(portal.db_path, 300, "ns/api", details=("ctx", "logs", "{not json"))
+    for incident_id in (corrupt, bad_json):
+        response = portal.get(f"/api/incidents/{incident_id}")
+        assert response.status_code == 500 and response.is_json and "error" in response.get_json()
+    assert portal.get("/api/incidents/999999").status_code == 404
@@ -0,0 +1,76 @@
+import time
+import sqlite3
+
+import pytest
+
+import main
+import schema
+import storage
+
+HOUR = 3600
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = storage.Storage(str(tmp_path / "agent.db")); db.open(schema.MIGRATIONS)
+    yield db
+    db.close()
+
+
+def test_retention_prunes_hourly_rollups_past_their_window(db, monkeypatch):
+    now_hour = int(time.time()) // HOUR * HOUR; old_hour = now_hour - 100 * 86400
+    def seed(cursor):
+        for hour in (old_hour, now_hour):
+            cursor.execute("INSERT INTO hourly_incidents (hour, namespace, severity, incident_count) VALUES (?, 'ns', 'ERROR', 1)", (hour,))
+            cursor.execute("INSERT INTO hourly_stats (hour, gemini_calls) VALUES (?, 1)", (hour,))
+    db.run(seed)
+    monkeypatch.setattr(main, "db", db); monkeypatch.setattr(main, "analysis_cache", None)
+    monkeypatch.setattr(main, "HOURLY_ROLLUP_RETENTION_DAYS", 90)
+    main.run_retention()
+    assert db.run(lambda cursor: [row[0] for row in cursor.execute("SELECT hour FROM hourly_incidents")]) == [now_hour]
+    assert db.run(lambda cursor: [row[0] for row in cursor.execute("SELECT hour FROM hourly_stats")]) == [now_hour]
+
+
+def test_migrations_upgrade_a_baseline_database(tmp_path):
+    path = str(tmp_path / "agent.db"); long_context = "Pod: ns/api\n" + "x" * 2000
+    conn = sqlite3.connect(path)
+    conn.execute('''CREATE TABLE incidents (id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp TEXT NOT NULL, pod_key TEXT NOT NULL,
+                    severity TEXT NOT NULL, summary TEXT, initial_reasons TEXT, k8s_context TEXT, sample_logs TEXT )''')
+    conn.execute('''CREATE TABLE daily_stats (date TEXT PRIMARY KEY, gemini_calls INTEGER DEFAULT 0,
+                    telegram_alerts INTEGER DEFAULT 0, incident_count INTEGER DEFAULT 0 )''')
+    conn.execute("INSERT INTO incidents (timestamp, pod_key, severity, summary, k8s_context, sample_logs) VALUES (?, ?, ?, ?, ?, ?)",
+                 ("2024-05-01T10:15:00+00:00", "ns/api", "ERROR", "boom", long_context, "ERROR short log"))
+    conn.execute("INSERT INTO daily_stats (date, gemini_calls) VALUES ('2024-05-01', 3)")
+    conn.commit(); conn.close()
+
+    db = storage.Storage(path).open(schema.MIGRATIONS)
+    try:
+        assert db.run(lambda cursor: cursor.execute("PRAGMA user_version").fetchone()[0]) == len(schema.MIGRATIONS)
+        columns = db.run(lambda cursor: [row[1] for row in cursor.execute("PRAGMA table_info(incidents)")])
+        assert not set(schema.DETAIL_COLUMNS) & set(columns) and {"ts_epoch", "workload"} <= set(columns)
+        incident = db.run(lambda cursor: cursor.execute("SELECT id, ts_epoch FROM incidents").fetchone())
+        assert incident[1] == 1714558500
+        details = db.run(lambda cursor: cursor.execute("SELECT k8s_context, sample_logs FROM incident_details WHERE incident_id = ?", (incident[0],)).fetchone())
+        assert isinstance(details[0], bytes) and storage.decompress_text(details[0]) == long_context and details[1] == "ERROR short log"
+        assert db.run(lambda cursor: tuple(cursor.execute("SELECT hour, namespace, severity, incident_count FROM hourly_incidents").fetchone())) == (1714557600, "ns", "ERROR", 1)
+        assert db.run(lambda cursor: cursor.execute("SELECT gemini_calls, analysis_cache_hits, triage_hits FROM daily_stats").fetchone()[:]) == (3, 0, 0)
+    finally: db.close()
+
+
+def test_prune_incidents_rolls_old_incidents_into_daily_counts(db):
+    day = 1714521600  # 2024-05-01 00:00 UTC
+    def insert(cursor, ts_epoch, pod_key, severity):
+        cursor.execute("INSERT INTO incidents (timestamp, ts_epoch, pod_key, severity) VALUES ('', ?, ?, ?)", (ts_epoch, pod_key, severity))
+        cursor.execute("INSERT INTO incident_details (incident_id, sample_logs) VALUES (?, 'log')", (cursor.lastrowid,))
+    def seed(cursor):
+        for offset in (0, 60, 120): insert(cursor, day + offset, "ns/api", "ERROR")
+        insert(cursor, day + 30, "ns/api", "WARNING"); insert(cursor, day + 10 * 86400, "ns/api", "ERROR")
+    db.run(seed)
+    assert db.run(lambda cursor: schema.prune_incidents(cursor, day + 86400)) == 4
+    # Lần prune sau cộng dồn vào cùng bucket ngày
+    db.run(lambda cursor: insert(cursor, day + 180, "ns/api", "ERROR"))
+    assert db.run(lambda cursor: schema.prune_incidents(cursor, day + 86400)) == 1
+    rollups = db.run(lambda cursor: [tuple(row) for row in cursor.execute("SELECT date, pod_key, severity, count FROM incident_rollups ORDER BY severity")])
+    assert rollups == [("2024-05-01", "ns/api", "ERROR", 4), ("2024-05-01", "ns/api", "WARNING", 1)]
+    assert db.run(lambda cursor: cursor.execute("SELECT COUNT(*) FROM incidents").fetchone()[0]) == 1
+    assert db.run(lambda cursor: cursor.execute("SELECT COUNT(*) FROM incident_details").fetchone()[0]) == 1
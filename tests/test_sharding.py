@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta, timezone
+
+from fakes import FakeLeaseApi
+from sharding import LeaseCoordinator
+
+KEYS = [f"ns-{i}" for i in range(1000)]
+
+
+class Cluster:
+    """Các replica dùng chung một FakeLeaseApi và một đồng hồ giả."""
+
+    def __init__(self, names=()):
+        self.api = FakeLeaseApi(); self.now = datetime(2024, 1, 1, tzinfo=timezone.utc); self.replicas = {}
+        for name in names: self.join(name)
+
+    def join(self, name):
+        self.replicas[name] = LeaseCoordinator(self.api, "agents", name, lease_duration_seconds=30, clock=lambda: self.now)
+        return self.replicas[name]
+
+    def settle(self, seconds=0):
+        self.now += timedelta(seconds=seconds)
+        for _ in range(2):
+            for coordinator in self.replicas.values(): coordinator.refresh()
+
+    def assignment(self):
+        owners = {key: [name for name, coordinator in self.replicas.items() if coordinator.owns(key)] for key in KEYS}
+        assert all(len(names) == 1 for names in owners.values()), "every key must have exactly one owner"
+        return {key: names[0] for key, names in owners.items()}
+
+
+def test_membership_changes_notify_handlers():
+    cluster = Cluster(["a", "b"]); changes = []
+    cluster.replicas["a"].add_change_handler(lambda old, new: changes.append((old, new)))
+    cluster.settle()
+    assert all(coordinator.members == ("a", "b") for coordinator in cluster.replicas.values())
+    cluster.join("c"); cluster.settle()
+    assert changes[-1] == (("a", "b"), ("a", "b", "c"))
+    cluster.replicas.pop("b").stop(release=True); cluster.settle()
+    assert changes[-1] == (("a", "b", "c"), ("a", "c"))
+    assert cluster.replicas["a"].members == cluster.replicas["c"].members == ("a", "c")
+
+
+def test_join_and_leave_move_about_one_nth_of_keys():
+    cluster = Cluster(["a", "b", "c", "d"]); cluster.settle()
+    before = cluster.assignment()
+    cluster.join("e"); cluster.settle(); after = cluster.assignment()
+    moved = [key for key in KEYS if before[key] != after[key]]
+    # Chỉ các khóa chuyển sang replica mới đổi chủ, khoảng 1/5 tổng số
+    assert all(after[key] == "e" for key in moved)
+    assert len(KEYS) / 5 * 0.5 < len(moved) < len(KEYS) / 5 * 1.5
+    cluster.replicas.pop("b").stop(release=True); cluster.settle(); left = cluster.assignment()
+    moved = [key for key in KEYS if after[key] != left[key]]
+    assert {after[key] for key in moved} == {"b"} and len(moved) == sum(1 for owner in after.values() if owner == "b")
+
+
+def test_owns_turns_false_after_lease_expires_while_api_unavailable():
+    cluster = Cluster(["a"]); cluster.settle(); coordinator = cluster.replicas["a"]
+    assert all(coordinator.owns(key) for key in KEYS)
+    cluster.api.unavailable = True
+    # Chưa hết hạn: giữ nguyên phân chia cũ
+    cluster.settle(20)
+    assert coordinator.active and all(coordinator.owns(key) for key in KEYS)
+    cluster.settle(15)
+    assert not coordinator.active and not any(coordinator.owns(key) for key in KEYS)
+    assert coordinator.stats["renew_errors"] >= 2
+    # API trở lại: replica tự nhận lại shard
+    cluster.api.unavailable = False; cluster.settle()
+    assert all(coordinator.owns(key) for key in KEYS)
@@ -0,0 +1,73 @@
+import threading
+
+import pytest
+
+import storage
+
+
+@pytest.fixture
+def db(tmp_path):
+    commits = []
+    db = storage.Storage(str(tmp_path / "agent.db"), on_commit=lambda seconds, ops: commits.append(ops)).open()
+    db.run(lambda cursor: cursor.execute("CREATE TABLE t (value INTEGER)"))
+    db.commits = commits
+    yield db
+    db.close()
+
+
+def _hold_writer(db):
+    """Chặn luồng writer bằng một thao tác standalone để các thao tác sau dồn lại trong hàng đợi."""
+    release = threading.Event(); started = threading.Event()
+    db.write(lambda cursor: (started.set(), release.wait(5)), transaction=False)
+    assert started.wait(5)
+    return release
+
+
+def _values(db):
+    return [row[0] for row in db.run(lambda cursor: cursor.execute("SELECT value FROM t ORDER BY value").fetchall())]
+
+
+def test_queued_writes_are_committed_as_one_group(db):
+    release = _hold_writer(db); db.commits.clear()
+    futures = [db.write(lambda cursor, i=i: cursor.execute("INSERT INTO t VALUES (?)", (i,))) for i in range(5)]
+    release.set(); db.flush()
+    assert all(future.result(5) is not None for future in futures)
+    assert db.commits[0] == 6  # 5 insert + thao tác flush, trong một transaction
+    assert _values(db) == [0, 1, 2, 3, 4]
+
+
+def test_failing_write_is_rolled_back_without_losing_its_group(db):
+    def insert_then_fail(cursor):
+        cursor.execute("INSERT INTO t VALUES (99)"); raise ValueError("boom")
+
+    release = _hold_writer(db)
+    ok_before = db.write(lambda cursor: cursor.execute("INSERT INTO t VALUES (1)"))
+    failing = db.write(insert_then_fail)
+    ok_after = db.write(lambda cursor: cursor.execute("INSERT INTO t VALUES (2)"))
+    release.set()
+    ok_before.result(5); ok_after.result(5)
+    with pytest.raises(ValueError): failing.result(5)
+    assert _values(db) == [1, 2]
+    assert db.stats["errors"] == 1
+
+
+def test_standalone_write_runs_outside_a_transaction(db):
+    assert db.run(lambda cursor: cursor.connection.in_transaction) is True
+    assert db.run(lambda cursor: cursor.connection.in_transaction, transaction=False) is False
+    db.run(lambda cursor: cursor.execute("PRAGMA incremental_vacuum"), transaction=False)
+
+
+def test_on_commit_error_does_not_kill_the_writer(db):
+    def broken_hook(seconds, ops): raise RuntimeError("hook failed")
+
+    db.on_commit = broken_hook
+    db.run(lambda cursor: cursor.execute("INSERT INTO t VALUES (1)"), timeout=5)
+    db.run(lambda cursor: cursor.execute("INSERT INTO t VALUES (2)"), timeout=5)
+    assert db.run(lambda cursor: cursor.execute("SELECT count(*) FROM t").fetchone()[0], timeout=5) == 2
+
+
+def test_writes_after_close_fail_instead_of_hanging(db):
+    db.close()
+    with pytest.raises(storage.StorageClosedError): db.run(lambda cursor: None, timeout=5)
+    with pytest.raises(storage.StorageClosedError): db.flush(timeout=5)
+    db.close()
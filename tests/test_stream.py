@@ -0,0 +1,72 @@
+import queue
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+
+def write(db_path, *statements):
+    conn = sqlite3.connect(db_path)
+    try:
+        for sql, params in statements: conn.execute(sql, params)
+        conn.commit()
+    finally: conn.close()
+
+
+def add_incident(db_path, pod_key="ns/api"):
+    write(db_path, ("INSERT INTO incidents (timestamp, ts_epoch, pod_key, severity, summary) VALUES ('', 100, ?, 'ERROR', 's')", (pod_key,)))
+    conn = sqlite3.connect(db_path)
+    try: return conn.execute("SELECT MAX(id) FROM incidents").fetchone()[0]
+    finally: conn.close()
+
+
+def test_change_feed_fans_out_polled_events_to_every_subscriber(portal):
+    events = queue.Queue(); events.put([("incidents", {"incidents": [{"id": 1}]}, 1)])
+    def poll():
+        try: return events.get_nowait()
+        except queue.Empty: return []
+    feed = portal.module.ChangeFeed(poll, interval_seconds=0.01)
+    first, second = feed.subscribe(), feed.subscribe()
+    expected = 'event: incidents\nid: 1\ndata: {"incidents": [{"id": 1}]}\n\n'
+    assert first.get(timeout=5) == expected and second.get(timeout=5) == expected
+
+
+def test_change_feed_evicts_slow_subscribers_and_caps_connections(portal):
+    idle = threading.Event()
+    feed = portal.module.ChangeFeed(lambda: idle.wait(5) and [], max_subscribers=2, max_queue=1)
+    fast, slow = feed.subscribe(), feed.subscribe()
+    assert feed.subscribe() is None
+    feed.publish("stats", {"n": 1}); fast.get(timeout=1)
+    feed.publish("stats", {"n": 2})
+    assert slow.closed and not fast.closed
+    # Chỗ của subscriber bị đóng được trả lại
+    assert feed.subscribe() is not None
+    idle.set()
+
+
+def test_change_detector_reports_new_incidents_and_stat_deltas(portal):
+    db_path = portal.db_path; first = add_incident(db_path)
+    detector = portal.module.DatabaseChangeDetector(portal.module.storage.ReadOnlyConnections(db_path))
+    assert detector() == [] and detector.last_id == first  # lần đầu chỉ lấy mốc
+    assert detector() == []  # data_version không đổi: không có sự kiện
+    second = add_incident(db_path, "ns/web"); today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+    write(db_path, ("INSERT INTO daily_stats (date, gemini_calls, incident_count) VALUES (?, 2, 1)", (today,)))
+    events = {event: (data, event_id) for event, data, event_id in detector()}
+    data, event_id = events["incidents"]
+    assert event_id == second and [incident["id"] for incident in data["incidents"]] == [second]
+    assert events["stats"][0]["deltas"] == {today: {"gemini_calls": 2, "incident_count": 1}}
+    write(db_path, ("UPDATE daily_stats SET gemini_calls = 5 WHERE date = ?", (today,)))
+    assert detector() == [("stats", {"daily_stats": [{"date": today, "gemini_calls": 5, "telegram_alerts": 0, "incident_count": 1}],
+                                     "deltas": {today: {"gemini_calls": 3}}}, None)]
+
+
+def test_stream_backfills_incidents_after_last_event_id(portal):
+    seen = add_incident(portal.db_path); missed = [add_incident(portal.db_path), add_incident(portal.db_path)]
+    response = portal.get("/api/stream", headers={"Last-Event-ID": str(seen)}, buffered=False)
+    try:
+        chunks = (chunk.decode("utf-8") for chunk in response.response)
+        assert next(chunks) == "retry: 5000\n\n"
+        backfill = next(chunks)
+        assert f"id: {missed[-1]}\n" in backfill and f'"id": {seen},' not in backfill
+        assert backfill.index(f'"id": {missed[1]},') < backfill.index(f'"id": {missed[0]},')  # mới nhất trước
+    finally: response.close()
+    assert not portal.module.change_feed._subscribers
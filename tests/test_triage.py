@@ -0,0 +1,43 @@
+import json
+
+import pytest
+
+import triage
+from triage import DEFAULT_RULES_FILE, TriageEngine, TriageRule, build_facts
+
+
+def crashloop(exit_code):
+    return {"status": "Running", "container_statuses": {"app": {"restart_count": 9, "waiting_reason": "CrashLoopBackOff", "exit_code": exit_code, "last_reason": "Error"}}}
+
+
+def test_default_rules_resolve_known_failures_and_escalate_the_rest():
+    engine = TriageEngine.from_file(DEFAULT_RULES_FILE)
+    result = engine.evaluate(build_facts("ns/api-0", crashloop(139)))
+    assert result["rule"] == "crashloop-segfault" and result["severity"] == "ERROR" and "ns/api-0" in result["summary"]
+    # Exit code không rõ nguyên nhân: luật khớp nhưng confidence thấp, pod được chuyển cho Gemini
+    assert engine.evaluate(build_facts("ns/api-0", crashloop(1))) is None
+    assert engine.evaluate(build_facts("ns/api-0", {"status": "Running"})) is None
+    assert engine.stats == {"evaluations": 3, "hits": 1, "low_confidence": 1, "misses": 1}
+
+
+def test_invalid_rules_are_rejected():
+    for spec in ({"name": "x", "severity": "BAD", "match": {"phase": "x"}}, {"name": "x", "severity": "ERROR", "match": {"foo": 1}},
+                 {"name": "x", "severity": "ERROR", "match": {"log": "("}}):
+        with pytest.raises(ValueError): TriageRule(spec)
+
+
+def test_yaml_rules_without_pyyaml_fail_clearly(monkeypatch, tmp_path):
+    monkeypatch.setattr(triage, "yaml", None)
+    with pytest.raises(ValueError, match="PyYAML is not installed"): TriageEngine.from_file(DEFAULT_RULES_FILE)
+    # Luật dạng JSON vẫn đọc được
+    path = tmp_path / "rules.json"
+    path.write_text(json.dumps({"rules": [{"name": "oom", "severity": "ERROR", "match": {"container_reason": "OOMKilled"}, "summary": "{pod_key}"}]}))
+    assert [rule.name for rule in TriageEngine.from_file(str(path)).rules] == ["oom"]
+
+
+def test_previous_termination_only_counts_while_the_container_is_down():
+    engine = TriageEngine.from_file(DEFAULT_RULES_FILE)
+    recovered = {"status": "Running", "container_statuses": {"app": {"restart_count": 1, "exit_code": 137, "last_reason": "OOMKilled"}}}
+    assert engine.evaluate(build_facts("ns/api-0", recovered, reasons=["Suspicious logs"])) is None
+    crashing = {"status": "Running", "container_statuses": {"app": {"restart_count": 4, "waiting_reason": "CrashLoopBackOff", "exit_code": 137, "last_reason": "OOMKilled"}}}
+    assert engine.evaluate(build_facts("ns/api-0", crashing))["rule"] == "oom-killed"
@@ -0,0 +1,75 @@
+from kubernetes import client
+from kubernetes.client.exceptions import ApiException
+
+from logbatch import LogBatch
+from workloads import WorkloadResolver, format_workload_context, group_by_workload
+
+
+def owner(kind, name, controller=True):
+    return client.V1OwnerReference(api_version="apps/v1", kind=kind, name=name, uid=name, controller=controller)
+
+
+class FakeAppsApi:
+    def __init__(self, replica_sets):
+        self.replica_sets = replica_sets; self.reads = 0
+
+    def read_namespaced_replica_set(self, name, namespace):
+        self.reads += 1
+        if name not in self.replica_sets: raise ApiException(status=404, reason="Not Found")
+        return client.V1ReplicaSet(metadata=client.V1ObjectMeta(name=name, namespace=namespace, owner_references=self.replica_sets[name]),
+                                  spec=client.V1ReplicaSetSpec(selector=client.V1LabelSelector()))
+
+
+def make_resolver(pod_owners, replica_sets):
+    def fetch_pod(namespace, name):
+        if name not in pod_owners: return None
+        return client.V1Pod(metadata=client.V1ObjectMeta(name=name, namespace=namespace, owner_references=pod_owners[name]))
+    apps = FakeAppsApi(replica_sets)
+    return WorkloadResolver(apps, fetch_pod), apps
+
+
+def test_resolver_maps_replicasets_to_deployments_and_caches_them():
+    resolver, apps = make_resolver(
+        {"api-7d9f-a": [owner("ReplicaSet", "api-7d9f")], "api-7d9f-b": [owner("ReplicaSet", "api-7d9f")], "db-0": [owner("StatefulSet", "db")],
+         "bare": [], "rs-only-x": [owner("ReplicaSet", "rs-only")], "gone-rs-x": [owner("ReplicaSet", "gone-rs")],
+         "custom": [owner("Rollout", "custom")], "two-owners": [owner("Job", "ignored", controller=False), owner("DaemonSet", "agent")]},
+        {"api-7d9f": [owner("Deployment", "api")], "rs-only": []})
+    assert resolver.resolve("ns", "api-7d9f-a") == ("Deployment", "api") and resolver.resolve("ns", "api-7d9f-b") == ("Deployment", "api")
+    assert apps.reads == 1
+    assert resolver.resolve("ns", "db-0") == ("StatefulSet", "db")
+    assert resolver.resolve("ns", "two-owners") == ("DaemonSet", "agent")
+    assert resolver.resolve("ns", "rs-only-x") == ("ReplicaSet", "rs-only")
+    assert resolver.resolve("ns", "gone-rs-x") == ("ReplicaSet", "gone-rs")
+    for pod_name in ("bare", "custom", "missing"): assert resolver.resolve("ns", pod_name) == ("Pod", pod_name)
+
+
+def logs(count):
+    batch = LogBatch(); label_id = batch.add_labels({"pod": "x"})
+    for i in range(count): batch.append(i, f"ERROR {i}", label_id)
+    return batch
+
+
+def test_group_by_workload_picks_the_noisiest_pod_as_representative():
+    resolver, _ = make_resolver({"api-7d9f-a": [owner("ReplicaSet", "api-7d9f")], "api-7d9f-b": [owner("ReplicaSet", "api-7d9f")],
+                                 "api-7d9f-c": [owner("ReplicaSet", "api-7d9f")], "solo": []}, {"api-7d9f": [owner("Deployment", "api")]})
+    pods = {"ns/api-7d9f-a": {"reason": ["K8s: CrashLoopBackOff"], "logs": logs(1)},
+            "ns/api-7d9f-b": {"reason": ["K8s: CrashLoopBackOff", "Loki: ERROR"], "logs": logs(3)},
+            "ns/api-7d9f-c": {"reason": ["K8s: CrashLoopBackOff", "Loki: ERROR"], "logs": logs(3)},
+            "ns/solo": {"reason": ["K8s: OOMKilled"], "logs": logs(0)}}
+    groups = group_by_workload(pods, resolver)
+    assert sorted(groups) == ["ns/Deployment/api", "ns/solo"]
+    api = groups["ns/Deployment/api"]
+    # Hòa về số log và số lý do: chọn theo tên pod để kết quả ổn định
+    assert api["representative"] == "ns/api-7d9f-b" and api["pods"] == ["ns/api-7d9f-a", "ns/api-7d9f-b", "ns/api-7d9f-c"]
+    assert api["reason"] == ["K8s: CrashLoopBackOff (x3 pod)", "Loki: ERROR (x2 pod)"] and len(api["logs"]) == 7
+    assert groups["ns/solo"]["representative"] == "ns/solo" and groups["ns/solo"]["kind"] == "Pod"
+    assert "3 pod đang gặp sự cố, pod đại diện: ns/api-7d9f-b" in format_workload_context(api)
+    assert format_workload_context(groups["ns/solo"]) == ""
+
+
+def test_group_by_workload_falls_back_to_the_pod_when_resolution_fails():
+    class BrokenResolver:
+        def resolve(self, namespace, pod_name): raise RuntimeError("api down")
+
+    groups = group_by_workload({"ns/api-0": {"reason": ["K8s: x"], "logs": logs(1)}}, BrokenResolver())
+    assert list(groups) == ["ns/api-0"] and groups["ns/api-0"]["representative"] == "ns/api-0"